@@ -1,8 +1,16 @@
 from trapdata.settings import read_settings
 from trapdata.db import check_db
+from trapdata.db.base import configure_sqlite
 
 
 settings = read_settings()
+configure_sqlite(
+    journal_mode=settings.sqlite_journal_mode,
+    synchronous=settings.sqlite_synchronous,
+    mmap_size_mb=settings.sqlite_mmap_size_mb,
+    cache_size_mb=settings.sqlite_cache_size_mb,
+    busy_timeout=settings.sqlite_busy_timeout,
+)
 check_db(settings.database_url, create=True, update=True)
 
 
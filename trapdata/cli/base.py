@@ -1,6 +1,10 @@
+import multiprocessing
+
 import typer
 
-from trapdata.cli import export, shell, test, show
+from trapdata.cli import collector, export, settings, shell, test, show
+from trapdata.pipeline import POLL_INTERVAL, start_pipeline
+from trapdata.settings import settings_to_config
 
 
 cli = typer.Typer(no_args_is_help=True)
@@ -8,6 +12,48 @@ cli.add_typer(export.cli, name="export", help="Export data in various formats")
 cli.add_typer(shell.cli, name="shell", help="Open an interactive shell")
 cli.add_typer(test.cli, name="test", help="Run tests")
 cli.add_typer(show.cli, name="show", help="Show data for use in other commands")
+cli.command(name="collect")(collector.collect)
+
+
+@cli.command()
+def run(
+    watch: bool = typer.Option(
+        False, help="Keep running and process new images as soon as they are queued"
+    ),
+    interval: float = typer.Option(
+        POLL_INTERVAL, help="Seconds between checks of an empty queue while watching"
+    ),
+    single: bool = typer.Option(
+        False, help="Load images in the main process instead of in workers"
+    ),
+):
+    """
+    Process the images in the queue with the models chosen in the settings.
+
+    With --watch, wait for more images once the queue is empty, e.g. the ones
+    queued by `ami collect --watch --queue`, until the command is interrupted.
+    """
+    required = [
+        "image_base_path",
+        "user_data_path",
+        "localization_model",
+        "binary_classification_model",
+        "taxon_classification_model",
+    ]
+    missing = [name for name in required if not getattr(settings, name)]
+    if missing:
+        raise typer.BadParameter(f"Settings that must be set: {', '.join(missing)}")
+
+    # Shared with the dataloader workers
+    stop_polling = multiprocessing.Event() if watch else None
+    start_pipeline(
+        settings.database_url,
+        settings.image_base_path,
+        settings_to_config(settings),
+        single=single,
+        stop_polling=stop_polling,
+        poll_interval=interval,
+    )
 
 
 @cli.command()
@@ -1,71 +1,149 @@
-# @TODO this needs to be converted to typer
-import argparse
+import pathlib
+from typing import Optional
 
-from trapdata import logger
-from trapdata.common.filemanagement import find_images
+import typer
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
 
+from trapdata import logger
+from trapdata.cli import settings
+from trapdata.common.filemanagement import scan_images, SCAN_WORKERS, TimestampSource
+from trapdata.db.models.scans import (
+    DeploymentWatcher,
+    rescan_deployment,
+    WATCH_INTERVAL,
+)
 from trapdata.ml.utils import StopWatch
 
 
-parser = argparse.ArgumentParser(description="Scan and add trap images to database")
-parser.add_argument(
-    "directory",
-    help="Path to directory of trap images to scan",
-)
-parser.add_argument(
-    "--max-num",
-    type=int,
-    nargs="?",
-    help="Stop after finding N number of images",
-)
-parser.add_argument(
-    "--queue",
-    action="store_const",
-    const=True,
-    default=False,
-    help="Automatically add all images to the process queue",
-)
-parser.add_argument(
-    "--count-only",
-    action="store_const",
-    const=True,
-    default=False,
-    help="Just count the number of images found",
-)
-parser.add_argument(
-    "--watch",
-    action="store_const",
-    const=True,
-    default=False,
-    help="Keep collector running and watch for new images",
-)
+def scan_with_progress(path, workers=SCAN_WORKERS, **kwargs):
+    """
+    Scan a directory for images while showing how many have been found.
+    """
+    columns = [
+        SpinnerColumn(),
+        TextColumn("{task.description}"),
+        TextColumn("{task.completed} images"),
+        TimeElapsedColumn(),
+    ]
+    with Progress(*columns, transient=True) as progress:
+        task = progress.add_task(f"Scanning {path}", total=None)
+        for image in scan_images(path, workers=workers, **kwargs):
+            progress.advance(task)
+            yield image
 
 
-def collect_images(path, max_num=None):
+def collect_images(
+    path, max_num=None, workers=SCAN_WORKERS, timestamps=TimestampSource.exif
+):
     images = []
     with StopWatch() as t:
-        for i, f in enumerate(find_images(path)):
+        for f in scan_with_progress(
+            path, workers=workers, ordered=False, timestamps=timestamps
+        ):
             # logger.debug(f'Found {f["path"].name} from {f["timestamp"].strftime("%c")}')
             images.append(f)
-            if max_num and i + 1 >= max_num:
+            if max_num and len(images) >= max_num:
                 break
 
-    logger.info(f"Total images: {i+1}")
+    logger.info(f"Total images: {len(images)}")
     logger.info(t)
     return images
 
 
-def count_images(path):
+def count_images(path, workers=SCAN_WORKERS):
     with StopWatch() as t:
-        count = sum(1 for _ in find_images(path, include_timestamps=False))
+        count = sum(
+            1
+            for _ in scan_with_progress(
+                path, workers=workers, include_timestamps=False, ordered=False
+            )
+        )
     logger.info(f"Total images: {count}")
     logger.info(t)
 
 
+def collect(
+    directory: Optional[pathlib.Path] = typer.Argument(
+        None,
+        help="Directory of trap images to scan, defaults to the image_base_path setting",
+    ),
+    watch: bool = typer.Option(
+        False, help="Keep running and save new images as soon as they are added"
+    ),
+    queue: bool = typer.Option(
+        False, help="Add the new images to the processing queue"
+    ),
+    full: bool = typer.Option(
+        False, help="Read every image again, not only new or changed files"
+    ),
+    timestamps: TimestampSource = typer.Option(
+        settings.image_timestamps,
+        help="Read the timestamps of images from their EXIF tags or their filenames",
+    ),
+    interval: float = typer.Option(
+        WATCH_INTERVAL, help="Seconds between scans of a watched directory"
+    ),
+    workers: int = typer.Option(
+        SCAN_WORKERS, help="Number of threads reading images at once"
+    ),
+    hashes: bool = typer.Option(
+        True,
+        help="Hash the contents of new images, to find copies of saved images "
+        "and files that were replaced",
+    ),
+    count_only: bool = typer.Option(
+        False, help="Just count the number of images found"
+    ),
+    max_num: Optional[int] = typer.Option(
+        None, help="Only find the first N images, without saving them"
+    ),
+):
+    """
+    Save the images in a directory to the database, in the monitoring session
+    of each night. Only the images that were added or changed since the last
+    scan are read.
+
+    With --watch, the directory is scanned again whenever images are added,
+    until the command is interrupted.
+    """
+    directory = directory or settings.image_base_path
+    if not directory:
+        raise typer.BadParameter("No directory given and no image_base_path set")
+
+    if count_only:
+        count_images(directory, workers=workers)
+        return
+    if max_num:
+        collect_images(directory, max_num, workers=workers, timestamps=timestamps)
+        return
+
+    with StopWatch() as t:
+        rescan_deployment(
+            settings.database_url,
+            directory,
+            full=full,
+            timestamps=timestamps,
+            queue=queue,
+            workers=workers,
+            hashes=hashes,
+        )
+    logger.info(t)
+
+    if watch:
+        watcher = DeploymentWatcher(
+            settings.database_url,
+            directory,
+            interval=interval,
+            timestamps=timestamps,
+            queue=queue,
+            hashes=hashes,
+        )
+        try:
+            # The directory was just scanned
+            watcher.run(scan_first=False)
+        except KeyboardInterrupt:
+            logger.info(f"Stopped watching {directory}")
+
+
 if __name__ == "__main__":
-    args = parser.parse_args()
-    logger.debug(args)
-    if args.count_only:
-        count_images(args.directory)
-    else:
-        collect_images(args.directory, max_num=args.max_num)
+    typer.run(collect)
@@ -1,59 +1,53 @@
 import sys
-import enum
 import pathlib
-import csv
-from typing import Optional, Union
+from typing import Optional, Iterable, Any
 
 import typer
 from rich import print
 import pandas as pd
 
-from trapdata.db.models.detections import get_detected_objects
+from trapdata.db.models.detections import iter_detection_reports
 from trapdata.db.models.events import get_monitoring_sessions_from_db
 from trapdata import logger
 from trapdata.cli import settings
+from trapdata.common.utils import ExportFormat, write_records, write_report
+from trapdata.db.parquet import export_detections_parquet, export_events_parquet
 
 
 cli = typer.Typer(no_args_is_help=True)
 
 
-class ExportFormat(str, enum.Enum):
-    json = "json"
-    html = "html"
-    csv = "csv"
-
-
 def export(
-    df: pd.DataFrame,
+    records: Iterable[dict[str, Any]],
     format: ExportFormat = ExportFormat.json,
     outfile: Optional[pathlib.Path] = None,
-) -> Union[str, None]:
-    if format is ExportFormat.json:
-        output = df.to_json(
-            path_or_buf=outfile,
-            orient="records",
-            indent=2,
-            date_format="iso",
-            default_handler=str,
-        )
-    elif format is ExportFormat.csv:
-        output = df.to_csv(
-            path_or_buf=outfile,
-            quoting=csv.QUOTE_NONNUMERIC,
-            index=False,
-        )
-    else:
-        export_method = getattr(df, f"to_{format}")
-        output = export_method(path_or_buf=outfile, index=False)
-    if outfile:
-        return str(outfile.absolute())
-    else:
+) -> Optional[str]:
+    """
+    Write the records to `outfile` one at a time, or to stdout if there is no
+    outfile. An outfile ending in ".gz" is compressed with gzip. The outfile
+    is written even if there are no records.
+    """
+    if format is ExportFormat.html:
+        # HTML tables are only made by pandas, which needs every record at once
+        df = pd.DataFrame(records)
+        output = df.to_html(buf=outfile, index=False)
+        if outfile:
+            return str(outfile.absolute())
         if output:
-            # @TODO write the output to stdout without other log messages
-            # sys.stdin.write(str(output))
             print(output)
         return output
 
+    if outfile:
+        num_records = write_report(records, outfile, format=format, skip_empty=False)
+        if num_records:
+            logger.info(f"Exported {num_records} records to {outfile}")
+        else:
+            logger.warn(f"No records to export, wrote an empty report to {outfile}")
+        return str(outfile.absolute())
+    else:
+        # @TODO write the output to stdout without other log messages
+        write_records(records, sys.stdout, format=format)
+
 
 @cli.command()
 def detections(
@@ -65,16 +59,28 @@ def detections(
 ) -> Optional[str]:
     """
     Export detected objects from database in the specified format.
+
+    Parquet files are written to the `outfile` directory, in one partition for
+    each deployment and night. Only the nights that changed are written again.
     """
-    objects = get_detected_objects(
+    if format is ExportFormat.parquet:
+        if not outfile:
+            raise typer.BadParameter("A directory is required for Parquet exports")
+        export_detections_parquet(
+            settings.database_url,
+            outfile,
+            base_directory=settings.image_base_path,
+        )
+        return str(outfile.absolute())
+
+    records = iter_detection_reports(
         settings.database_url,
         limit=limit,
         offset=offset,
         image_base_path=settings.image_base_path,
     )
-    logger.info(f"Preparing to export {len(objects)} records as {format}")
-    df = pd.DataFrame([obj.report_data() for obj in objects])
-    return export(df=df, format=format, outfile=outfile)
+    logger.info(f"Preparing to export records as {format}")
+    return export(records=records, format=format, outfile=outfile)
 
 
 @cli.command()
@@ -85,11 +91,21 @@ def events(
     """
     Export a summary of monitoring sessions from database in the specified format.
     """
+    if format is ExportFormat.parquet:
+        if not outfile:
+            raise typer.BadParameter("A directory is required for Parquet exports")
+        export_events_parquet(
+            settings.database_url,
+            outfile,
+            base_directory=settings.image_base_path,
+        )
+        return str(outfile.absolute())
+
     objects = get_monitoring_sessions_from_db(
         db_path=settings.database_url, base_directory=settings.image_base_path
     )
-    df = pd.DataFrame([obj.report_data() for obj in objects])
-    return export(df=df, format=format, outfile=outfile)
+    records = (obj.report_data() for obj in objects)
+    return export(records=records, format=format, outfile=outfile)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ from sqlalchemy import select, func
 from trapdata.db.base import get_session_class
 from trapdata.cli import settings
 from trapdata.db import models
+from trapdata.db.models.deployments import normalize_base_directory
 from trapdata import logger
 
 cli = typer.Typer(no_args_is_help=True)
@@ -25,21 +26,26 @@ def show_settings():
 @cli.command()
 def deployments():
     """
-    List all image base directories that have been scanned.
-    A proxy for "registered trap deployments".
+    List all trap deployments, the image base directories that have been scanned.
     """
     Session = get_session_class(settings.database_url)
     session = Session()
     deployments = session.execute(
         select(
-            models.MonitoringSession.base_directory,
+            models.Deployment.name,
+            models.Deployment.base_directory,
             func.count(models.MonitoringSession.id),
             func.sum(models.MonitoringSession.num_images),
             func.sum(models.MonitoringSession.num_detected_objects),
-        ).group_by(models.MonitoringSession.base_directory)
+        )
+        .join(
+            models.MonitoringSession,
+            models.MonitoringSession.deployment_id == models.Deployment.id,
+        )
+        .group_by(models.Deployment.id)
     ).all()
 
-    table = Table("Image Base Path", "Events", "Images", "Objects")
+    table = Table("Name", "Image Base Path", "Events", "Images", "Objects")
     for deployment in deployments:
         row_values = [str(field) for field in deployment._mapping.values()]
         table.add_row(*row_values)
@@ -54,8 +60,7 @@ def events():
     """
     Session = get_session_class(settings.database_url)
     session = Session()
-    # image_base_path = str(settings.image_base_path.resolve())
-    image_base_path = str(settings.image_base_path)
+    image_base_path = normalize_base_directory(settings.image_base_path)
     logger.info(f"Show monitoring events for images in {image_base_path}")
     events = (
         session.execute(
@@ -3,7 +3,19 @@ from rich import print
 
 
 from trapdata.cli import settings
-from trapdata.tests import test_pipeline
+from trapdata.tests import (
+    test_pipeline,
+    test_queue,
+    test_monitoring_sessions,
+    test_export,
+    test_query_plans,
+    test_db_base,
+    test_writer,
+    test_exif,
+    test_streaming,
+    test_ml_utils,
+    benchmarks,
+)
 from trapdata.db.base import check_db
 
 cli = typer.Typer(no_args_is_help=True)
@@ -19,6 +31,59 @@ def pipeline():
     test_pipeline.run()
 
 
+@cli.command()
+def queue():
+    test_queue.run()
+
+
+@cli.command()
+def sessions():
+    test_monitoring_sessions.run()
+
+
+@cli.command()
+def export():
+    test_export.run()
+
+
+@cli.command()
+def query_plans():
+    test_query_plans.run()
+
+
+@cli.command()
+def db_base():
+    test_db_base.run()
+
+
+@cli.command()
+def writer():
+    test_writer.run()
+
+
+@cli.command()
+def exif():
+    test_exif.run()
+
+
+@cli.command()
+def streaming():
+    test_streaming.run()
+
+
+@cli.command()
+def ml_utils():
+    test_ml_utils.run()
+
+
+@cli.command()
+def benchmark(name: str):
+    """
+    Run one of the benchmarks in `trapdata.tests.benchmarks`
+    """
+    print(benchmarks.run(name))
+
+
 @cli.command()
 def database():
     return check_db(db_path=settings.database_url, create=True, quiet=False)
@@ -1,12 +1,18 @@
-from typing import Union, Literal, Optional
+from typing import Any, Iterable, Iterator, Union, Literal, Optional
 import pathlib
 import datetime
 import time
 import collections
+import concurrent.futures
+import enum
+import functools
+import heapq
+import pickle
 import dateutil.parser
 import os
 import math
 import re
+import struct
 import hashlib
 import tempfile
 
@@ -64,18 +70,11 @@ def find_timestamped_folders(path):
     logger.debug("Looking for nightly timestamped folders")
     nights = collections.OrderedDict()
 
-    def _preprocess(name):
-        return name.replace("_", "-")
-
     dirs = sorted(list(pathlib.Path(path).iterdir()))
     for d in dirs:
-        # @TODO use yield?
-        try:
-            date = dateutil.parser.parse(_preprocess(d.name))
-        except Exception:
-            # except dateutil.parser.ParserError:
-            pass
-        else:
+        date = parse_folder_date(d.name)
+        if date and d.is_dir():
+            date = datetime.datetime.combine(date, datetime.time())
             logger.debug(f"Found nightly folder for {date}: {d}")
             nights[date] = d
 
@@ -176,12 +175,584 @@ def get_image_timestamp_with_timezone(img_path, default_offset="+0"):
     return date
 
 
+# EXIF tags in the first IFD of an image that are read by `read_jpeg_header`
+EXIF_TAGS = {0x0132: "DateTime", 0x882A: "TimeZoneOffset"}
+# Sizes of the EXIF types of those tags: ASCII, SHORT and SSHORT
+EXIF_TYPES = {2: "s", 3: "H", 8: "h"}
+# JPEG markers of the frame header, which has the dimensions of the image
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def parse_exif_tags(data: bytes) -> dict[str, Any]:
+    """
+    Parse the tags in `EXIF_TAGS` from the TIFF structure of an APP1 segment.
+    """
+    byte_order = {b"II": "<", b"MM": ">"}[data[:2]]
+    (ifd_offset,) = struct.unpack_from(byte_order + "I", data, 4)
+    (num_entries,) = struct.unpack_from(byte_order + "H", data, ifd_offset)
+    tags = {}
+    for i in range(num_entries):
+        tag, type_, count, value = struct.unpack_from(
+            byte_order + "HHI4s", data, ifd_offset + 2 + i * 12
+        )
+        if tag not in EXIF_TAGS or type_ not in EXIF_TYPES:
+            continue
+        fmt = f"{byte_order}{count}{EXIF_TYPES[type_]}"
+        if struct.calcsize(fmt) > 4:
+            (value_offset,) = struct.unpack(byte_order + "I", value)
+            values = struct.unpack_from(fmt, data, value_offset)
+        else:
+            values = struct.unpack_from(fmt, value)
+        if type_ == 2:
+            value = values[0].split(b"\0")[0].decode("ascii", "replace")
+        else:
+            # The offset may also have the hours of the modified time
+            value = values[0]
+        tags[EXIF_TAGS[tag]] = value
+    return tags
+
+
+def read_jpeg_header(img_path) -> tuple[dict[str, Any], int, int]:
+    """
+    Read the EXIF date tags and the dimensions of a JPEG image from the
+    segments before its image data, without decoding it. Usually only the
+    first few KB of the file are read.
+
+    Returns the tags, width and height. Raises a ValueError if the file is not
+    a JPEG or has no frame header.
+    """
+    tags = {}
+    with open(img_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            raise ValueError(f"Not a JPEG image: {img_path}")
+        while True:
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF:
+                raise ValueError(f"No frame header in JPEG image: {img_path}")
+            code = marker[1]
+            (length,) = struct.unpack(">H", marker[2:])
+            if code in JPEG_SOF_MARKERS:
+                _, height, width = struct.unpack(">BHH", f.read(5))
+                return tags, width, height
+            elif code == 0xDA:
+                # The image data starts before a frame header
+                raise ValueError(f"No frame header in JPEG image: {img_path}")
+            elif code == 0xE1 and not tags:
+                data = f.read(length - 2)
+                if data.startswith(b"Exif\0\0"):
+                    tags = parse_exif_tags(data[6:])
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+
+
+def parse_exif_datetime(datestring: str, offset=None) -> datetime.datetime:
+    """
+    Parse an EXIF date like "2022:06:01 22:00:00", with a timezone offset in
+    hours like "-4". Dates in other formats are parsed by dateutil, like
+    `get_image_timestamp_with_timezone` does.
+    """
+    try:
+        date = datetime.datetime.strptime(datestring, EXIF_DATETIME_STR_FORMAT)
+    except ValueError:
+        date = None
+    if date and offset is None:
+        return date
+    elif date:
+        tz = datetime.timezone(datetime.timedelta(hours=int(offset)))
+        return date.replace(tzinfo=tz)
+    datestring = datestring.replace(":", "-", 2)
+    if offset is not None:
+        offset = f"+{offset}" if int(offset) > 0 else offset
+        datestring = f"{datestring} {offset}"
+    return dateutil.parser.parse(datestring)
+
+
+def read_image_metadata(img_path, default_offset="+0") -> dict[str, Any]:
+    """
+    Return the timestamp, width and height of an image, reading as little of
+    the file as possible. The timestamp is None if the image has no DateTime
+    tag. Images that are not JPEGs are opened with PIL.
+    """
+    try:
+        tags, width, height = read_jpeg_header(img_path)
+    except (ValueError, KeyError, struct.error):
+        image = PIL.Image.open(img_path)
+        tags, (width, height) = get_exif(img_path), image.size
+    timestamp = None
+    if tags.get("DateTime"):
+        offset = tags.get("TimeZoneOffset") or default_offset
+        timestamp = parse_exif_datetime(tags["DateTime"], offset)
+    return {"timestamp": timestamp, "width": width, "height": height}
+
+
+# Threads that list directories and read the timestamps of images. Most of
+# the time is spent waiting for the disk, which may be a network mount.
+SCAN_WORKERS = 8
+
+
+class TimestampSource(str, enum.Enum):
+    """
+    Where the timestamps of images are read from when scanning a directory.
+
+    `filename` parses the timestamp in the name of each file, like
+    "20220810232637-00-16.jpg". Only the first image of each directory is
+    read, to get the timezone offset from its EXIF tags and check that they
+    have the same time as its name. The other images get the dimensions of
+    the first one, if the last image of the directory has the same dimensions
+    too, otherwise each one is read. Images in nightly folders, named by their
+    date like "2022_05_14", are grouped by folder instead of by the gaps
+    between them.
+    """
+
+    exif = "exif"
+    filename = "filename"
+
+
+# Timestamps in the names of image files. The groups of each pattern are
+# joined and parsed with FILENAME_TIMESTAMP_FORMAT.
+FILENAME_TIMESTAMP_PATTERNS = [
+    # 20220810232637-00-16.jpg, 84-20220916202959-snapshot.jpg
+    re.compile(r"(?<!\d)(\d{14})(?!\d)"),
+    # 20220810_232637.jpg, 20220810-232637.jpg
+    re.compile(r"(?<!\d)(\d{8})[_T-](\d{6})(?!\d)"),
+    # 2022-08-10_23-26-37.jpg
+    re.compile(
+        r"(?<!\d)(\d{4})[-_](\d{2})[-_](\d{2})[_T ](\d{2})[-_:](\d{2})[-_:](\d{2})(?!\d)"
+    ),
+]
+FILENAME_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+# Nightly folders, like 2022_05_14, 2022-05-14 or 20220514
+FOLDER_DATE_PATTERN = re.compile(r"^(\d{4})[-_]?(\d{2})[-_]?(\d{2})$")
+
+# How far the timestamp in the name of a file may be from its EXIF tags
+FILENAME_TIMESTAMP_TOLERANCE = datetime.timedelta(seconds=2)
+
+
+def parse_filename_timestamp(name: str) -> Optional[datetime.datetime]:
+    """
+    Return the timestamp in the name of an image file, without a timezone,
+    or None if it doesn't have one.
+    """
+    for pattern in FILENAME_TIMESTAMP_PATTERNS:
+        for match in pattern.finditer(name):
+            try:
+                return datetime.datetime.strptime(
+                    "".join(match.groups()), FILENAME_TIMESTAMP_FORMAT
+                )
+            except ValueError:
+                continue
+    return None
+
+
+def parse_folder_date(name: str) -> Optional[datetime.date]:
+    """
+    Return the date of a nightly folder, or None if its name is not a date.
+    """
+    match = FOLDER_DATE_PATTERN.match(name)
+    if match:
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return None
+
+
+def get_folder_date(base_directory, path) -> Optional[datetime.date]:
+    """
+    Return the date of the first nightly folder an image is in, below the
+    base directory.
+    """
+    relative_path = pathlib.Path(path).relative_to(base_directory)
+    for name in relative_path.parts[:-1]:
+        date = parse_folder_date(name)
+        if date:
+            return date
+    return None
+
+
+def is_image(name: str) -> bool:
+    return name.lower().endswith(constants.SUPPORTED_IMAGE_EXTENSIONS)
+
+
+def scan_directory(directory) -> tuple[list[os.DirEntry], list[str]]:
+    """
+    List the image files and the subdirectories of a directory, in order of
+    their names.
+    """
+    images = []
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif is_image(entry.name) and entry.is_file():
+                images.append(entry)
+    images.sort(key=lambda entry: entry.name)
+    return images, sorted(subdirectories)
+
+
+def list_images(directory) -> list[os.DirEntry]:
+    """
+    List the image files in a directory and all of its subdirectories.
+    """
+    images, subdirectories = scan_directory(directory)
+    for subdirectory in subdirectories:
+        images.extend(list_images(subdirectory))
+    return images
+
+
+def read_image(entry: os.DirEntry, include_timestamps=True, skip_bad_exif=True):
+    """
+    Return the path, size, timestamp and dimensions of an image found by
+    `list_images`, or None if its timestamp can't be read and `skip_bad_exif`
+    is set.
+    """
+    path = pathlib.Path(entry.path)
+    image = {"path": path, "timestamp": None, "filesize": entry.stat().st_size}
+    if include_timestamps:
+        try:
+            image |= read_image_metadata(path)
+            if not image["timestamp"]:
+                raise KeyError("DateTime")
+        except Exception as e:
+            logger.error(f"Could not get EXIF date for image: {path}\n {e}")
+            if skip_bad_exif:
+                return None
+    return image
+
+
+def read_timestamps_from_names(
+    entries: list[os.DirEntry], skip_bad_exif=True
+) -> list[dict]:
+    """
+    Read the timestamps of the images in one directory from their names. See
+    `TimestampSource.filename`. If the name of the first image does not match
+    its EXIF tags, every image is read like `read_image`. So are images whose
+    names have no timestamp.
+
+    The dimensions of the images that were not read are copied from the
+    first image that was, if the last image has the same dimensions.
+    """
+    images = []
+    without_offset = []
+    tzinfo = None
+    use_exif = False
+    for entry in entries:
+        timestamp = None if use_exif else parse_filename_timestamp(entry.name)
+        if timestamp and tzinfo:
+            images.append(
+                {
+                    "path": pathlib.Path(entry.path),
+                    "timestamp": timestamp.replace(tzinfo=tzinfo),
+                    "filesize": entry.stat().st_size,
+                }
+            )
+            continue
+
+        image = read_image(entry, skip_bad_exif=skip_bad_exif and not timestamp)
+        if not image:
+            continue
+        elif timestamp and not image["timestamp"]:
+            # Wait for the offset of another image in the directory
+            image["timestamp"] = timestamp
+            without_offset.append(image)
+        elif timestamp:
+            difference = abs(image["timestamp"].replace(tzinfo=None) - timestamp)
+            if difference > FILENAME_TIMESTAMP_TOLERANCE:
+                logger.warn(
+                    f"The timestamp in the name of {entry.path} does not match its "
+                    f"EXIF date ({image['timestamp']}), reading the EXIF date of "
+                    f"every image in the same directory"
+                )
+                use_exif = True
+            else:
+                tzinfo = image["timestamp"].tzinfo
+        images.append(image)
+
+    # The same default offset as `read_image_metadata`
+    tzinfo = tzinfo or datetime.timezone.utc
+    for image in without_offset:
+        image["timestamp"] = image["timestamp"].replace(tzinfo=tzinfo)
+
+    unread = [image for image in images if "width" not in image]
+    if unread:
+        # A camera usually takes every image of a night with the same settings
+        size = next(
+            ((image["width"], image["height"]) for image in images if "width" in image),
+            None,
+        )
+        if size and get_image_size(unread[-1]["path"]) != size:
+            logger.warn(
+                f"The images in {os.path.dirname(unread[-1]['path'])} have "
+                f"different dimensions, reading the dimensions of each one"
+            )
+            size = None
+        for image in unread:
+            image["width"], image["height"] = size or get_image_size(image["path"])
+    return images
+
+
+def get_image_size(img_path) -> tuple[Optional[int], Optional[int]]:
+    """
+    Return the width and height of an image, or None if it can't be read.
+    """
+    try:
+        metadata = read_image_metadata(img_path)
+    except Exception as e:
+        logger.error(f"Could not read the dimensions of image: {img_path}\n {e}")
+        return None, None
+    return metadata["width"], metadata["height"]
+
+
+def scan_folder_timestamps(directory, skip_bad_exif=True) -> list[dict]:
+    """
+    Find the images in a directory and all of its subdirectories, and read
+    their timestamps from their names.
+    """
+    return read_timestamps_from_names(list_images(directory), skip_bad_exif)
+
+
+def map_bounded(pool, func, items, max_pending, ordered=True):
+    """
+    Like `pool.map`, but only submits `max_pending` items at a time, so a
+    large or endless iterable is not read all at once. Results are yielded
+    in the order of the items, or as soon as they are ready if not `ordered`.
+    """
+    pending = collections.deque() if ordered else set()
+    for item in items:
+        if len(pending) >= max_pending:
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield future.result()
+        future = pool.submit(func, item)
+        if ordered:
+            pending.append(future)
+        else:
+            pending.add(future)
+    if ordered:
+        for future in pending:
+            yield future.result()
+    else:
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def scan_images(
+    base_directory,
+    include_timestamps=True,
+    skip_bad_exif=True,
+    ordered=True,
+    workers: int = SCAN_WORKERS,
+    timestamps: TimestampSource = TimestampSource.exif,
+) -> Iterator[dict]:
+    """
+    Find the images in a directory and read their timestamps with a pool of
+    threads. Each subdirectory (usually one per night) is listed by its own
+    thread, and the images are read while the others are still being listed.
+    With `TimestampSource.filename`, each subdirectory is also read by the
+    thread that listed it.
+
+    Yields the same dicts as `find_images`, plus the size of each file, sorted
+    by directory and name. Set `ordered=False` to get each image as soon as
+    it has been read instead.
+    """
+    logger.info(f"Scanning '{base_directory}' for images with {workers} threads")
+    base_directory = pathlib.Path(base_directory)
+    if not base_directory.exists():
+        raise Exception(f"Directory does not exist: {base_directory}")
+
+    images, subdirectories = scan_directory(base_directory)
+    read = functools.partial(
+        read_image,
+        include_timestamps=include_timestamps,
+        skip_bad_exif=skip_bad_exif,
+    )
+
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="Image Scanner"
+    )
+    try:
+        if include_timestamps and timestamps == TimestampSource.filename:
+            folders = [
+                pool.submit(read_timestamps_from_names, images, skip_bad_exif)
+            ] + [
+                pool.submit(scan_folder_timestamps, path, skip_bad_exif)
+                for path in subdirectories
+            ]
+            if not ordered:
+                folders = concurrent.futures.as_completed(folders)
+            for folder in folders:
+                yield from folder.result()
+            return
+
+        listings = [pool.submit(list_images, path) for path in subdirectories]
+        if not ordered:
+            listings = concurrent.futures.as_completed(listings)
+
+        def entries():
+            yield from images
+            for listing in listings:
+                yield from listing.result()
+
+        for image in map_bounded(pool, read, entries(), workers * 4, ordered):
+            if image:
+                yield image
+    finally:
+        # Stop listing directories if the caller stops early
+        pool.shutdown(cancel_futures=True)
+
+
+def read_images(
+    entries: Iterable[os.DirEntry],
+    include_timestamps=True,
+    skip_bad_exif=True,
+    workers: int = SCAN_WORKERS,
+    timestamps: TimestampSource = TimestampSource.exif,
+) -> Iterator[dict]:
+    """
+    Read the timestamps of some image files that were already found, like
+    `scan_images` does, in the same order.
+    """
+    read = functools.partial(
+        read_image,
+        include_timestamps=include_timestamps,
+        skip_bad_exif=skip_bad_exif,
+    )
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="Image Reader"
+    ) as pool:
+        if include_timestamps and timestamps == TimestampSource.filename:
+            folders = collections.defaultdict(list)
+            for entry in entries:
+                folders[os.path.dirname(entry.path)].append(entry)
+            read_folder = functools.partial(
+                read_timestamps_from_names, skip_bad_exif=skip_bad_exif
+            )
+            for images in pool.map(read_folder, folders.values()):
+                yield from images
+            return
+
+        for image in map_bounded(pool, read, entries, workers * 4):
+            if image:
+                yield image
+
+
+# Bytes of a file read at a time when hashing its contents
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path) -> str:
+    """
+    Return a digest of the contents of a file, to find copies of the same
+    image and files that were replaced. The file is read in chunks, so it is
+    never held in memory at once.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        while size := f.readinto(buffer):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def hash_images(images: Iterable[dict], workers: int = SCAN_WORKERS) -> Iterator[dict]:
+    """
+    Add the `content_hash` of each image found by `scan_images` or
+    `read_images`, reading the files with a pool of threads while the next
+    images are still being found. Images are yielded in the same order.
+    Images that can no longer be read are saved without a hash.
+    """
+
+    def add_hash(image):
+        try:
+            image["content_hash"] = hash_file(image["path"])
+        except OSError as e:
+            logger.error(f"Could not read image: {image['path']}\n {e}")
+            image["content_hash"] = None
+        return image
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="Image Hasher"
+    ) as pool:
+        yield from map_bounded(pool, add_hash, images, workers * 4)
+
+
+def find_changed_images(
+    base_directory, manifest: dict[str, dict], settle_seconds: float = 0
+) -> tuple[list[os.DirEntry], dict[str, dict]]:
+    """
+    Find the image files that were added or changed since a directory was
+    last scanned, and return them with an updated manifest of the scan.
+
+    The manifest has the modification time of each directory, relative to
+    `base_directory`, with the names of its subdirectories and the size and
+    modification time of each of its images. Only directories that were
+    modified since the last scan are listed again, and only the files in them
+    that are new or changed are returned. A file that is replaced without
+    modifying its directory (e.g. written in place) is not found.
+
+    Files modified less than `settle_seconds` ago may still be being written,
+    so they are left for the next scan, which lists their directory again.
+    """
+    base_directory = pathlib.Path(base_directory)
+    if not base_directory.exists():
+        raise Exception(f"Directory does not exist: {base_directory}")
+
+    changed = []
+    new_manifest = {}
+    directories = [""]
+    settled_before = time.time_ns() - int(settle_seconds * 1e9)
+    while directories:
+        directory = directories.pop()
+        try:
+            mtime_ns = os.stat(base_directory / directory).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        known = manifest.get(directory)
+        if known and known["mtime_ns"] == mtime_ns:
+            new_manifest[directory] = known
+        else:
+            entries, subdirectories = scan_directory(base_directory / directory)
+            files = {}
+            for entry in entries:
+                stat = entry.stat()
+                if stat.st_mtime_ns > settled_before:
+                    logger.debug(f"Waiting for {entry.path} to be written")
+                    mtime_ns = 0
+                    continue
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                if not known or known["files"].get(entry.name) != files[entry.name]:
+                    changed.append(entry)
+            new_manifest[directory] = {
+                "mtime_ns": mtime_ns,
+                "subdirectories": [os.path.basename(path) for path in subdirectories],
+                "files": files,
+            }
+        directories.extend(
+            os.path.join(directory, name)
+            for name in new_manifest[directory]["subdirectories"]
+        )
+
+    return changed, new_manifest
+
+
 def find_images(
     base_directory,
     absolute_paths=False,
     include_timestamps=True,
     skip_bad_exif=True,
 ):
+    """
+    Find the images in a directory one at a time, without a thread pool.
+    See `scan_images` for a faster way.
+    """
     logger.info(f"Scanning '{base_directory}' for images")
     base_directory = pathlib.Path(base_directory)
     if not base_directory.exists():
@@ -214,14 +785,129 @@ def find_images(
                 yield {"path": path, "timestamp": date}
 
 
+# Images sorted in memory at once when grouping them into monitoring sessions,
+# the others are written to temporary files
+SORT_CHUNK_SIZE = 100000
+# Images written and read back together from the temporary files
+SORT_BLOCK_SIZE = 1000
+
+
+def image_timestamp(image: dict) -> datetime.datetime:
+    return image["timestamp"]
+
+
+class ImageSorter:
+    """
+    Sort images by their timestamps, without holding more than `chunk_size`
+    of them in memory. Each full chunk is sorted and written to a temporary
+    file, and the files are merged as the images are read back. Chunks that
+    are mostly sorted already, like the images of one folder, sort quickly.
+
+    >>> sorter = ImageSorter()
+    >>> for image in images:
+    ...     sorter.add(image)
+    >>> for image in sorter:
+    ...     pass
+    """
+
+    def __init__(self, chunk_size: int = SORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, image: dict):
+        self.chunk.append(image)
+        self.count += 1
+        if len(self.chunk) >= self.chunk_size:
+            self.chunk.sort(key=image_timestamp)
+            run = tempfile.TemporaryFile()
+            for i in range(0, len(self.chunk), SORT_BLOCK_SIZE):
+                block = self.chunk[i : i + SORT_BLOCK_SIZE]
+                pickle.dump(block, run, protocol=pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+            self.runs.append(run)
+            self.chunk = []
+
+    @staticmethod
+    def read_run(run) -> Iterator[dict]:
+        while True:
+            try:
+                yield from pickle.load(run)
+            except EOFError:
+                return
+
+    def __iter__(self) -> Iterator[dict]:
+        self.chunk.sort(key=image_timestamp)
+        if self.runs:
+            logger.debug(f"Merging {self.count} images from {len(self.runs)} files")
+        try:
+            yield from heapq.merge(
+                *(self.read_run(run) for run in self.runs),
+                self.chunk,
+                key=image_timestamp,
+            )
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+            self.chunk = []
+
+
+def sort_images_by_time(
+    images: Iterable[dict], chunk_size: int = SORT_CHUNK_SIZE
+) -> Iterator[dict]:
+    """
+    Sort images by their timestamps with an `ImageSorter`.
+    """
+    sorter = ImageSorter(chunk_size)
+    for image in images:
+        sorter.add(image)
+    yield from sorter
+
+
+def iter_image_groups(
+    images: Iterable[dict], maximum_gap_minutes=6 * 60
+) -> Iterator[tuple[datetime.date, list[dict]]]:
+    """
+    Group images that are sorted by their timestamps into monitoring
+    sessions, see `group_images_by_day`. Each group is yielded with its day
+    as soon as the next one starts, so only one is held in memory. More than
+    one group can start on the same day.
+    """
+    maximum_gap = datetime.timedelta(minutes=maximum_gap_minutes)
+    group = []
+    for image in images:
+        if group and image["timestamp"] - group[-1]["timestamp"] >= maximum_gap:
+            yield group_day(group), group
+            group = []
+        group.append(image)
+    if group:
+        yield group_day(group), group
+
+
+def group_day(images: list[dict]) -> datetime.date:
+    first_date = images[0]["timestamp"]
+    last_date = images[-1]["timestamp"]
+    hours = round((last_date - first_date).total_seconds() / 60 / 60, 1)
+    logger.debug(
+        f"Found session on {first_date.date()} with {len(images)} images that ran for {hours} hours.\n"
+        f"From {first_date.strftime('%c')} to {last_date.strftime('%c')}."
+    )
+    return first_date.date()
+
+
 def group_images_by_day(images, maximum_gap_minutes=6 * 60):
     """
     Find consecutive images and group them into daily/nightly monitoring sessions.
     If the time between two photos is greater than `maximumm_time_gap` (in minutes)
     then start a new session group. Each new group uses the first photo's day
     as the day of the session even if consecutive images are taken past midnight.
+    Groups that start on the same day are merged.
     # @TODO add other group by methods? like image size, camera model, random sample batches, etc. Add to UI settings
 
+    See `iter_image_groups` to group more images than fit in memory.
+
     @TODO make fake images for this test
     >>> images = find_images(TEST_IMAGES_BASE_PATH, skip_bad_exif=True)
     >>> sessions = group_images_by_session(images)
@@ -231,46 +917,62 @@ def group_images_by_day(images, maximum_gap_minutes=6 * 60):
     logger.info(
         f"Grouping images into date-based groups with a maximum gap of {maximum_gap_minutes} minutes"
     )
-    images = sorted(images, key=lambda image: image["timestamp"])
-    if not images:
-        return {}
-
+    images = sorted(images, key=image_timestamp)
     groups = collections.OrderedDict()
+    for day, day_images in iter_image_groups(images, maximum_gap_minutes):
+        groups.setdefault(day, []).extend(day_images)
+    return groups
 
-    last_timestamp = None
-    current_day = None
 
+def iter_folder_groups(
+    base_directory,
+    images: Iterable[dict],
+    maximum_gap_minutes=6 * 60,
+    chunk_size: int = SORT_CHUNK_SIZE,
+) -> Iterator[tuple[datetime.date, list[dict]]]:
+    """
+    Group the images in each nightly folder, named by its date like
+    "2022_05_14", into the monitoring session for that date. Each folder is
+    yielded as soon as the images of the next one start, sorted by time, so
+    the images should be in order of their folders, like `scan_images`
+    finds them. The images that are not in a nightly folder are sorted with
+    an `ImageSorter` and grouped by `iter_image_groups` at the end.
+    """
+    other_images = ImageSorter(chunk_size)
+    folder_date = None
+    group = []
     for image in images:
-        if last_timestamp:
-            delta = (image["timestamp"] - last_timestamp).seconds / 60
-        else:
-            delta = maximum_gap_minutes
+        date = get_folder_date(base_directory, image["path"])
+        if date is None:
+            other_images.add(image)
+            continue
+        if group and date != folder_date:
+            yield folder_date, sorted(group, key=image_timestamp)
+            group = []
+        folder_date = date
+        group.append(image)
+    if group:
+        yield folder_date, sorted(group, key=image_timestamp)
 
-        # logger.debug(f"{timestamp}, {round(delta, 2)}")
+    yield from iter_image_groups(other_images, maximum_gap_minutes)
 
-        if delta >= maximum_gap_minutes:
-            current_day = image["timestamp"].date()
-            logger.debug(
-                f"Gap of {round(delta/60, 1)} hours detected. Starting new session for date: {current_day}"
-            )
-            groups[current_day] = []
-
-        groups[current_day].append(image)
-        last_timestamp = image["timestamp"]
-
-    # This is for debugging
-    for day, images in groups.items():
-        first_date = images[0]["timestamp"]
-        last_date = images[-1]["timestamp"]
-        delta = last_date - first_date
-        hours = round(delta.seconds / 60 / 60, 1)
-        logger.debug(
-            f"Found session on {day} with {len(images)} images that ran for {hours} hours.\n"
-            f"From {first_date.strftime('%c')} to {last_date.strftime('%c')}."
-        )
 
-    return groups
-    # yield relative_path, get_image_timestamp(full_path)
+def group_images_by_folder(
+    base_directory, images, maximum_gap_minutes=6 * 60
+) -> dict[datetime.date, list[dict]]:
+    """
+    Group the images in each nightly folder into the monitoring session for
+    its date, see `iter_folder_groups`. Images that are not in a nightly
+    folder are grouped like `group_images_by_day`.
+    """
+    groups = collections.defaultdict(list)
+    for day, day_images in iter_folder_groups(
+        base_directory, images, maximum_gap_minutes
+    ):
+        groups[day].extend(day_images)
+    for day_images in groups.values():
+        day_images.sort(key=image_timestamp)
+    return dict(sorted(groups.items()))
 
 
 def save_image(
@@ -1,7 +1,12 @@
 import csv
+import enum
+import gzip
+import itertools
+import json
 import pathlib
 import string
-from typing import Union, Any
+import time
+from typing import Union, Any, Iterable, Optional, TextIO
 
 
 def get_sequential_sample(direction, images, last_sample=None):
@@ -57,24 +62,123 @@ def bbox_center(bbox):
     return (center_x, center_y)
 
 
-def export_report(
-    records: list[dict[str, Any]],
-    report_name: str,
-    directory: Union[pathlib.Path, str],
-) -> Union[pathlib.Path, None]:
-    if not records:
+def bbox_relative(bbox, img_width, img_height):
+    """
+    Return the coordinates of a bounding box as fractions of the image size,
+    like those used by the COCO cameratraps format. Returns None if the size
+    of the image is not known.
+    """
+    if not img_width or not img_height:
         return None
+    x1, y1, x2, y2 = bbox
+    return [
+        round(x1 / img_width, 4),
+        round(y1 / img_height, 4),
+        round(x2 / img_width, 4),
+        round(y2 / img_height, 4),
+    ]
+
+
+class ExportFormat(str, enum.Enum):
+    json = "json"
+    ndjson = "ndjson"
+    html = "html"
+    csv = "csv"
+    parquet = "parquet"
 
-    filepath = (pathlib.Path(directory) / "reports" / report_name).with_suffix(".csv")
-    if not filepath.parent.exists():
-        filepath.parent.mkdir(parents=True, exist_ok=True)
 
-    header = records[0].keys()
+# Seconds between flushes of a report that is being written
+EXPORT_FLUSH_INTERVAL = 5.0
 
-    with open(filepath, "w", newline="") as f:
-        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
-        writer.writerow(header)
-        for record in records:
+
+def write_records(
+    records: Iterable[dict[str, Any]],
+    f: TextIO,
+    format: ExportFormat = ExportFormat.csv,
+    flush_interval: float = EXPORT_FLUSH_INTERVAL,
+) -> int:
+    """
+    Write each record to an open file as soon as it is read, in CSV, JSON or
+    newline-delimited JSON, so the records never have to fit in memory.
+    The columns of a CSV file are the keys of the first record.
+    Returns the number of records written.
+    """
+    format = ExportFormat(format)
+    if format in [ExportFormat.html, ExportFormat.parquet]:
+        raise ValueError(
+            f"{format.value} reports can't be written one record at a time"
+        )
+
+    num_records = 0
+    last_flush = time.time()
+    writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+    if format is ExportFormat.json:
+        f.write("[")
+    for record in records:
+        if format is ExportFormat.csv:
+            if not num_records:
+                writer.writerow(record.keys())
             writer.writerow(record.values())
+        else:
+            line = json.dumps(record, default=str)
+            if format is ExportFormat.json:
+                line = ("\n  " if not num_records else ",\n  ") + line
+            else:
+                line = line + "\n"
+            f.write(line)
+        num_records += 1
+        if time.time() - last_flush > flush_interval:
+            f.flush()
+            last_flush = time.time()
+    if format is ExportFormat.json:
+        f.write("\n]\n")
+    f.flush()
+    return num_records
+
+
+def write_report(
+    records: Iterable[dict[str, Any]],
+    filepath: Union[pathlib.Path, str],
+    format: ExportFormat = ExportFormat.csv,
+    compress: Optional[bool] = None,
+    skip_empty: bool = True,
+) -> int:
+    """
+    Write the records to a file with `write_records`, unless there are none
+    and `skip_empty` is set. An empty JSON report is an empty list, and an
+    empty CSV or NDJSON report is an empty file, since there are no columns.
+    The file is compressed with gzip if `compress` is set, or by default if
+    its name ends with ".gz". Returns the number of records written.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None and skip_empty:
+        return 0
+
+    filepath = pathlib.Path(filepath)
+    if compress is None:
+        compress = filepath.suffix == ".gz"
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    open_file = gzip.open if compress else open
+    with open_file(filepath, "wt", newline="") as f:
+        if first is not None:
+            records = itertools.chain([first], records)
+        return write_records(records, f, format)
+
+
+def report_filepath(
+    directory: Union[pathlib.Path, str], report_name: str, suffix: str = ".csv"
+) -> pathlib.Path:
+    return (pathlib.Path(directory) / "reports" / report_name).with_suffix(suffix)
+
+
+def export_report(
+    records: Iterable[dict[str, Any]],
+    report_name: str,
+    directory: Union[pathlib.Path, str],
+) -> Union[pathlib.Path, None]:
+    filepath = report_filepath(directory, report_name)
+    if not write_report(records, filepath):
+        return None
 
     return filepath
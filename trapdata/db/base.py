@@ -1,5 +1,10 @@
 import contextlib
+import enum
+import functools
+import os
 import pathlib
+import threading
+import time
 from typing import Generator
 
 import sqlalchemy as sa
@@ -23,6 +28,196 @@ def get_alembic_config(db_path: str) -> Config:
     return alembic_cfg
 
 
+# Connection pool settings for each type of database. SQLite allows only one
+# writer at a time, so a few connections are enough for the app, the pipeline
+# threads and the UI.
+POOL_SETTINGS = {
+    "sqlite": {
+        "pool_size": 5,
+        "max_overflow": 10,
+    },
+    "postgresql": {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 60 * 60,
+    },
+}
+
+
+class SQLiteJournalMode(str, enum.Enum):
+    wal = "wal"
+    delete = "delete"
+
+
+class SQLiteSynchronous(str, enum.Enum):
+    off = "off"
+    normal = "normal"
+    full = "full"
+
+
+# PRAGMAs applied to every new SQLite connection, see `configure_sqlite`.
+# WAL lets the UI read while the pipeline is writing. With WAL, the NORMAL
+# synchronous level can't corrupt the database, a power failure can only
+# lose the last commits.
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLiteJournalMode.wal.value,
+    "synchronous": SQLiteSynchronous.normal.value,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # Negative values are in KiB
+    "temp_store": "memory",
+    "busy_timeout": 10 * 1000,  # Milliseconds
+}
+
+# Retries of functions that find the database locked, see `retry_on_locked`
+LOCKED_RETRY_ATTEMPTS = 5
+LOCKED_RETRY_WAIT = 0.1  # Seconds, doubled after each attempt
+
+_engines: dict[str, sa.Engine] = {}
+_session_classes: dict[str, orm.sessionmaker[orm.Session]] = {}
+_engines_pid = os.getpid()
+_engines_lock = threading.Lock()
+
+
+def create_engine(db_path) -> sa.Engine:
+    """
+    Create a new engine (and connection pool) for the database.
+
+    Use `get_engine` instead, unless you really need a separate pool.
+    """
+    url = sa.engine.make_url(str(db_path))
+    kwargs = {}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {
+            # A longer timeout is necessary for SQLite and multiple PyTorch workers
+            "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+            "check_same_thread": False,
+        }
+        if url.database and url.database != ":memory:":
+            # In-memory databases use a single connection per thread
+            kwargs.update(POOL_SETTINGS["sqlite"])
+    else:
+        kwargs.update(POOL_SETTINGS.get(url.get_backend_name(), {}))
+
+    engine = sa.create_engine(url, echo=False, future=True, **kwargs)
+    if engine.dialect.name == "sqlite":
+        sa.event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def configure_sqlite(
+    journal_mode=None,
+    synchronous=None,
+    mmap_size_mb=None,
+    cache_size_mb=None,
+    busy_timeout=None,
+):
+    """
+    Change the PRAGMAs used for SQLite connections. Connections that are
+    already open are replaced, once they are returned to the pool.
+    """
+    pragmas = dict(SQLITE_PRAGMAS)
+    if journal_mode is not None:
+        pragmas["journal_mode"] = SQLiteJournalMode(journal_mode).value
+    if synchronous is not None:
+        pragmas["synchronous"] = SQLiteSynchronous(synchronous).value
+    if mmap_size_mb is not None:
+        pragmas["mmap_size"] = int(mmap_size_mb * 1024 * 1024)
+    if cache_size_mb is not None:
+        pragmas["cache_size"] = -int(cache_size_mb * 1024)
+    if busy_timeout is not None:
+        pragmas["busy_timeout"] = int(busy_timeout * 1000)
+
+    if pragmas != SQLITE_PRAGMAS:
+        logger.info(f"Using SQLite settings: {pragmas}")
+        SQLITE_PRAGMAS.update(pragmas)
+        with _engines_lock:
+            for url, engine in list(_engines.items()):
+                if engine.dialect.name == "sqlite":
+                    # The connect timeout can only be changed with a new engine
+                    engine.dispose()
+                    del _engines[url]
+                    _session_classes.pop(url, None)
+
+
+def retry_on_locked(func):
+    """
+    Retry a database function if SQLite reports that the database is locked.
+
+    The busy timeout makes SQLite wait for other writers, but some conflicts fail
+    right away, e.g. when a transaction that has been reading starts to write
+    after another connection has written. The function must be safe to repeat.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(LOCKED_RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except sa.exc.OperationalError as e:
+                last_attempt = attempt == LOCKED_RETRY_ATTEMPTS - 1
+                if "database is locked" not in str(e) or last_attempt:
+                    raise
+                wait = LOCKED_RETRY_WAIT * 2**attempt
+                logger.warn(f"Database is locked, retrying {func.__name__} in {wait}s")
+                time.sleep(wait)
+
+    return wrapper
+
+
+def dispose_engines(close=True):
+    """
+    Remove all engines from the registry and close their connections.
+
+    Use `close=False` in a forked process. The connections belong to the
+    parent process, so they are dropped without being closed.
+    """
+    global _engines_pid
+    for engine in _engines.values():
+        engine.dispose(close=close)
+    _engines.clear()
+    _session_classes.clear()
+    _engines_pid = os.getpid()
+
+
+def reset_after_fork():
+    """
+    Forget the engines of the parent process in a forked child. The lock is
+    replaced first, since another thread of the parent may have been holding
+    it when the process was forked, and that thread doesn't exist in the child.
+    """
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    dispose_engines(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    # Dataloader workers are forked on Linux and must not share connections
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def get_engine(db_path) -> sa.Engine:
+    """
+    Return the engine for this database, which is created on first use and
+    then shared by every session in the process.
+    """
+    key = str(db_path)
+    with _engines_lock:
+        if _engines_pid != os.getpid():
+            # Forked without `os.register_at_fork`
+            dispose_engines(close=False)
+        if key not in _engines:
+            _engines[key] = create_engine(db_path)
+        return _engines[key]
+
+
 def get_db(db_path, create=False, update=False):
     """
     db_path supports any database URL format supported by sqlalchemy
@@ -38,15 +233,10 @@ def get_db(db_path, create=False, update=False):
         # logger.debug(f"Using DB from path: {db_path}")
         # logger.debug(f"Using DB from path: {get_safe_db_path()}")
 
-    db = sa.create_engine(
-        str(db_path),
-        echo=False,
-        future=True,
-        connect_args={
-            "timeout": 10,  # A longer timeout is necessary for SQLite and multiple PyTorch workers
-            "check_same_thread": False,
-        },
-    )
+    db = get_engine(db_path)
+
+    if not (create or update):
+        return db
 
     alembic_cfg = get_alembic_config(db_path)
 
@@ -84,6 +274,10 @@ def get_session_class(db_path, **kwargs) -> orm.sessionmaker[orm.Session]:
     Attach it to the running app.
     Then we don't have to pass around the db_path
     """
+    key = str(db_path)
+    if not kwargs and key in _session_classes:
+        return _session_classes[key]
+
     Session = orm.sessionmaker(
         bind=get_db(db_path, create=False, update=False),
         expire_on_commit=False,  # Currently only need this for `pull_n_from_queue`
@@ -91,6 +285,8 @@ def get_session_class(db_path, **kwargs) -> orm.sessionmaker[orm.Session]:
         autocommit=False,
         **kwargs,
     )
+    if not kwargs:
+        _session_classes[key] = Session
     return Session
 
 
@@ -152,6 +348,42 @@ def query(db_path, q, **kwargs):
         return list(sesh.query(q, **kwargs))
 
 
+def insert_or_ignore(session, model):
+    """
+    Return an INSERT statement for the model that skips rows that would
+    violate a unique constraint, using the syntax of the session's database.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"Unsupported database: {dialect}")
+    return insert(model).on_conflict_do_nothing()
+
+
+def begin_write(session, model) -> None:
+    """
+    Start a transaction that can't be interleaved with the writes of other
+    connections, for a transaction that reads before it writes. Must be the
+    first statement of the transaction.
+
+    SQLite takes the write lock of the database right away, instead of when
+    the first write is made. PostgreSQL locks the table of the model against
+    writes by other transactions until this one ends.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        session.execute(sa.text("BEGIN IMMEDIATE"))
+    elif dialect == "postgresql":
+        session.execute(
+            sa.text(f"LOCK TABLE {model.__tablename__} IN SHARE ROW EXCLUSIVE MODE")
+        )
+    else:
+        raise NotImplementedError(f"Unsupported database: {dialect}")
+
+
 def get_or_create(session, model, defaults=None, **kwargs):
     # https://stackoverflow.com/a/2587041/966058
     instance = session.query(model).filter_by(**kwargs).one_or_none()
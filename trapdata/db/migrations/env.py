@@ -7,8 +7,6 @@ from alembic import context
 
 from trapdata.settings import Settings
 
-settings = Settings()
-
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -32,7 +30,10 @@ target_metadata = Base.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
-config.set_main_option("sqlalchemy.url", str(settings.database_url))
+# Use the database of the app's settings, unless a database was given
+# (e.g. by `trapdata.db.base.get_alembic_config`)
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", str(Settings().database_url))
 
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,73 @@
+"""Add monitoring session totals
+
+Revision ID: 2f7a9e4b6c18
+Revises: 8d4f1a6c3e27
+Create Date: 2026-10-17 16:41:27.503316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2f7a9e4b6c18"
+down_revision = "8d4f1a6c3e27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "monitoring_sessions",
+        sa.Column("num_processed_images", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "monitoring_sessions", sa.Column("num_moths", sa.Integer(), nullable=True)
+    )
+    op.add_column(
+        "monitoring_sessions", sa.Column("num_species", sa.Integer(), nullable=True)
+    )
+
+    # Same totals as `update_session_aggregates`
+    op.execute(
+        """
+        UPDATE monitoring_sessions SET
+            num_images = (
+                SELECT count(images.id) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_processed_images = (
+                SELECT count(images.last_processed) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            start_time = (
+                SELECT min(images.timestamp) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            end_time = (
+                SELECT max(images.timestamp) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_detected_objects = (
+                SELECT count(detections.id) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_moths = (
+                SELECT count(detections.id) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+                AND detections.binary_label = 'moth'
+            ),
+            num_species = (
+                SELECT count(DISTINCT detections.specific_label) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+                AND detections.binary_label = 'moth'
+            )
+        """
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("monitoring_sessions") as batch_op:
+        batch_op.drop_column("num_species")
+        batch_op.drop_column("num_moths")
+        batch_op.drop_column("num_processed_images")
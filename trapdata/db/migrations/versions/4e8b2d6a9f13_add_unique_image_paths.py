@@ -0,0 +1,160 @@
+"""Only save each image file once
+
+Revision ID: 4e8b2d6a9f13
+Revises: 9c3d5b8e1a72
+Create Date: 2026-10-17 18:12:40.316925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4e8b2d6a9f13"
+down_revision = "9c3d5b8e1a72"
+branch_labels = None
+depends_on = None
+
+
+# Images that were saved again with the same path, e.g. because the file was
+# replaced with one of a different size. The first copy is kept.
+DUPLICATE_IMAGES = """
+    SELECT images.id FROM images
+    WHERE images.id NOT IN (
+        SELECT min(original.id) FROM images AS original
+        GROUP BY original.base_path, original.path
+    )
+"""
+
+
+# The image that is kept for the path of an image
+KEPT_IMAGE = """
+    SELECT min(original.id) FROM images AS original
+    JOIN images AS duplicate
+    ON original.base_path = duplicate.base_path AND original.path = duplicate.path
+    WHERE duplicate.id = {image_id}
+"""
+
+# The first image with the path of an image that has detections. Only the
+# detections of one copy are kept, otherwise they would be counted twice.
+PROCESSED_IMAGE = """
+    SELECT min(processed.id) FROM images AS processed
+    JOIN images AS duplicate
+    ON processed.base_path = duplicate.base_path AND processed.path = duplicate.path
+    WHERE duplicate.id = {image_id}
+    AND EXISTS (
+        SELECT 1 FROM detections AS existing WHERE existing.image_id = processed.id
+    )
+"""
+
+
+def upgrade() -> None:
+    # If the kept image has detections, the other copies' are dropped.
+    # Otherwise the detections of the first copy that has some are moved.
+    processed_image = PROCESSED_IMAGE.format(image_id="detections.image_id")
+    op.execute(
+        f"""
+        DELETE FROM detections
+        WHERE detections.image_id IN ({DUPLICATE_IMAGES})
+        AND detections.image_id != ({processed_image})
+        """
+    )
+    op.execute(
+        f"""
+        UPDATE images SET
+            last_processed = (
+                SELECT max(duplicate.last_processed) FROM images AS duplicate
+                WHERE duplicate.base_path = images.base_path
+                AND duplicate.path = images.path
+                AND duplicate.id IN (SELECT detections.image_id FROM detections)
+            ),
+            in_queue = FALSE
+        WHERE images.id NOT IN ({DUPLICATE_IMAGES})
+        AND NOT EXISTS (
+            SELECT 1 FROM detections WHERE detections.image_id = images.id
+        )
+        AND EXISTS (
+            SELECT 1 FROM images AS duplicate
+            JOIN detections ON detections.image_id = duplicate.id
+            WHERE duplicate.base_path = images.base_path
+            AND duplicate.path = images.path
+        )
+        """
+    )
+    kept_image = KEPT_IMAGE.format(image_id="detections.image_id")
+    op.execute(
+        f"""
+        UPDATE detections SET
+            monitoring_session_id = (
+                SELECT images.monitoring_session_id FROM images
+                WHERE images.id = ({kept_image})
+            ),
+            image_id = ({kept_image})
+        WHERE detections.image_id IN ({DUPLICATE_IMAGES})
+        """
+    )
+    op.execute(
+        f"""
+        DELETE FROM queue_jobs
+        WHERE queue_jobs.queue = 'images'
+        AND queue_jobs.item_id IN ({DUPLICATE_IMAGES})
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM queue_jobs
+        WHERE queue_jobs.queue IN ('detected_objects', 'unclassified_objects')
+        AND NOT EXISTS (
+            SELECT 1 FROM detections WHERE detections.id = queue_jobs.item_id
+        )
+        """
+    )
+    op.execute(f"DELETE FROM images WHERE images.id IN ({DUPLICATE_IMAGES})")
+    op.execute(
+        """
+        UPDATE images SET num_detected_objects = (
+            SELECT count(detections.id) FROM detections
+            WHERE detections.image_id = images.id
+        )
+        """
+    )
+    # Same totals as `update_session_aggregates`
+    op.execute(
+        """
+        UPDATE monitoring_sessions SET
+            num_images = (
+                SELECT count(images.id) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_processed_images = (
+                SELECT count(images.last_processed) FROM images
+                WHERE images.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_detected_objects = (
+                SELECT count(detections.id) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+            ),
+            num_moths = (
+                SELECT count(detections.id) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+                AND detections.binary_label = 'moth'
+            ),
+            num_species = (
+                SELECT count(DISTINCT detections.specific_label) FROM detections
+                WHERE detections.monitoring_session_id = monitoring_sessions.id
+                AND detections.binary_label = 'moth'
+            )
+        """
+    )
+    # The queue counters are counted again when needed
+    op.execute("DELETE FROM queue_counters")
+    op.create_index(
+        "ix_images_base_path_path",
+        "images",
+        ["base_path", "path"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_images_base_path_path", table_name="images")
@@ -0,0 +1,43 @@
+"""Add queue counters
+
+Revision ID: 5b2e9c7d1f40
+Revises: de36be6d44b7
+Create Date: 2026-10-17 13:24:08.117392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b2e9c7d1f40"
+down_revision = "de36be6d44b7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The counters are created when the queues are first read
+    op.create_table(
+        "queue_counters",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("queue", sa.String(length=255), nullable=False),
+        sa.Column("base_directory", sa.String(length=255), nullable=False),
+        sa.Column("waiting", sa.Integer(), nullable=False),
+        sa.Column("leased", sa.Integer(), nullable=False),
+        sa.Column("done", sa.Integer(), nullable=False),
+        sa.Column("unprocessed", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_queue_counters_queue_base_directory",
+        "queue_counters",
+        ["queue", "base_directory"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_queue_counters_queue_base_directory", table_name="queue_counters")
+    op.drop_table("queue_counters")
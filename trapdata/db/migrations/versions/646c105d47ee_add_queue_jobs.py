@@ -0,0 +1,58 @@
+"""Add queue jobs
+
+Revision ID: 646c105d47ee
+Revises: 3665528a445c
+Create Date: 2026-10-17 10:12:41.318245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "646c105d47ee"
+down_revision = "3665528a445c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "queue_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("queue", sa.String(length=255), nullable=False),
+        sa.Column("item_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "state",
+            sa.Enum("waiting", "leased", "done", "failed", name="jobstate"),
+            nullable=False,
+        ),
+        sa.Column("worker", sa.String(length=255), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_queue_jobs_open_item",
+        "queue_jobs",
+        ["queue", "item_id"],
+        unique=True,
+        sqlite_where=sa.text("state IN ('waiting', 'leased')"),
+        postgresql_where=sa.text("state IN ('waiting', 'leased')"),
+    )
+    op.create_index(
+        "ix_queue_jobs_state",
+        "queue_jobs",
+        ["queue", "state", "lease_expires_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_queue_jobs_state", table_name="queue_jobs")
+    op.drop_index("ix_queue_jobs_open_item", table_name="queue_jobs")
+    op.drop_table("queue_jobs")
+    sa.Enum(name="jobstate").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,204 @@
+"""Add deployments
+
+Revision ID: 8d4f1a6c3e27
+Revises: 5b2e9c7d1f40
+Create Date: 2026-10-17 15:02:51.640218
+
+"""
+import datetime
+import pathlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d4f1a6c3e27"
+down_revision = "5b2e9c7d1f40"
+branch_labels = None
+depends_on = None
+
+
+# See de36be6d44b7_add_performance_indexes.py
+SQLITE_IN_QUEUE = sa.text("in_queue IS 1")
+POSTGRESQL_IN_QUEUE = sa.text("in_queue IS true")
+
+
+def create_queue_counters(deployment_column, *column_args):
+    op.create_table(
+        "queue_counters",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("queue", sa.String(length=255), nullable=False),
+        sa.Column(deployment_column, *column_args, nullable=False),
+        sa.Column("waiting", sa.Integer(), nullable=False),
+        sa.Column("leased", sa.Integer(), nullable=False),
+        sa.Column("done", sa.Integer(), nullable=False),
+        sa.Column("unprocessed", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        f"ix_queue_counters_queue_{deployment_column}",
+        "queue_counters",
+        ["queue", deployment_column],
+        unique=True,
+    )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "deployments",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=True),
+        sa.Column("base_directory", sa.String(length=255), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_deployments_base_directory",
+        "deployments",
+        ["base_directory"],
+        unique=True,
+    )
+    for table in ["monitoring_sessions", "images", "detections"]:
+        if op.get_bind().dialect.name == "sqlite":
+            # Alembic can only add a foreign key in SQLite by copying the whole
+            # table, but SQLite can add a column with a foreign key directly.
+            op.execute(
+                f"ALTER TABLE {table} "
+                f"ADD COLUMN deployment_id INTEGER REFERENCES deployments (id)"
+            )
+        else:
+            op.add_column(
+                table,
+                sa.Column(
+                    "deployment_id",
+                    sa.Integer(),
+                    sa.ForeignKey("deployments.id"),
+                    nullable=True,
+                ),
+            )
+
+    # One deployment for each base directory that has been scanned, named
+    # after the last part of the directory like in `report_data`
+    conn = op.get_bind()
+    base_directories = (
+        conn.execute(
+            sa.text(
+                "SELECT DISTINCT base_directory FROM monitoring_sessions "
+                "WHERE base_directory IS NOT NULL"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    deployments = sa.table(
+        "deployments",
+        sa.column("name", sa.String),
+        sa.column("base_directory", sa.String),
+        sa.column("created_at", sa.DateTime),
+    )
+    now = datetime.datetime.now()
+    op.bulk_insert(
+        deployments,
+        [
+            {
+                "name": pathlib.Path(base_directory).name,
+                "base_directory": base_directory,
+                "created_at": now,
+            }
+            for base_directory in base_directories
+        ],
+    )
+    op.execute(
+        """
+        UPDATE monitoring_sessions SET deployment_id = (
+            SELECT deployments.id FROM deployments
+            WHERE deployments.base_directory = monitoring_sessions.base_directory
+        )
+        """
+    )
+    for table in ["images", "detections"]:
+        op.execute(
+            f"""
+            UPDATE {table} SET deployment_id = (
+                SELECT monitoring_sessions.deployment_id FROM monitoring_sessions
+                WHERE monitoring_sessions.id = {table}.monitoring_session_id
+            )
+            """
+        )
+
+    op.create_index(
+        "ix_monitoring_sessions_deployment_id",
+        "monitoring_sessions",
+        ["deployment_id", "day"],
+    )
+    op.create_index(
+        "ix_images_deployment_id",
+        "images",
+        ["deployment_id", "last_processed"],
+    )
+    op.create_index(
+        "ix_detections_deployment_id",
+        "detections",
+        ["deployment_id", "binary_label", "specific_label"],
+    )
+    # The queues are now filtered by deployment instead of monitoring session
+    op.drop_index("ix_images_in_queue", table_name="images")
+    op.create_index(
+        "ix_images_in_queue",
+        "images",
+        ["deployment_id"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
+    op.drop_index("ix_detections_in_queue", table_name="detections")
+    op.create_index(
+        "ix_detections_in_queue",
+        "detections",
+        ["deployment_id", "binary_label", "specific_label"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
+
+    # The counters are only a cache, they are counted again when needed
+    op.drop_index("ix_queue_counters_queue_base_directory", table_name="queue_counters")
+    op.drop_table("queue_counters")
+    create_queue_counters(
+        "deployment_id", sa.Integer(), sa.ForeignKey("deployments.id")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_queue_counters_queue_deployment_id", table_name="queue_counters")
+    op.drop_table("queue_counters")
+    create_queue_counters("base_directory", sa.String(length=255))
+
+    op.drop_index("ix_detections_in_queue", table_name="detections")
+    op.drop_index("ix_images_in_queue", table_name="images")
+    op.drop_index("ix_detections_deployment_id", table_name="detections")
+    op.drop_index("ix_images_deployment_id", table_name="images")
+    op.drop_index(
+        "ix_monitoring_sessions_deployment_id", table_name="monitoring_sessions"
+    )
+    for table in ["detections", "images", "monitoring_sessions"]:
+        # SQLite can't drop a column with a foreign key without copying the table
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("deployment_id")
+    op.drop_index("ix_deployments_base_directory", table_name="deployments")
+    op.drop_table("deployments")
+
+    op.create_index(
+        "ix_images_in_queue",
+        "images",
+        ["monitoring_session_id"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
+    op.create_index(
+        "ix_detections_in_queue",
+        "detections",
+        ["monitoring_session_id", "binary_label", "specific_label"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
@@ -0,0 +1,28 @@
+"""Add an index for exporting the detections of a deployment
+
+Revision ID: 9c3d5b8e1a72
+Revises: 2f7a9e4b6c18
+Create Date: 2026-10-17 17:36:52.180447
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9c3d5b8e1a72"
+down_revision = "2f7a9e4b6c18"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_detections_deployment_id_id",
+        "detections",
+        ["deployment_id", "id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_detections_deployment_id_id", table_name="detections")
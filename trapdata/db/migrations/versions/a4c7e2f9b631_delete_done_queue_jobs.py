@@ -0,0 +1,25 @@
+"""Delete the jobs that are done, which are no longer kept
+
+Revision ID: a4c7e2f9b631
+Revises: f3b8d2a6c915
+Create Date: 2026-10-17 23:12:40.531027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a4c7e2f9b631"
+down_revision = "f3b8d2a6c915"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Jobs are now deleted when they are completed
+    op.execute("DELETE FROM queue_jobs WHERE state = 'done'")
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,28 @@
+"""Add the dimensions of images
+
+Revision ID: b7f3c1e5d208
+Revises: 4e8b2d6a9f13
+Create Date: 2026-10-17 19:05:14.782031
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b7f3c1e5d208"
+down_revision = "4e8b2d6a9f13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Images that are already saved get their dimensions when they are scanned again
+    op.add_column("images", sa.Column("width", sa.Integer(), nullable=True))
+    op.add_column("images", sa.Column("height", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_column("height")
+        batch_op.drop_column("width")
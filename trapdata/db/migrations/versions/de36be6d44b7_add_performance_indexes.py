@@ -0,0 +1,82 @@
+"""Add indexes for the queue, count and playback queries
+
+Revision ID: de36be6d44b7
+Revises: 646c105d47ee
+Create Date: 2026-10-17 11:02:15.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "de36be6d44b7"
+down_revision = "646c105d47ee"
+branch_labels = None
+depends_on = None
+
+
+# Partial indexes only include the items in a queue. The conditions must be
+# written the same way as in the queries (`in_queue.is_(True)`) to be used.
+SQLITE_IN_QUEUE = sa.text("in_queue IS 1")
+POSTGRESQL_IN_QUEUE = sa.text("in_queue IS true")
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_monitoring_sessions_base_directory",
+        "monitoring_sessions",
+        ["base_directory", "day"],
+    )
+    op.create_index(
+        "ix_images_monitoring_session_id",
+        "images",
+        ["monitoring_session_id", "timestamp"],
+    )
+    op.create_index(
+        "ix_images_last_processed",
+        "images",
+        ["monitoring_session_id", "last_processed"],
+    )
+    op.create_index(
+        "ix_images_in_queue",
+        "images",
+        ["monitoring_session_id"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
+    op.create_index(
+        "ix_detections_image_id",
+        "detections",
+        ["image_id", "binary_label", "specific_label"],
+    )
+    op.create_index(
+        "ix_detections_monitoring_session_id",
+        "detections",
+        ["monitoring_session_id", "binary_label", "specific_label"],
+    )
+    op.create_index(
+        "ix_detections_specific_label",
+        "detections",
+        ["specific_label"],
+    )
+    op.create_index(
+        "ix_detections_in_queue",
+        "detections",
+        ["monitoring_session_id", "binary_label", "specific_label"],
+        sqlite_where=SQLITE_IN_QUEUE,
+        postgresql_where=POSTGRESQL_IN_QUEUE,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_detections_in_queue", table_name="detections")
+    op.drop_index("ix_detections_specific_label", table_name="detections")
+    op.drop_index("ix_detections_monitoring_session_id", table_name="detections")
+    op.drop_index("ix_detections_image_id", table_name="detections")
+    op.drop_index("ix_images_in_queue", table_name="images")
+    op.drop_index("ix_images_last_processed", table_name="images")
+    op.drop_index("ix_images_monitoring_session_id", table_name="images")
+    op.drop_index(
+        "ix_monitoring_sessions_base_directory", table_name="monitoring_sessions"
+    )
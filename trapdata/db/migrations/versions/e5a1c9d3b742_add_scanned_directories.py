@@ -0,0 +1,46 @@
+"""Add the directories of each deployment that were scanned for images
+
+Revision ID: e5a1c9d3b742
+Revises: b7f3c1e5d208
+Create Date: 2026-10-17 20:12:37.514820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e5a1c9d3b742"
+down_revision = "b7f3c1e5d208"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Deployments that were scanned before are read in full on their next scan
+    op.create_table(
+        "scanned_directories",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("deployment_id", sa.Integer(), nullable=False),
+        sa.Column("path", sa.String(length=255), nullable=False),
+        sa.Column("mtime_ns", sa.BigInteger(), nullable=False),
+        sa.Column("subdirectories", sa.JSON(), nullable=False),
+        sa.Column("files", sa.JSON(), nullable=False),
+        sa.Column("scanned_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["deployment_id"], ["deployments.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_scanned_directories_deployment_id_path",
+        "scanned_directories",
+        ["deployment_id", "path"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_scanned_directories_deployment_id_path",
+        table_name="scanned_directories",
+    )
+    op.drop_table("scanned_directories")
@@ -0,0 +1,47 @@
+"""Add the content hash of images, and the image each copy is a duplicate of
+
+Revision ID: f3b8d2a6c915
+Revises: e5a1c9d3b742
+Create Date: 2026-10-17 21:34:52.108463
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f3b8d2a6c915"
+down_revision = "e5a1c9d3b742"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Images that are already saved are hashed when they are read again,
+    # e.g. by a full rescan
+    op.add_column("images", sa.Column("content_hash", sa.String(32), nullable=True))
+    if op.get_bind().dialect.name == "sqlite":
+        # Alembic can only add a foreign key in SQLite by copying the whole
+        # table, but SQLite can add a column with a foreign key directly.
+        op.execute(
+            "ALTER TABLE images ADD COLUMN duplicate_of_id INTEGER REFERENCES images (id)"
+        )
+    else:
+        op.add_column(
+            "images",
+            sa.Column(
+                "duplicate_of_id",
+                sa.Integer(),
+                sa.ForeignKey("images.id"),
+                nullable=True,
+            ),
+        )
+    op.create_index("ix_images_content_hash", "images", ["content_hash"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_images_content_hash", table_name="images")
+    # SQLite can't drop a column with a foreign key without copying the table
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_column("duplicate_of_id")
+        batch_op.drop_column("content_hash")
@@ -1,6 +1,17 @@
+from .deployments import Deployment
 from .events import MonitoringSession
 from .images import TrapImage
 from .detections import DetectedObject
+from .queue import QueueJob, QueueCounter
+from .scans import ScannedDirectory
 
 
-__models__ = [MonitoringSession, TrapImage, DetectedObject]
+__models__ = [
+    Deployment,
+    MonitoringSession,
+    TrapImage,
+    DetectedObject,
+    QueueJob,
+    QueueCounter,
+    ScannedDirectory,
+]
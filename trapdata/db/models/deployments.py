@@ -0,0 +1,77 @@
+import datetime
+import pathlib
+from typing import Optional
+
+import sqlalchemy as sa
+
+from trapdata.db import Base, get_session
+from trapdata.db.base import insert_or_ignore
+from trapdata.common.types import FilePath
+
+
+class Deployment(Base):
+    """
+    A trap that has been deployed at one location. All of its images are in
+    one base directory.
+
+    Monitoring sessions, images and detected objects have the ID of their
+    deployment, so they can be filtered without comparing directory names.
+    """
+
+    __tablename__ = "deployments"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(255))
+    base_directory = sa.Column(sa.String(255), nullable=False)
+    created_at = sa.Column(sa.DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        sa.Index("ix_deployments_base_directory", base_directory, unique=True),
+    )
+
+    def __repr__(self):
+        return (
+            f"Deployment(name={self.name!r}, "
+            f"base_directory={self.base_directory!r})"
+        )
+
+
+def normalize_base_directory(base_directory: FilePath) -> str:
+    """
+    Return the path that is saved for a directory of images, the absolute path
+    with symlinks resolved, like the `image_base_path` setting. The paths are
+    compared as strings, so a directory must be looked up by this path to
+    find its deployment.
+    """
+    return str(pathlib.Path(base_directory).resolve())
+
+
+def get_or_create_deployment(sesh, base_directory: FilePath) -> Deployment:
+    """
+    Return the deployment for the images in this directory, adding it if
+    necessary. Does not commit.
+    """
+    base_directory = normalize_base_directory(base_directory)
+    sesh.execute(
+        insert_or_ignore(sesh, Deployment).values(
+            name=pathlib.Path(base_directory).name,
+            base_directory=base_directory,
+            created_at=datetime.datetime.now(),
+        )
+    )
+    return sesh.execute(
+        sa.select(Deployment).where(Deployment.base_directory == base_directory)
+    ).scalar_one()
+
+
+def get_deployment_id(db_path, base_directory: FilePath) -> Optional[int]:
+    """
+    Return the ID of the deployment for this directory, if its images have
+    been scanned.
+    """
+    with get_session(db_path) as sesh:
+        return sesh.execute(
+            sa.select(Deployment.id).where(
+                Deployment.base_directory == normalize_base_directory(base_directory)
+            )
+        ).scalar()
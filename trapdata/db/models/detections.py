@@ -1,18 +1,33 @@
+import collections
 import datetime
+import os
 import pathlib
-from typing import Iterable, Union, Optional, Any
+import threading
+import time
+from typing import Iterable, Iterator, Union, Optional, Any, Sequence
 
 import sqlalchemy as sa
 from sqlalchemy import orm
 import PIL.Image
 
 from trapdata import db
+from trapdata.db.base import retry_on_locked
 from trapdata import constants
 from trapdata.common.types import FilePath
-from trapdata.db.models.images import TrapImage, completely_classified
-from trapdata.db.models.events import MonitoringSession
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.events import (
+    MonitoringSession,
+    change_session_aggregates,
+    update_session_aggregates,
+)
+from trapdata.db.models.deployments import get_deployment_id
 from trapdata.common.logs import logger
-from trapdata.common.utils import bbox_area, bbox_center, export_report
+from trapdata.common.utils import (
+    bbox_area,
+    bbox_center,
+    bbox_relative,
+    export_report,
+)
 from trapdata.common.filemanagement import (
     save_image,
     absolute_path,
@@ -21,12 +36,40 @@ from trapdata.common.filemanagement import (
 )
 
 
+# Object counts of the most recent images shown in playback
+IMAGE_STATS_CACHE_SIZE = 256
+# Seconds the counts are kept, about one refresh of the playback view. Writes
+# by other processes, e.g. `ami run`, don't remove the counts they change.
+IMAGE_STATS_TTL = 1
+_image_stats: collections.OrderedDict = collections.OrderedDict()
+_image_stats_lock = threading.Lock()
+_image_stats_version = 0
+
+# Detected objects read in each query of an export
+EXPORT_PAGE_SIZE = 5000
+
+
+def reset_image_stats_after_fork():
+    """
+    Replace the lock of the cached stats in a forked child, in case another
+    thread of the parent was holding it. See `reset_after_fork`.
+    """
+    global _image_stats_lock
+    _image_stats_lock = threading.Lock()
+    _image_stats.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_image_stats_after_fork)
+
+
 class DetectedObject(db.Base):
     __tablename__ = "detections"
 
     id = sa.Column(sa.Integer, primary_key=True)
     image_id = sa.Column(sa.ForeignKey("images.id"))
     monitoring_session_id = sa.Column(sa.ForeignKey("monitoring_sessions.id"))
+    deployment_id = sa.Column(sa.ForeignKey("deployments.id"))
     bbox = sa.Column(sa.JSON)
     area_pixels = sa.Column(sa.Integer)
     path = sa.Column(
@@ -41,6 +84,34 @@ class DetectedObject(db.Base):
     in_queue = sa.Column(sa.Boolean, default=False)
     notes = sa.Column(sa.JSON)
 
+    __table_args__ = (
+        sa.Index("ix_detections_image_id", image_id, binary_label, specific_label),
+        sa.Index(
+            "ix_detections_monitoring_session_id",
+            monitoring_session_id,
+            binary_label,
+            specific_label,
+        ),
+        sa.Index(
+            "ix_detections_deployment_id",
+            deployment_id,
+            binary_label,
+            specific_label,
+        ),
+        # Exports read the objects of a deployment in order of ID
+        sa.Index("ix_detections_deployment_id_id", deployment_id, id),
+        sa.Index("ix_detections_specific_label", specific_label),
+        # Only the objects in a queue, which is usually a small fraction
+        sa.Index(
+            "ix_detections_in_queue",
+            deployment_id,
+            binary_label,
+            specific_label,
+            sqlite_where=in_queue.is_(True),
+            postgresql_where=in_queue.is_(True),
+        ),
+    )
+
     image = orm.relationship(
         "TrapImage",
         back_populates="detected_objects",
@@ -89,8 +160,12 @@ class DetectedObject(db.Base):
         self,
         base_path: Union[pathlib.Path, str, None] = None,
         source_image: Union[TrapImage, None] = None,
+        image_data: Optional[PIL.Image.Image] = None,
     ):
         """
+        Save the cropped image of this object to disk. Uses `image_data` if the crop
+        has already been made, otherwise it is cut from the source image.
+
         @TODO need consistent way of discovering the user_data_path in the application settings
         and using that for the base_path.
         """
@@ -104,7 +179,8 @@ class DetectedObject(db.Base):
         )
 
         fpath = save_image(
-            image=self.cropped_image_data(
+            image=image_data
+            or self.cropped_image_data(
                 base_path=base_path,
                 source_image=source_image,
             ),
@@ -131,6 +207,11 @@ class DetectedObject(db.Base):
             "timestamp": self.image.timestamp.isoformat(),
             "bbox": self.bbox,
             "bbox_center": bbox_center(self.bbox) if self.bbox else None,
+            "bbox_relative": (
+                bbox_relative(self.bbox, self.image.width, self.image.height)
+                if self.bbox
+                else None
+            ),
             "area_pixels": self.area_pixels,
             "model_name": self.model_name,
             "category_label": label,
@@ -141,77 +222,278 @@ class DetectedObject(db.Base):
         return self.report_data()
 
 
-def save_detected_objects(
-    db_path, image_ids, detected_objects_data, user_data_path=None
-):
-    orm_objects = []
-    with db.get_session(db_path) as sesh:
-        images = sesh.query(TrapImage).filter(TrapImage.id.in_(image_ids)).all()
-
-    timestamp = datetime.datetime.now()
-
-    for image, detected_objects in zip(images, detected_objects_data):
-        image.last_processed = timestamp
-        # sesh.add(image)
-        orm_objects.append(image)
+def save_cropped_images(
+    image: TrapImage,
+    bboxes: Sequence[Sequence[int]],
+    base_path: Union[pathlib.Path, str, None] = None,
+    cropped_images: Optional[Sequence[PIL.Image.Image]] = None,
+) -> list[str]:
+    """
+    Save a cropped image of each object detected in the source image.
+
+    The source image is only opened once for all of its objects. Crops that were
+    already made can be passed in `cropped_images`, in the same order as `bboxes`.
+    """
+    source_image_data = PIL.Image.open(image.absolute_path)
+    exif_data = construct_exif(
+        description=f"Source image: {image.path}",
+        timestamp=image.timestamp,  # type:ignore
+        existing_exif=source_image_data.getexif(),
+    )
+    paths = []
+    for i, bbox in enumerate(bboxes):
+        fpath = save_image(
+            image=cropped_images[i] if cropped_images else source_image_data.crop(bbox),
+            base_path=base_path,
+            subdir="crops",
+            exif_data=exif_data,
+        )
+        paths.append(str(fpath))
+    return paths
+
+
+def insert_detected_objects(sesh, image_ids, rows, timestamp):
+    """
+    Insert the detected objects of some images with one statement, and mark
+    the images as processed with another. Then add them to the totals of
+    their monitoring sessions. Returns the IDs of the new objects, in the same
+    order as `rows`. Does not commit.
+    """
+    from trapdata.db.models.queue import (
+        ImageQueue,
+        DetectedObjectQueue,
+        UnclassifiedObjectQueue,
+    )
 
-        for object_data in detected_objects:
-            detection = DetectedObject(
-                last_detected=timestamp,
-                in_queue=True,
+    logger.info(f"Bulk saving {len(rows)} detected objects")
+    object_ids = []
+    if rows:
+        object_ids = (
+            sesh.execute(
+                sa.insert(DetectedObject).returning(
+                    DetectedObject.id, sort_by_parameter_order=True
+                ),
+                rows,
             )
+            .scalars()
+            .all()
+        )
+    num_detected_objects = (
+        sa.select(sa.func.count(DetectedObject.id))
+        .where(DetectedObject.image_id == TrapImage.id)
+        .scalar_subquery()
+    )
+    # Images that are processed again were already counted
+    newly_processed = sesh.execute(
+        sa.select(TrapImage.monitoring_session_id, sa.func.count(TrapImage.id))
+        .where(TrapImage.id.in_(image_ids) & TrapImage.last_processed.is_(None))
+        .group_by(TrapImage.monitoring_session_id)
+    ).all()
+    with ImageQueue.track_counters(sesh, image_ids):
+        sesh.execute(
+            sa.update(TrapImage)
+            .where(TrapImage.id.in_(image_ids))
+            .values(
+                last_processed=timestamp,
+                num_detected_objects=num_detected_objects,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    if object_ids:
+        DetectedObjectQueue.add_to_counters(sesh, object_ids)
+        UnclassifiedObjectQueue.add_to_counters(sesh, object_ids)
+    forget_image_stats(sesh, image_ids)
+
+    changes = collections.defaultdict(collections.Counter)
+    for session_id, num_images in newly_processed:
+        changes[session_id]["num_processed_images"] += num_images
+    species_session_ids = set()
+    for row in rows:
+        changes[row["monitoring_session_id"]]["num_detected_objects"] += 1
+        if row.get("binary_label") == constants.POSITIVE_BINARY_LABEL:
+            changes[row["monitoring_session_id"]]["num_moths"] += 1
+            if row.get("specific_label"):
+                species_session_ids.add(row["monitoring_session_id"])
+    change_session_aggregates(sesh, changes)
+    if species_session_ids:
+        update_session_aggregates(
+            sesh, list(species_session_ids), totals=["num_species"]
+        )
+    return object_ids
 
-            if "bbox" in object_data:
-                area_pixels = bbox_area(object_data["bbox"])
-                object_data["area_pixels"] = area_pixels
 
-            for k, v in object_data.items():
-                logger.debug(f"Adding {k}: {v} to detected object {detection.id}")
-                setattr(detection, k, v)
+@retry_on_locked
+def save_detected_objects(
+    db_path,
+    image_ids,
+    detected_objects_data,
+    user_data_path=None,
+    save_crops=True,
+    cropped_images=None,
+    writer=None,
+):
+    """
+    Save new detected objects for each image, and a cropped image of each object
+    unless `save_crops` is False. Crops that were already made in memory can be
+    passed in `cropped_images`, in the same order as `detected_objects_data`.
+
+    The objects are saved with `insert_detected_objects`, in the transaction of
+    the `DatabaseWriter` if there is one. Returns the IDs of the new objects, in
+    the same order as `detected_objects_data`.
+    """
+    with db.get_session(db_path) as sesh:
+        images = (
+            sesh.execute(
+                sa.select(TrapImage).where(TrapImage.id.in_(image_ids))
+                # The existing objects of the images are not needed
+                .options(orm.lazyload("*"))
+            )
+            .scalars()
+            .all()
+        )
+        # Results are in the same order as the image IDs, the query results may not be
+        images_by_id = {image.id: image for image in images}
+        images = [images_by_id[image_id] for image_id in image_ids]
 
-            detection.monitoring_session_id = image.monitoring_session_id
-            detection.image_id = image.id
+    timestamp = datetime.datetime.now()
+    cropped_images = cropped_images or [None for _ in detected_objects_data]
+    rows = []
 
-            detection.save_cropped_image_data(
-                source_image=image,
+    for image, detected_objects, crops in zip(
+        images, detected_objects_data, cropped_images
+    ):
+        if save_crops and detected_objects:
+            paths = save_cropped_images(
+                image,
+                [object_data["bbox"] for object_data in detected_objects],
                 base_path=user_data_path,
+                cropped_images=crops,
             )
-
-            logger.debug(f"Creating detected object {detection} for image {image}")
-
-            orm_objects.append(detection)
+        else:
+            paths = [None for _ in detected_objects]
+
+        for object_data, path in zip(detected_objects, paths):
+            row = {
+                "image_id": image.id,
+                "monitoring_session_id": image.monitoring_session_id,
+                "deployment_id": image.deployment_id,
+                "last_detected": timestamp,
+                "in_queue": True,
+                "path": path,
+            }
+            row.update(object_data)
+            if row.get("bbox"):
+                row["area_pixels"] = bbox_area(row["bbox"])
+            rows.append(row)
+
+    # Every row of a bulk insert must have the same columns
+    columns = set().union(*rows)
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+
+    if writer:
+        # The next stage needs the IDs, so wait for the objects to be committed
+        return writer.execute(insert_detected_objects, image_ids, rows, timestamp)
 
     with db.get_session(db_path) as sesh:
-        # @TODO this could be faster! Especially for sqlite
-        logger.info(f"Bulk saving {len(orm_objects)} objects")
-        sesh.bulk_save_objects(orm_objects)
+        object_ids = insert_detected_objects(sesh, image_ids, rows, timestamp)
         sesh.commit()
 
+    return object_ids
 
-def save_classified_objects(db_path, object_ids, classified_objects_data):
-    # logger.debug(f"Callback was called! {object_ids}, {classified_objects_data}")
-
-    orm_objects = []
-    timestamp = datetime.datetime.now()
-    with db.get_session(db_path) as sesh:
-        objects = (
-            sesh.query(DetectedObject).filter(DetectedObject.id.in_(object_ids)).all()
-        )
 
-    for obj, object_data in zip(objects, classified_objects_data):
-        obj.last_processed = timestamp
+def update_classified_objects(sesh, rows):
+    """
+    Update detected objects by primary key with one executemany UPDATE,
+    without loading them first, then add the changes to the totals of their
+    monitoring sessions. Each row must have an `id`. Does not commit.
+    """
+    from trapdata.db.models.queue import DetectedObjectQueue, UnclassifiedObjectQueue
 
-        logger.debug(f"Updating classified object {obj}")
-        for k, v in object_data.items():
-            logger.debug(f"Adding {k}: {v} to detected object {obj.id}")
-            setattr(obj, k, v)
+    object_ids = [row["id"] for row in rows]
+    is_moth = DetectedObject.binary_label == constants.POSITIVE_BINARY_LABEL
 
-        orm_objects.append(obj)
+    def count_moths():
+        # The moths of each session, and the objects with a species label
+        return {
+            session_id: (num_moths, num_labelled)
+            for session_id, num_moths, num_labelled in sesh.execute(
+                sa.select(
+                    DetectedObject.monitoring_session_id,
+                    sa.func.coalesce(sa.func.sum(sa.case((is_moth, 1), else_=0)), 0),
+                    sa.func.count(DetectedObject.specific_label),
+                )
+                .where(DetectedObject.id.in_(object_ids))
+                .group_by(DetectedObject.monitoring_session_id)
+            )
+        }
 
+    before = count_moths()
+    with DetectedObjectQueue.track_counters(sesh, object_ids):
+        with UnclassifiedObjectQueue.track_counters(sesh, object_ids):
+            sesh.execute(sa.update(DetectedObject), rows)
+    after = count_moths()
+    image_ids = (
+        sesh.execute(
+            sa.select(DetectedObject.image_id)
+            .where(DetectedObject.id.in_(object_ids))
+            .distinct()
+        )
+        .scalars()
+        .all()
+    )
+    forget_image_stats(sesh, image_ids)
+
+    session_ids = set(before) | set(after)
+    change_session_aggregates(
+        sesh,
+        {
+            session_id: {
+                "num_moths": after.get(session_id, (0, 0))[0]
+                - before.get(session_id, (0, 0))[0]
+            }
+            for session_id in session_ids
+        },
+    )
+    # Only batches that change species labels count the species again
+    species_session_ids = [
+        session_id
+        for session_id in session_ids
+        if before.get(session_id, (0, 0))[1] or after.get(session_id, (0, 0))[1]
+    ]
+    if species_session_ids:
+        update_session_aggregates(sesh, species_session_ids, totals=["num_species"])
+
+
+@retry_on_locked
+def save_classified_objects(db_path, object_ids, classified_objects_data, writer=None):
+    """
+    Update detected objects with their classification results, e.g. the
+    `binary_label`, `binary_label_score`, `specific_label`, `specific_label_score`,
+    `in_queue` and `model_name` fields.
+
+    With a `DatabaseWriter`, the update is added to its next transaction
+    and this returns without waiting for it to be committed.
+    """
+    rows = [
+        {"id": object_id, **object_data}
+        for object_id, object_data in zip(object_ids, classified_objects_data)
+    ]
+    if not rows:
+        return
+
+    if writer:
+        writer.submit(update_classified_objects, rows)
+        return
+
+    start = time.time()
     with db.get_session(db_path) as sesh:
-        logger.info(f"Bulk saving {len(orm_objects)} objects")
-        sesh.bulk_save_objects(orm_objects)
+        update_classified_objects(sesh, rows)
         sesh.commit()
+    seconds = time.time() - start
+    logger.info(
+        f"Bulk saved {len(rows)} classified objects in {seconds:.2f} seconds "
+        f"({len(rows) / seconds:.0f} objects/sec)"
+    )
 
 
 def get_detected_objects(
@@ -222,28 +504,135 @@ def get_detected_objects(
     if monitoring_session:
         query_kwargs["monitoring_session_id"] = monitoring_session.id
 
+    deployment_id = get_deployment_id(db_path, image_base_path)
+    if deployment_id is None:
+        return []
+
     with db.get_session(db_path) as sesh:
         return (
             sesh.query(DetectedObject)
-            .filter_by(**query_kwargs)
-            .filter(MonitoringSession.base_directory == str(image_base_path))
-            .join(
-                MonitoringSession,
-                MonitoringSession.id == DetectedObject.monitoring_session_id,
-            )
+            .filter_by(deployment_id=deployment_id, **query_kwargs)
             .offset(offset)
             .limit(limit)
         ).all()
 
 
+def iter_detection_reports(
+    db_path,
+    image_base_path: FilePath,
+    monitoring_session=None,
+    limit=None,
+    offset=0,
+    page_size=EXPORT_PAGE_SIZE,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield the `report_data` of each detected object of a deployment, in order
+    of ID, without loading the objects.
+
+    Only the columns of the report are selected. The objects are read in pages
+    that start after the last ID of the previous page (keyset pagination), each
+    in its own short transaction, so memory use and the time to read a page
+    don't grow with the number of objects.
+    """
+    deployment_id = get_deployment_id(db_path, image_base_path)
+    if deployment_id is None:
+        return
+
+    where = DetectedObject.deployment_id == deployment_id
+    if monitoring_session:
+        where = where & (DetectedObject.monitoring_session_id == monitoring_session.id)
+    query = (
+        sa.select(
+            DetectedObject.id,
+            MonitoringSession.base_directory,
+            MonitoringSession.day,
+            TrapImage.base_path,
+            TrapImage.path.label("image_path"),
+            TrapImage.timestamp,
+            TrapImage.width,
+            TrapImage.height,
+            DetectedObject.path,
+            DetectedObject.bbox,
+            DetectedObject.area_pixels,
+            DetectedObject.model_name,
+            DetectedObject.specific_label,
+            DetectedObject.specific_label_score,
+            DetectedObject.binary_label,
+            DetectedObject.binary_label_score,
+        )
+        .join(TrapImage, DetectedObject.image_id == TrapImage.id)
+        .join(
+            MonitoringSession,
+            DetectedObject.monitoring_session_id == MonitoringSession.id,
+        )
+        .where(where)
+        .order_by(DetectedObject.id)
+    )
+
+    start = time.time()
+    num_records = 0
+    last_id = None
+    while limit is None or num_records < limit:
+        n = page_size if limit is None else min(page_size, limit - num_records)
+        if last_id is None:
+            page = query.offset(offset).limit(n)
+        else:
+            page = query.where(DetectedObject.id > last_id).limit(n)
+        with db.get_session(db_path) as sesh:
+            rows = sesh.execute(page).all()
+
+        for row in rows:
+            if row.specific_label:
+                label = row.specific_label
+                score = row.specific_label_score
+            else:
+                label = row.binary_label
+                score = row.binary_label_score
+            yield {
+                "trap": pathlib.Path(row.base_directory).name,
+                "event": row.day.isoformat(),
+                "source_image": pathlib.Path(str(row.base_path)) / str(row.image_path),
+                "cropped_image": row.path,
+                "timestamp": row.timestamp.isoformat(),
+                "bbox": row.bbox,
+                "bbox_center": bbox_center(row.bbox) if row.bbox else None,
+                "bbox_relative": (
+                    bbox_relative(row.bbox, row.width, row.height) if row.bbox else None
+                ),
+                "area_pixels": row.area_pixels,
+                "model_name": row.model_name,
+                "category_label": label,
+                "category_score": score,
+            }
+
+        num_records += len(rows)
+        if len(rows) < n:
+            break
+        last_id = rows[-1].id
+
+    seconds = time.time() - start
+    logger.info(
+        f"Exported {num_records} detected objects in {seconds:.2f} seconds "
+        f"({num_records / max(seconds, 0.001):.0f} objects/sec)"
+    )
+
+
 def get_objects_for_image(db_path, image_id):
     with db.get_session(db_path) as sesh:
         return sesh.query(DetectedObject.binary_label).filter_by(image_id=image_id)
 
 
 def delete_objects_for_image(db_path, image_id):
+    from trapdata.db.models.queue import clear_queue_counters
+
     with db.get_session(db_path) as sesh:
         sesh.query(DetectedObject).filter_by(image_id=image_id).delete()
+        clear_queue_counters(sesh)
+        forget_image_stats(sesh, [image_id])
+        update_session_aggregates(
+            sesh,
+            sa.select(TrapImage.monitoring_session_id).where(TrapImage.id == image_id),
+        )
         sesh.commit()
 
 
@@ -307,31 +696,102 @@ def get_objects_for_species(db_path, species_label, monitoring_session=None):
         return sesh.execute(query).unique().all()
 
 
-def get_object_counts_for_image(db_path, image_id):
-    # @TODO this could all be one query. It runs on every frame of the playback.
-
-    # Every object detected
-    num_objects = get_objects_for_image(db_path, image_id).count()
-
-    # Every object that is a moth
-    num_detections = get_detections_for_image(db_path, image_id).count()
+def forget_image_stats(sesh, image_ids: Optional[Sequence[int]] = None):
+    """
+    Remove the cached stats of some images, or of every image, once the
+    session commits. Call this whenever an image's objects or queue state
+    change.
+    """
+    image_ids = list(image_ids) if image_ids is not None else None
+    url = str(sesh.get_bind().url)
+
+    def forget(_):
+        global _image_stats_version
+        with _image_stats_lock:
+            _image_stats_version += 1
+            if image_ids is None:
+                keys = [key for key in _image_stats if key[0] == url]
+            else:
+                keys = [(url, image_id) for image_id in image_ids]
+            for key in keys:
+                _image_stats.pop(key, None)
+
+    sa.event.listen(sesh, "after_commit", forget, once=True)
+
+
+def count_objects_for_image(sesh, image_id) -> dict[str, Any]:
+    """
+    Count the objects of an image with one query.
+    """
+    is_moth = DetectedObject.binary_label == constants.POSITIVE_BINARY_LABEL
+    is_classified = is_moth & DetectedObject.specific_label.is_not(None)
+
+    def total(condition):
+        return sa.func.coalesce(sa.func.sum(sa.case((condition, 1), else_=0)), 0)
+
+    row = sesh.execute(
+        sa.select(
+            TrapImage.last_processed,
+            TrapImage.in_queue,
+            # Every object detected
+            sa.func.count(DetectedObject.id),
+            # Every object that is a moth
+            total(is_moth),
+            # Every object that has been classified to taxa level
+            total(is_classified),
+            # Unique taxa names
+            sa.func.count(DetectedObject.specific_label.distinct()),
+        )
+        .outerjoin(DetectedObject, DetectedObject.image_id == TrapImage.id)
+        .where(TrapImage.id == image_id)
+        .group_by(TrapImage.id)
+    ).one_or_none()
+    if not row:
+        row = (None, None, 0, 0, 0, 0)
+    last_processed, in_queue, objects, detections, classifications, species = row
 
-    # Every object that has been classified to taxa level
-    num_classifications = get_classifications_for_image(db_path, image_id).count()
+    return {
+        "num_objects": objects,
+        "num_detections": detections,
+        "num_species": species,
+        "num_classifications": classifications,
+        # Has every object detected in this image been fully processed?
+        "completely_classified": bool(
+            last_processed and not in_queue and classifications == detections
+        ),
+    }
 
-    # Unique taxa names
-    num_species = get_species_for_image(db_path, image_id).count()
 
-    # Has every object detected in this image been fully processed?
-    is_completely_classified = completely_classified(db_path, image_id)
+def get_object_counts_for_image(db_path, image_id):
+    """
+    Return the object counts of an image, from the cache if they have not
+    changed since they were last counted. Runs on every frame of the playback.
+
+    Writes in this process remove the counts they change from the cache, and
+    the counts expire after `IMAGE_STATS_TTL` seconds, for the writes of other
+    processes.
+    """
+    key = (str(db.get_db(db_path).url), image_id)
+    with _image_stats_lock:
+        if key in _image_stats:
+            stats, counted_at = _image_stats[key]
+            if time.monotonic() - counted_at < IMAGE_STATS_TTL:
+                _image_stats.move_to_end(key)
+                return dict(stats)
+            del _image_stats[key]
+        version = _image_stats_version
+
+    counted_at = time.monotonic()
+    with db.get_session(db_path) as sesh:
+        stats = count_objects_for_image(sesh, image_id)
 
-    return {
-        "num_objects": num_objects,
-        "num_detections": num_detections,
-        "num_species": num_species,
-        "num_classifications": num_classifications,
-        "completely_classified": is_completely_classified,
-    }
+    with _image_stats_lock:
+        # Don't cache counts that changed while they were being read
+        if version == _image_stats_version:
+            _image_stats[key] = (stats, counted_at)
+            if len(_image_stats) > IMAGE_STATS_CACHE_SIZE:
+                _image_stats.popitem(last=False)
+    return dict(stats)
 
 
 def export_detected_objects(
@@ -339,5 +799,5 @@ def export_detected_objects(
     directory: Union[pathlib.Path, str],
     report_name: str = "detections",
 ):
-    records = [item.report_data() for item in items]
+    records = (item.report_data() for item in items)
     return export_report(records, report_name, directory)
@@ -1,16 +1,33 @@
+import collections
+import itertools
+import operator
 import pathlib
 import datetime
-from typing import Optional, Union, Iterable, Any
+from typing import Optional, Union, Iterable, Iterator, Any, Sequence
 
 import sqlalchemy as sa
 from sqlalchemy import orm
-from sqlalchemy_utils import aggregated, observes
 
 from trapdata.db import Base, get_session
+from trapdata.db.base import insert_or_ignore
+from trapdata import constants
 from trapdata.common.logs import logger
 from trapdata.common.utils import export_report
-from trapdata.db.models.images import TrapImage
-from trapdata.common.filemanagement import find_images, group_images_by_day
+from trapdata.db.models.images import TrapImage, link_duplicate_images
+from trapdata.db.models.deployments import (
+    get_or_create_deployment,
+    normalize_base_directory,
+)
+from trapdata.common.filemanagement import (
+    TimestampSource,
+    scan_images,
+    get_folder_date,
+    sort_images_by_time,
+    iter_image_groups,
+    iter_folder_groups,
+    group_images_by_day,
+    group_images_by_folder,
+)
 
 
 # Rename to TrapEvent? CapturePeriod? less confusing with other types of Sessions. CaptureSession? Or SurveyEvent or Survey?
@@ -19,28 +36,24 @@ class MonitoringSession(Base):
 
     id = sa.Column(sa.Integer, primary_key=True)
     day = sa.Column(sa.Date)
-    # @TODO instead of base directory, we can now use a Trap object to group sessions
+    deployment_id = sa.Column(sa.ForeignKey("deployments.id"))
     base_directory = sa.Column(sa.String(255))
     start_time = sa.Column(sa.DateTime(timezone=True))
     end_time = sa.Column(sa.DateTime(timezone=True))
-    # num_species = sa.Column(sa.Integer)
+    # Totals that are kept up to date by `update_session_aggregates`
+    num_images = sa.Column(sa.Integer)
+    num_processed_images = sa.Column(sa.Integer)
+    num_detected_objects = sa.Column(sa.Integer)
+    num_moths = sa.Column(sa.Integer)
+    num_species = sa.Column(sa.Integer)
     notes = sa.Column(sa.JSON)
 
-    @aggregated("images", sa.Column(sa.Integer))
-    def num_images(self):
-        return sa.func.count("1")
-
-    @aggregated("detected_objects", sa.Column(sa.Integer))
-    def num_detected_objects(self):
-        return sa.func.count("1")
+    __table_args__ = (
+        sa.Index("ix_monitoring_sessions_base_directory", base_directory, day),
+        sa.Index("ix_monitoring_sessions_deployment_id", deployment_id, day),
+    )
 
-    # This runs an expensive/slow query every time an image is updated
-    # @observes("images")
-    # def image_observer(self, images):
-    #     timestamps = sorted([img.timestamp for img in images if img.timestamp])
-    #     if timestamps:
-    #         self.start_time = timestamps[0]
-    #         self.end_time = timestamps[-1]
+    deployment = orm.relationship("Deployment")
 
     images = orm.relationship(
         "TrapImage",
@@ -67,12 +80,17 @@ class MonitoringSession(Base):
         )
 
     def update_aggregates(self):
-        # Requires and active session
+        # Requires an active session
         logger.info(f"Updating cached values for {self}")
-        self.num_images = len(self.images)
-        self.num_detected_objects = len(self.detected_objects)
-        self.start_time: datetime.datetime = self.images[0].timestamp
-        self.end_time: datetime.datetime = self.images[-1].timestamp
+        sesh = orm.object_session(self)
+        update_session_aggregates(sesh, [self.id])
+        sesh.refresh(self)
+
+    @property
+    def processed_fraction(self) -> float:
+        if not self.num_images:
+            return 0.0
+        return (self.num_processed_images or 0) / self.num_images
 
     def duration(self) -> Optional[datetime.timedelta]:
         if self.start_time and self.end_time:
@@ -84,7 +102,7 @@ class MonitoringSession(Base):
     def duration_label(self):
         duration = self.duration()
         if duration:
-            hours = int(round(duration.seconds / 60 / 60, 0))
+            hours = int(round(duration.total_seconds() / 60 / 60, 0))
             unit = "hour" if hours == 1 else "hours"
             duration = f"{hours} {unit}"
         else:
@@ -92,13 +110,14 @@ class MonitoringSession(Base):
         return duration
 
     def report_data(self) -> dict[str, Any]:
-
         duration = self.duration()
 
         return {
             "trap": pathlib.Path(str(self.base_directory)).name,
             "event": self.day.isoformat(),
-            "duration_minutes": int(round(duration.seconds / 60, 0)) if duration else 0,
+            "duration_minutes": int(round(duration.total_seconds() / 60, 0))
+            if duration
+            else 0,
             "duration_label": self.duration_label,
             "num_images": self.num_images,
             "num_detected_objects": self.num_detected_objects,
@@ -107,104 +126,511 @@ class MonitoringSession(Base):
         }
 
 
-def save_monitoring_session(db_path, base_directory, session):
-    # @TODO find & save all images to the DB first, then
-    # group by timestamp and construct monitoring sessions. window function?
-    with get_session(db_path) as sesh:
-        ms_kwargs = {"base_directory": str(base_directory), "day": session["day"]}
-        ms = sesh.query(MonitoringSession).filter_by(**ms_kwargs).one_or_none()
+# Images inserted with each statement when saving monitoring sessions
+INGEST_BATCH_SIZE = 5000
 
-        if ms:
-            logger.debug(f"Found existing Monitoring Session in db: {ms}")
-        else:
-            ms = MonitoringSession(**ms_kwargs)
-            logger.debug(f"Adding new Monitoring Session to db: {ms}")
-            sesh.add(ms)
-            sesh.flush()
 
-        num_existing_images = (
-            sesh.query(TrapImage).filter_by(monitoring_session_id=ms.id).count()
+def get_or_create_session_ids(sesh, deployment, days) -> dict[datetime.date, int]:
+    """
+    Return the IDs of the monitoring sessions of a deployment for each day,
+    adding the sessions that don't exist yet. Does not commit.
+    """
+    base_directory = deployment.base_directory
+    session_ids = dict(
+        sesh.execute(
+            sa.select(MonitoringSession.day, MonitoringSession.id).where(
+                MonitoringSession.base_directory == base_directory
+            )
+        ).all()
+    )
+    new_sessions = [
+        MonitoringSession(
+            deployment_id=deployment.id, base_directory=base_directory, day=day
         )
-        if session["num_images"] > num_existing_images:
-            logger.info(
-                f"session images: {session['num_images']}, saved count: {num_existing_images}"
+        for day in set(days) - set(session_ids)
+    ]
+    if new_sessions:
+        logger.debug(f"Adding {len(new_sessions)} new Monitoring Sessions to db")
+        sesh.add_all(new_sessions)
+        sesh.flush()
+        session_ids |= {ms.day: ms.id for ms in new_sessions}
+    return session_ids
+
+
+def ingest_monitoring_sessions(
+    sesh, base_directory, sessions, queue: bool = False
+) -> dict[str, int]:
+    """
+    Save the images of some monitoring sessions found in a directory. Does
+    not commit. Set `queue` to add the new images to the processing queue.
+
+    The images already saved with the same paths are loaded in large batches
+    and compared by path. New images are inserted in large batches, and
+    images whose file size or monitoring session changed are updated, e.g.
+    if a file was replaced, as are images saved without their dimensions.
+    This does not delete missing images.
+
+    Images read with their `content_hash` (see `hash_images`) are linked to
+    the first saved image with the same contents, and only that one is
+    processed. An image whose hash changed was replaced in place, so its
+    detected objects are deleted and it is processed again.
+    """
+    from trapdata.db.models.detections import DetectedObject, forget_image_stats
+    from trapdata.db.models.queue import ImageQueue, clear_queue_counters
+
+    deployment = get_or_create_deployment(sesh, base_directory)
+    base_path = deployment.base_directory
+    session_ids = get_or_create_session_ids(
+        sesh, deployment, [session["day"] for session in sessions]
+    )
+    images = [
+        (
+            session_ids[session["day"]],
+            str(pathlib.Path(image["path"]).relative_to(base_directory)),
+            image,
+        )
+        for session in sessions
+        for image in session["images"]
+    ]
+    existing = {}
+    for i in range(0, len(images), INGEST_BATCH_SIZE):
+        paths = [path for _, path, _ in images[i : i + INGEST_BATCH_SIZE]]
+        existing |= {
+            path: values
+            for path, *values in sesh.execute(
+                sa.select(
+                    TrapImage.path,
+                    TrapImage.id,
+                    TrapImage.monitoring_session_id,
+                    TrapImage.filesize,
+                    TrapImage.width,
+                    TrapImage.content_hash,
+                ).where(
+                    TrapImage.base_path == base_path,
+                    TrapImage.path.in_(paths),
+                )
             )
-            # Compare the number of images known in this session
-            # Only scan & add images if there is a difference.
-            # This does not delete missing images.
-            ms_images = []
-            for image in session["images"]:
-                path = pathlib.Path(image["path"]).relative_to(ms.base_directory)
-                absolute_path = pathlib.Path(ms.base_directory) / path
-                img_kwargs = {
-                    "monitoring_session_id": ms.id,
-                    "base_path": ms.base_directory,
-                    "path": str(path),
-                    "timestamp": image["timestamp"],
-                    "filesize": absolute_path.stat().st_size,
-                    # file hash?
+        }
+
+    new_images = []
+    changed_images = []
+    replaced_ids = []
+    moved_ids = collections.defaultdict(list)
+    changed_session_ids = set()
+    content_hashes = set()
+    for ms_id, path, image in images:
+        filesize = image.get("filesize")
+        if filesize is None:
+            filesize = (pathlib.Path(base_directory) / path).stat().st_size
+        content_hash = image.get("content_hash")
+        if content_hash:
+            content_hashes.add(content_hash)
+        values = {
+            "monitoring_session_id": ms_id,
+            "timestamp": image["timestamp"],
+            "filesize": filesize,
+            "width": image.get("width"),
+            "height": image.get("height"),
+            "content_hash": content_hash,
+        }
+        if path not in existing:
+            new_images.append(
+                {
+                    "deployment_id": deployment.id,
+                    "base_path": base_path,
+                    "path": path,
+                    "in_queue": queue,
+                    **values,
                 }
-                db_img = sesh.query(TrapImage).filter_by(**img_kwargs).one_or_none()
-                if db_img:
-                    # logger.debug(f"Found existing Image in db: {img}")
-                    pass
-                else:
-                    db_img = TrapImage(**img_kwargs)
-                    logger.debug(f"Adding new Image to db: {db_img}")
-                ms_images.append(db_img)
-            logger.info(f"Bulk saving {len(ms_images)} objects")
-            sesh.bulk_save_objects(ms_images)
-
-            # Manually update aggregate & cached values after bulk update
-            ms.update_aggregates()
+            )
+            changed_session_ids.add(ms_id)
+            continue
+        (
+            image_id,
+            existing_ms_id,
+            existing_filesize,
+            existing_width,
+            existing_hash,
+        ) = existing[path]
+        if content_hash is None:
+            values["content_hash"] = existing_hash
+        elif existing_hash and content_hash != existing_hash:
+            logger.info(f"Image was replaced, processing it again: {path}")
+            replaced_ids.append(image_id)
+            content_hashes.add(existing_hash)
+        if (
+            (existing_ms_id, existing_filesize) != (ms_id, filesize)
+            or (existing_width is None and values["width"] is not None)
+            or existing_hash != values["content_hash"]
+        ):
+            changed_images.append({"id": image_id, **values})
+            changed_session_ids |= {ms_id, existing_ms_id}
+            if ms_id != existing_ms_id:
+                moved_ids[ms_id].append(image_id)
+
+    logger.info(
+        f"Saving {len(new_images)} new and {len(changed_images)} changed images "
+        f"of {len(sessions)} monitoring sessions"
+    )
+    # The unique index on the path skips images that were saved by another
+    # process since they were loaded.
+    for i in range(0, len(new_images), INGEST_BATCH_SIZE):
+        sesh.execute(
+            insert_or_ignore(sesh, TrapImage),
+            new_images[i : i + INGEST_BATCH_SIZE],
+        )
+    if changed_images:
+        sesh.execute(sa.update(TrapImage), changed_images)
+    for ms_id, image_ids in moved_ids.items():
+        # The objects of an image belong to the same session
+        sesh.execute(
+            sa.update(DetectedObject)
+            .where(DetectedObject.image_id.in_(image_ids))
+            .values(monitoring_session_id=ms_id, deployment_id=deployment.id)
+            .execution_options(synchronize_session=False)
+        )
+    queued_ids = []
+    if replaced_ids:
+        # Replaced images that were queued or processed are processed again,
+        # and so are the copies of their previous contents (see
+        # `link_duplicate_images`)
+        queued_ids = (
+            sesh.execute(
+                sa.select(TrapImage.id).where(
+                    TrapImage.id.in_(replaced_ids),
+                    sa.or_(TrapImage.in_queue, TrapImage.last_processed.is_not(None)),
+                )
+            )
+            .scalars()
+            .all()
+        )
+        # The objects detected in the previous contents of the files
+        sesh.execute(
+            sa.delete(DetectedObject).where(DetectedObject.image_id.in_(replaced_ids))
+        )
+        sesh.execute(
+            sa.update(TrapImage)
+            .where(TrapImage.id.in_(replaced_ids))
+            .values(
+                last_processed=None,
+                in_queue=queue or TrapImage.id.in_(queued_ids),
+                num_detected_objects=0,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        forget_image_stats(sesh, replaced_ids)
+
+    num_duplicates = link_duplicate_images(sesh, content_hashes, queued_ids)
+    if num_duplicates:
+        logger.info(f"Found {num_duplicates} copies of images that were saved before")
+    if num_duplicates or replaced_ids:
+        # Copies may be in other deployments, and the copies of a replaced
+        # image are processed by themselves again
+        clear_queue_counters(sesh, ImageQueue.key)
+        forget_image_stats(sesh)
+
+    if changed_session_ids:
+        # Manually update aggregate & cached values after bulk update
+        update_session_aggregates(sesh, list(changed_session_ids))
+        clear_queue_counters(sesh, deployment_id=deployment.id)
+
+    return {
+        "new_images": len(new_images),
+        "changed_images": len(changed_images),
+        "replaced_images": len(replaced_ids),
+        "duplicate_images": num_duplicates,
+    }
 
+
+def save_monitoring_session(db_path, base_directory, session):
+    with get_session(db_path) as sesh:
+        ingest_monitoring_sessions(sesh, base_directory, [session])
         logger.debug("Committing changes to DB")
         sesh.commit()
         logger.debug("Done committing")
 
 
-def save_monitoring_sessions(db_path, base_directory, sessions):
+def update_session_aggregates(
+    sesh,
+    session_ids: Union[Sequence[int], sa.Select, None] = None,
+    totals: Optional[Sequence[str]] = None,
+):
+    """
+    Recount the images, detected objects and species of some monitoring
+    sessions, or of all of them, with one UPDATE statement. `session_ids` can
+    also be a query that selects the IDs. Set `totals` to only count some of
+    the columns, e.g. `["num_species"]`. Does not commit.
+
+    Every total is counted from an index on the `monitoring_session_id` of
+    the images or objects, without loading them, but that still reads every
+    image or object of the sessions. The pipeline adds the changes made by
+    each batch with `change_session_aggregates` instead.
+    """
+    from trapdata.db.models.detections import DetectedObject
+
+    def images(column):
+        return (
+            sa.select(column)
+            .where(TrapImage.monitoring_session_id == MonitoringSession.id)
+            .scalar_subquery()
+        )
+
+    def objects(column, *where):
+        return (
+            sa.select(column)
+            .where(DetectedObject.monitoring_session_id == MonitoringSession.id, *where)
+            .scalar_subquery()
+        )
+
+    is_moth = DetectedObject.binary_label == constants.POSITIVE_BINARY_LABEL
+    values = {
+        "num_images": images(sa.func.count(TrapImage.id)),
+        "num_processed_images": images(sa.func.count(TrapImage.last_processed)),
+        "start_time": images(sa.func.min(TrapImage.timestamp)),
+        "end_time": images(sa.func.max(TrapImage.timestamp)),
+        "num_detected_objects": objects(sa.func.count(DetectedObject.id)),
+        "num_moths": objects(sa.func.count(DetectedObject.id), is_moth),
+        "num_species": objects(
+            sa.func.count(DetectedObject.specific_label.distinct()), is_moth
+        ),
+    }
+    if totals is not None:
+        values = {name: values[name] for name in totals}
+    query = sa.update(MonitoringSession).values(values)
+    if session_ids is not None:
+        query = query.where(MonitoringSession.id.in_(session_ids))
+    sesh.execute(query.execution_options(synchronize_session=False))
+
+
+def change_session_aggregates(sesh, changes: dict[int, dict[str, int]]) -> None:
+    """
+    Add the changes made by a batch of writes to the totals of each
+    monitoring session, e.g. `{session_id: {"num_moths": 2}}`, without
+    counting the rest of the session again. Does not commit.
+    """
+    for session_id, change in changes.items():
+        values = {
+            name: sa.func.coalesce(getattr(MonitoringSession, name), 0) + n
+            for name, n in change.items()
+            if n
+        }
+        if values:
+            sesh.execute(
+                sa.update(MonitoringSession)
+                .where(MonitoringSession.id == session_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
 
-    for session in sessions:
-        save_monitoring_session(db_path, base_directory, session)
 
+def ingest_session_batches(
+    db_path, base_directory, sessions, batch_size=INGEST_BATCH_SIZE, queue=False
+) -> dict[str, int]:
+    """
+    Save monitoring sessions from a list or a generator, committing after
+    each batch of about `batch_size` images. Only one batch is held in
+    memory, and other connections can write to the database in between.
+    Saving a batch again is harmless, so an interrupted scan can be resumed.
+    """
+    counts = {
+        "new_images": 0,
+        "changed_images": 0,
+        "replaced_images": 0,
+        "duplicate_images": 0,
+    }
+    batch = []
+    num_images = 0
+    sessions = iter(sessions)
+    while True:
+        session = next(sessions, None)
+        if session:
+            batch.append(session)
+            num_images += len(session["images"])
+        if batch and (num_images >= batch_size or session is None):
+            with get_session(db_path) as sesh:
+                batch_counts = ingest_monitoring_sessions(
+                    sesh, base_directory, batch, queue=queue
+                )
+                sesh.commit()
+            for name, count in batch_counts.items():
+                counts[name] += count
+            batch = []
+            num_images = 0
+        if session is None:
+            return counts
+
+
+def save_monitoring_sessions(
+    db_path, base_directory, sessions, batch_size=INGEST_BATCH_SIZE
+):
+    ingest_session_batches(db_path, base_directory, sessions, batch_size)
     return get_monitoring_sessions_from_db(db_path, base_directory)
 
 
-def get_monitoring_sessions_from_filesystem(base_directory):
+def make_session(base_directory, day, images) -> dict[str, Any]:
+    return {
+        "base_directory": str(base_directory),
+        "day": day,
+        "num_images": len(images),
+        "start_time": images[0]["timestamp"],
+        "end_time": images[-1]["timestamp"],
+        "images": images,
+    }
+
+
+def make_sessions(base_directory, groups) -> list[dict[str, Any]]:
+    sessions = [
+        make_session(base_directory, day, images) for day, images in groups.items()
+    ]
+    sessions.sort(key=lambda s: s["day"])
+    return sessions
+
+
+def group_images(
+    base_directory,
+    images,
+    timestamps: TimestampSource = TimestampSource.exif,
+    maximum_gap_minutes=6 * 60,
+):
+    """
+    Group images into nightly folders if their timestamps were read from
+    their names, otherwise by the gaps between them.
+    """
+    if timestamps == TimestampSource.filename:
+        return group_images_by_folder(base_directory, images, maximum_gap_minutes)
+    else:
+        return group_images_by_day(images, maximum_gap_minutes)
+
+
+def get_monitoring_sessions_from_filesystem(
+    base_directory, timestamps: TimestampSource = TimestampSource.exif
+):
     # @TODO can we use the sqlalchemy classes for sessions & images before
     # they are saved to the DB?
-    images = find_images(base_directory)
-    sessions = []
-    groups = group_images_by_day(images)
-    for day, images in groups.items():
-        sessions.append(
-            {
-                "base_directory": str(base_directory),
-                "day": day,
-                "num_images": len(images),
-                "start_time": images[0]["timestamp"],
-                "end_time": images[-1]["timestamp"],
-                "images": images,
-            }
+    images = scan_images(base_directory, timestamps=timestamps)
+    groups = group_images(base_directory, images, timestamps)
+    return make_sessions(base_directory, groups)
+
+
+def iter_monitoring_sessions_from_filesystem(
+    base_directory,
+    timestamps: TimestampSource = TimestampSource.exif,
+    maximum_gap_minutes=6 * 60,
+) -> Iterator[dict[str, Any]]:
+    """
+    Find the monitoring sessions in a directory one at a time, without
+    holding all of their images in memory. Save them with
+    `save_monitoring_sessions`.
+
+    More than one session can be yielded for the same day, e.g. if images
+    were taken before and after a long gap, they are saved to the same
+    monitoring session.
+    """
+    images = scan_images(base_directory, timestamps=timestamps)
+    if timestamps == TimestampSource.filename:
+        groups = iter_folder_groups(base_directory, images, maximum_gap_minutes)
+    else:
+        groups = iter_image_groups(sort_images_by_time(images), maximum_gap_minutes)
+    for day, day_images in groups:
+        yield make_session(base_directory, day, day_images)
+
+
+def group_new_images(
+    sesh,
+    base_directory,
+    images,
+    maximum_gap_minutes=6 * 60,
+    timestamps: TimestampSource = TimestampSource.exif,
+) -> Iterator[dict[str, Any]]:
+    """
+    Group images that were found since a directory was last scanned. Images
+    taken during a saved monitoring session, or less than the maximum gap
+    before or after it, are added to it. The others are grouped into new
+    sessions, like a full scan does. With `TimestampSource.filename`, images
+    in nightly folders always go to the session for the date of the folder.
+
+    The saved sessions are loaded right away. The images are sorted and
+    grouped as the sessions are read, like
+    `iter_monitoring_sessions_from_filesystem` does.
+    """
+    gap = datetime.timedelta(minutes=maximum_gap_minutes)
+    saved_sessions = sesh.execute(
+        sa.select(
+            MonitoringSession.start_time,
+            MonitoringSession.end_time,
+            MonitoringSession.day,
         )
-    sessions.sort(key=lambda s: s["day"])
-    return sessions
+        .where(
+            MonitoringSession.base_directory
+            == normalize_base_directory(base_directory),
+            MonitoringSession.start_time.is_not(None),
+        )
+        .order_by(MonitoringSession.start_time)
+    ).all()
+    starts = [start_time - gap for start_time, _, _ in saved_sessions]
+
+    def find_saved_days(images):
+        # The day of the saved session each image belongs to, or None
+        i = -1
+        for image in images:
+            if timestamps == TimestampSource.filename and get_folder_date(
+                base_directory, image["path"]
+            ):
+                yield None, image
+                continue
+            timestamp = image["timestamp"]
+            if starts and starts[0].tzinfo is None:
+                # SQLite saves the local time without the offset
+                timestamp = timestamp.replace(tzinfo=None)
+            # The last session that starts before the image
+            while i + 1 < len(starts) and starts[i + 1] <= timestamp:
+                i += 1
+            if i >= 0 and timestamp <= saved_sessions[i].end_time + gap:
+                yield saved_sessions[i].day, image
+            else:
+                yield None, image
+
+    def iter_sessions():
+        images_by_day = find_saved_days(sort_images_by_time(images))
+        for day, run in itertools.groupby(images_by_day, key=operator.itemgetter(0)):
+            run_images = (image for _, image in run)
+            if day:
+                yield make_session(base_directory, day, list(run_images))
+                continue
+            if timestamps == TimestampSource.filename:
+                groups = iter_folder_groups(
+                    base_directory, run_images, maximum_gap_minutes
+                )
+            else:
+                groups = iter_image_groups(run_images, maximum_gap_minutes)
+            for new_day, day_images in groups:
+                yield make_session(base_directory, new_day, day_images)
+
+    return iter_sessions()
 
 
 def get_monitoring_sessions_from_db(
     db_path: str,
     base_directory: Union[pathlib.Path, str, None] = None,
-    update_aggregates: bool = True,
+    update_aggregates: bool = False,
 ):
+    """
+    The totals of each session are saved with it. Set `update_aggregates`
+    to count them again, e.g. if images were changed outside of the app.
+    """
     query_kwargs = {}
 
     logger.info("Querying existing sessions in DB")
 
     if base_directory:
-        query_kwargs["base_directory"] = str(base_directory)
+        query_kwargs["base_directory"] = normalize_base_directory(base_directory)
 
     with get_session(db_path) as sesh:
+        if update_aggregates:
+            update_session_aggregates(
+                sesh, sa.select(MonitoringSession.id).filter_by(**query_kwargs)
+            )
+            sesh.commit()
         items = (
             sesh.query(MonitoringSession)
             .filter_by(
@@ -212,8 +638,6 @@ def get_monitoring_sessions_from_db(
             )
             .all()
         )
-        if update_aggregates:
-            [item.update_aggregates() for item in items]
         return items
 
 
@@ -221,16 +645,24 @@ def monitoring_sessions_exist(db_path, base_directory):
     with get_session(db_path) as sesh:
         return (
             sesh.query(MonitoringSession)
-            .filter_by(base_directory=str(base_directory))
+            .filter_by(base_directory=normalize_base_directory(base_directory))
             .count()
         )
 
 
-def get_or_create_monitoring_sessions(db_path, base_directory):
-    # @TODO Check if there are unprocessed images in monitoring session?
-    if not monitoring_sessions_exist(db_path, base_directory):
-        sessions = get_monitoring_sessions_from_filesystem(base_directory)
-        save_monitoring_sessions(db_path, base_directory, sessions)
+def get_or_create_monitoring_sessions(
+    db_path, base_directory, timestamps: TimestampSource = TimestampSource.exif
+):
+    """
+    Scan a directory for images that were added since it was last scanned,
+    and return all of its monitoring sessions.
+
+    The images are not hashed, so that opening a deployment stays quick.
+    `ami collect` hashes them to find copies and replaced files.
+    """
+    from trapdata.db.models.scans import rescan_deployment
+
+    rescan_deployment(db_path, base_directory, timestamps=timestamps, hashes=False)
     return get_monitoring_sessions_from_db(db_path, base_directory)
 
 
@@ -264,5 +696,5 @@ def export_monitoring_sessions(
     directory: Union[pathlib.Path, str],
     report_name: str = "monitoring_events",
 ):
-    records = [item.report_data() for item in items]
+    records = (item.report_data() for item in items)
     return export_report(records, report_name, directory)
@@ -14,14 +14,37 @@ class TrapImage(Base):
 
     id = sa.Column(sa.Integer, primary_key=True)
     monitoring_session_id = sa.Column(sa.ForeignKey("monitoring_sessions.id"))
+    deployment_id = sa.Column(sa.ForeignKey("deployments.id"))
     base_path = sa.Column(sa.String(255))
     path = sa.Column(sa.String(255))
     timestamp = sa.Column(sa.DateTime(timezone=True))
     filesize = sa.Column(sa.Integer)
+    width = sa.Column(sa.Integer)
+    height = sa.Column(sa.Integer)
     last_read = sa.Column(sa.DateTime)
     last_processed = sa.Column(sa.DateTime)
     in_queue = sa.Column(sa.Boolean, default=False)
     notes = sa.Column(sa.JSON)
+    # A digest of the file, see `hash_file`
+    content_hash = sa.Column(sa.String(32))
+    # The first image saved with the same contents, which is processed instead
+    duplicate_of_id = sa.Column(sa.ForeignKey("images.id"))
+
+    __table_args__ = (
+        sa.Index("ix_images_monitoring_session_id", monitoring_session_id, timestamp),
+        sa.Index("ix_images_last_processed", monitoring_session_id, last_processed),
+        sa.Index("ix_images_deployment_id", deployment_id, last_processed),
+        # Each file is only saved once, see `ingest_monitoring_sessions`
+        sa.Index("ix_images_base_path_path", base_path, path, unique=True),
+        # Only the images in the queue, which is usually a small fraction
+        sa.Index(
+            "ix_images_in_queue",
+            deployment_id,
+            sqlite_where=in_queue.is_(True),
+            postgresql_where=in_queue.is_(True),
+        ),
+        sa.Index("ix_images_content_hash", content_hash),
+    )
 
     @property
     def absolute_path(self, directory: Union[str, None] = None) -> pathlib.Path:
@@ -62,6 +85,68 @@ class TrapImage(Base):
         )
 
 
+def link_duplicate_images(sesh, content_hashes, queued_ids=(), batch_size=1000) -> int:
+    """
+    Link the images that have the same contents to the first one that was
+    saved, i.e. the one with the lowest ID, and remove the others from the
+    processing queue. Only the images with the given hashes are linked.
+
+    `queued_ids` are images that were queued or processed before their files
+    were replaced. A copy of their previous contents that becomes the first
+    of its hash is queued in their place, since it was never processed.
+    Returns the number of images that were linked to another one. Does not
+    commit.
+    """
+    queued_ids = list(queued_ids)
+    content_hashes = list(content_hashes)
+    num_linked = 0
+    for i in range(0, len(content_hashes), batch_size):
+        canonical_ids = dict(
+            sesh.execute(
+                sa.select(TrapImage.content_hash, sa.func.min(TrapImage.id))
+                .where(TrapImage.content_hash.in_(content_hashes[i : i + batch_size]))
+                .group_by(TrapImage.content_hash)
+            ).all()
+        )
+        if not canonical_ids:
+            continue
+        # Images that were replaced may no longer be the first of their hash
+        sesh.execute(
+            sa.update(TrapImage)
+            .where(
+                TrapImage.id.in_(canonical_ids.values()),
+                TrapImage.duplicate_of_id.is_not(None),
+            )
+            .values(
+                duplicate_of_id=None,
+                in_queue=sa.or_(
+                    TrapImage.in_queue,
+                    sa.and_(
+                        TrapImage.duplicate_of_id.in_(queued_ids),
+                        TrapImage.last_processed.is_(None),
+                    ),
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        canonical_id = sa.case(canonical_ids, value=TrapImage.content_hash)
+        result = sesh.execute(
+            sa.update(TrapImage)
+            .where(
+                TrapImage.content_hash.in_(canonical_ids),
+                TrapImage.id.not_in(canonical_ids.values()),
+                sa.or_(
+                    TrapImage.duplicate_of_id.is_(None),
+                    TrapImage.duplicate_of_id != canonical_id,
+                ),
+            )
+            .values(duplicate_of_id=canonical_id, in_queue=False)
+            .execution_options(synchronize_session=False)
+        )
+        num_linked += result.rowcount
+    return num_linked
+
+
 def get_image_with_objects(db_path, image_id):
     with get_session(db_path) as sesh:
         image_kwargs = {
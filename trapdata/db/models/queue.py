@@ -1,31 +1,160 @@
-from typing import Union, Sequence
+import contextlib
+import datetime
+import enum
+import os
+import socket
+import threading
+from typing import Sequence, Optional
 
 import sqlalchemy as sa
 
-from trapdata.db import get_session
+from trapdata.db import Base, get_session
+from trapdata.db.base import begin_write, insert_or_ignore, retry_on_locked
 from trapdata import logger
 from trapdata import constants
 from trapdata.common.types import FilePath
 from trapdata.db.models.images import TrapImage
-from trapdata.db.models.detections import DetectedObject
-from trapdata.db.models.events import MonitoringSession
+from trapdata.db.models.detections import DetectedObject, forget_image_stats
+from trapdata.db.models.deployments import get_deployment_id
+
+
+class JobState(str, enum.Enum):
+    waiting = "waiting"
+    leased = "leased"
+    done = "done"
+    failed = "failed"
+
+
+class QueueJob(Base):
+    """
+    An item of work in one of the processing queues.
+
+    Workers lease jobs for a limited time. Jobs are only deleted once the
+    results have been saved, so if a worker crashes or the app is closed, its
+    jobs are given to another worker when the lease expires. Failed jobs are
+    kept for troubleshooting.
+    """
+
+    __tablename__ = "queue_jobs"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    queue = sa.Column(sa.String(255), nullable=False)
+    item_id = sa.Column(sa.Integer, nullable=False)
+    state = sa.Column(sa.Enum(JobState), nullable=False, default=JobState.waiting)
+    worker = sa.Column(sa.String(255))
+    lease_expires_at = sa.Column(sa.DateTime)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    error = sa.Column(sa.String)
+    created_at = sa.Column(sa.DateTime, default=datetime.datetime.now)
+    updated_at = sa.Column(
+        sa.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+
+    __table_args__ = (
+        # Only one open job per item, even if several workers add jobs at once
+        sa.Index(
+            "ix_queue_jobs_open_item",
+            "queue",
+            "item_id",
+            unique=True,
+            sqlite_where=sa.text("state IN ('waiting', 'leased')"),
+            postgresql_where=sa.text("state IN ('waiting', 'leased')"),
+        ),
+        sa.Index("ix_queue_jobs_state", "queue", "state", "lease_expires_at"),
+    )
+
+    def __repr__(self):
+        return (
+            f"QueueJob(queue={self.queue!r}, item_id={self.item_id!r}, "
+            f"state={self.state!r}, worker={self.worker!r}, "
+            f"attempts={self.attempts!r})"
+        )
+
+
+class QueueCounter(Base):
+    """
+    The number of items in each state of a queue, for one deployment, so the
+    size of a queue can be read without counting its items.
+
+    The counts are updated in the same transaction as the items that change.
+    When items are changed in bulk, the counter is deleted instead, and the
+    items are counted again the next time it is read.
+    """
+
+    __tablename__ = "queue_counters"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    queue = sa.Column(sa.String(255), nullable=False)
+    deployment_id = sa.Column(sa.ForeignKey("deployments.id"), nullable=False)
+    waiting = sa.Column(sa.Integer, nullable=False, default=0)
+    leased = sa.Column(sa.Integer, nullable=False, default=0)
+    done = sa.Column(sa.Integer, nullable=False, default=0)
+    unprocessed = sa.Column(sa.Integer, nullable=False, default=0)
+    updated_at = sa.Column(
+        sa.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+
+    __table_args__ = (
+        sa.Index(
+            "ix_queue_counters_queue_deployment_id",
+            "queue",
+            "deployment_id",
+            unique=True,
+        ),
+    )
+
+    def __repr__(self):
+        return (
+            f"QueueCounter(queue={self.queue!r}, "
+            f"deployment_id={self.deployment_id!r}, waiting={self.waiting!r}, "
+            f"leased={self.leased!r}, done={self.done!r}, "
+            f"unprocessed={self.unprocessed!r})"
+        )
+
+
+COUNTER_STATES = ["waiting", "leased", "done", "unprocessed"]
 
 
 class QueueManager:
     name = "Unnamed Queue"
+    key = "unnamed"  # Name of the queue in the jobs table
     base_directory: FilePath
+    lease_seconds = 5 * 60
+    max_attempts = 3
 
     def __init__(self, db_path: str, base_directory: FilePath):
         self.db_path = db_path
         self.base_directory = base_directory
+        self._deployment_id = None
+
+    @property
+    def deployment_id(self) -> Optional[int]:
+        """
+        The deployment of the images in the base directory, once they have been
+        scanned.
+        """
+        if self._deployment_id is None:
+            self._deployment_id = get_deployment_id(self.db_path, self.base_directory)
+        return self._deployment_id
+
+    def in_deployment(self) -> sa.ColumnElement[bool]:
+        """
+        Return the condition for items to be in the scope of this queue.
+        """
+        if self.deployment_id is None:
+            return sa.false()
+        ModelClass = self.get_model()
+        return (ModelClass.deployment_id == self.deployment_id) & self.in_scope()
 
     def ids(self) -> sa.ScalarSelect:
         """
         Return subquery of all IDs managed by the scope of this queue.
         """
-        return sa.select().scalar_subquery()
+        ModelClass = self.get_model()
+        return sa.select(ModelClass.id).where(self.in_deployment()).scalar_subquery()
 
-    def get_model(self):
+    @classmethod
+    def get_model(cls):
         """
         The primary SQLAlchemy model for common queries.
 
@@ -33,15 +162,202 @@ class QueueManager:
         """
         raise NotImplementedError
 
-    def queue_count(self):
+    @classmethod
+    def in_scope(cls) -> sa.ColumnElement[bool]:
+        """
+        Return the condition for items of any deployment to belong to this queue.
+        """
         raise NotImplementedError
 
-    def unprocessed_count(self):
+    @classmethod
+    def is_queued(cls) -> sa.ColumnElement[bool]:
+        """
+        Return the condition for items to be waiting in the queue, or leased.
+        """
         raise NotImplementedError
 
-    def done_count(self):
+    @classmethod
+    def is_done(cls) -> sa.ColumnElement[bool]:
+        """
+        Return the condition for items to have been processed by this stage.
+        """
         raise NotImplementedError
 
+    def queue_count(self) -> int:
+        counter = self.get_counter()
+        return counter["waiting"] + counter["leased"]
+
+    def unprocessed_count(self) -> int:
+        return self.get_counter()["unprocessed"]
+
+    def done_count(self) -> int:
+        return self.get_counter()["done"]
+
+    @classmethod
+    def count_states(
+        cls,
+        sesh,
+        item_ids: Optional[Sequence[int]] = None,
+        deployment_id: Optional[int] = None,
+    ) -> dict[int, dict[str, int]]:
+        """
+        Count the items of this queue in each state, for each deployment.
+        Only the given items, or the items of one deployment, can be counted.
+        """
+        ModelClass = cls.get_model()
+        where = cls.in_scope()
+        if item_ids is not None:
+            where = where & ModelClass.id.in_(item_ids)
+        if deployment_id is not None:
+            where = where & (ModelClass.deployment_id == deployment_id)
+
+        def total(condition):
+            return sa.func.coalesce(sa.func.sum(sa.case((condition, 1), else_=0)), 0)
+
+        items = (
+            sa.select(
+                ModelClass.deployment_id,
+                total(cls.is_queued()),
+                total(cls.is_done()),
+                sa.func.count(ModelClass.id),
+            )
+            .where(where)
+            .group_by(ModelClass.deployment_id)
+        )
+        leased = (
+            sa.select(ModelClass.deployment_id, sa.func.count(QueueJob.id))
+            .join(ModelClass, QueueJob.item_id == ModelClass.id)
+            .where(
+                where
+                & cls.is_queued()
+                & (QueueJob.queue == cls.key)
+                & (QueueJob.state == JobState.leased)
+            )
+            .group_by(ModelClass.deployment_id)
+        )
+
+        counts = {}
+        for deployment, num_queued, num_done, num_items in sesh.execute(items):
+            counts[deployment] = {
+                "waiting": num_queued,
+                "leased": 0,
+                "done": num_done,
+                "unprocessed": num_items - num_done,
+            }
+        for deployment, num_leased in sesh.execute(leased):
+            counts[deployment]["waiting"] -= num_leased
+            counts[deployment]["leased"] += num_leased
+        return counts
+
+    @classmethod
+    def change_counters(cls, sesh, changes: dict[int, dict[str, int]]) -> None:
+        """
+        Add changes in the number of items in each state to the counters of
+        each deployment. Counters that don't exist yet are left alone.
+        """
+        for deployment, change in changes.items():
+            values = {
+                state: getattr(QueueCounter, state) + n
+                for state, n in change.items()
+                if n
+            }
+            if values:
+                sesh.execute(
+                    sa.update(QueueCounter)
+                    .where(
+                        (QueueCounter.queue == cls.key)
+                        & (QueueCounter.deployment_id == deployment)
+                    )
+                    .values(updated_at=datetime.datetime.now(), **values)
+                )
+
+    @classmethod
+    def add_to_counters(cls, sesh, item_ids: Sequence[int]) -> None:
+        """
+        Count new items.
+        """
+        cls.change_counters(sesh, cls.count_states(sesh, item_ids))
+
+    @classmethod
+    @contextlib.contextmanager
+    def track_counters(cls, sesh, item_ids: Sequence[int]):
+        """
+        Update the counters with the changes made to these items in the block.
+        """
+        before = cls.count_states(sesh, item_ids)
+        yield
+        after = cls.count_states(sesh, item_ids)
+        empty = {state: 0 for state in COUNTER_STATES}
+        cls.change_counters(
+            sesh,
+            {
+                deployment: {
+                    state: after.get(deployment, empty)[state]
+                    - before.get(deployment, empty)[state]
+                    for state in COUNTER_STATES
+                }
+                for deployment in set(before) | set(after)
+            },
+        )
+
+    @retry_on_locked
+    def get_counter(self) -> dict[str, int]:
+        """
+        Return the number of items in each state for the deployment of this
+        queue, counting them first if there is no counter yet.
+
+        The items are counted in a write transaction, so that no other
+        connection can change them before the counter is saved. Otherwise the
+        change to the counter that doesn't exist yet would be lost.
+        """
+        if self.deployment_id is None:
+            return {state: 0 for state in COUNTER_STATES}
+
+        def read_counter(sesh):
+            counter = sesh.execute(
+                sa.select(QueueCounter).where(
+                    (QueueCounter.queue == self.key)
+                    & (QueueCounter.deployment_id == self.deployment_id)
+                )
+            ).scalar_one_or_none()
+            if counter:
+                return {state: getattr(counter, state) for state in COUNTER_STATES}
+
+        with get_session(self.db_path) as sesh:
+            values = read_counter(sesh)
+            if values:
+                return values
+
+        with get_session(self.db_path) as sesh:
+            begin_write(sesh, QueueCounter)
+            # Counted by another connection while waiting for the lock
+            values = read_counter(sesh)
+            if values:
+                sesh.rollback()
+                return values
+
+            logger.debug(f"Counting items in {self.name} queue")
+            counts = self.count_states(sesh, deployment_id=self.deployment_id)
+            values = counts.get(
+                self.deployment_id, {state: 0 for state in COUNTER_STATES}
+            )
+            sesh.execute(
+                insert_or_ignore(sesh, QueueCounter).values(
+                    queue=self.key,
+                    deployment_id=self.deployment_id,
+                    updated_at=datetime.datetime.now(),
+                    **values,
+                )
+            )
+            sesh.commit()
+            return values
+
+    def clear_counter(self, sesh) -> None:
+        """
+        Delete the counter of this queue, after its items were changed in bulk.
+        """
+        clear_queue_counters(sesh, self.key, self.deployment_id)
+
     def add_unprocessed(self, *_):
         raise NotImplementedError
 
@@ -51,68 +367,254 @@ class QueueManager:
     def status(self):
         return NotImplementedError
 
-    def pull_n_from_queue(self, n: int):
-        return NotImplementedError
+    def queued_ids(self) -> sa.Select:
+        """
+        Return query of the IDs of all items that are waiting in this queue.
+        """
+        raise NotImplementedError
 
-    def process_queue(self, model):
-        logger.info(f"Processing {self.name} queue")
-        model.run()
-        logger.info(f"Done processing {self.name} queue")
+    def remove_from_queue(self, sesh, item_ids: Sequence[int]) -> None:
+        """
+        Mark items as no longer in the queue, once they are done or have failed.
+        """
+        raise NotImplementedError
 
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
 
-class ImageQueue(QueueManager):
-    name = "Images"
-    description = "Raw images from camera needing object detection"
+    def has_items_without_jobs(self, sesh) -> bool:
+        """
+        Whether items may have been added to the queue since jobs were last
+        created for it. Call once no waiting jobs are left to lease.
 
-    def ids(self) -> sa.ScalarSelect:
+        With no waiting jobs, the items counted as waiting are the ones that
+        have no job yet. Without a counter, the items were changed in bulk.
         """
-        Return subquery of all IDs managed by the scope of this queue.
+        waiting = sesh.execute(
+            sa.select(QueueCounter.waiting).where(
+                (QueueCounter.queue == self.key)
+                & (QueueCounter.deployment_id == self.deployment_id)
+            )
+        ).scalar_one_or_none()
+        return waiting is None or waiting > 0
+
+    def add_jobs(self, sesh) -> None:
         """
-        return (
-            sa.select(TrapImage.id)
-            .where(MonitoringSession.base_directory == str(self.base_directory))
-            .join(
-                MonitoringSession,
-                TrapImage.monitoring_session_id == MonitoringSession.id,
+        Create waiting jobs for items that were added to the queue.
+        """
+        queued = self.queued_ids().subquery()
+        now = datetime.datetime.now()
+        stmt = insert_or_ignore(sesh, QueueJob).from_select(
+            ["queue", "item_id", "state", "attempts", "created_at", "updated_at"],
+            sa.select(
+                sa.literal(self.key),
+                queued.c[0],
+                sa.literal(JobState.waiting, QueueJob.state.type),
+                sa.literal(0),
+                sa.literal(now),
+                sa.literal(now),
             )
-            .scalar_subquery()
+            # SQLite can't parse the ON CONFLICT clause after a SELECT without a WHERE
+            .where(queued.c[0].is_not(None)),
         )
+        sesh.execute(stmt)
 
-    def queue_count(self) -> Union[int, None]:
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(TrapImage.id)).where(
-                (TrapImage.id.in_(self.ids()) & (TrapImage.in_queue.is_(True)))
+    def reclaim_expired(self, sesh) -> None:
+        """
+        Return jobs whose lease has expired to the queue, or mark them as failed
+        if they have been attempted too many times.
+        """
+        expired = (
+            (QueueJob.queue == self.key)
+            & (QueueJob.state == JobState.leased)
+            & (QueueJob.lease_expires_at < datetime.datetime.now())
+        )
+        expired_ids = (
+            sesh.execute(sa.select(QueueJob.item_id).where(expired)).scalars().all()
+        )
+        if not expired_ids:
+            return
+
+        with self.track_counters(sesh, expired_ids):
+            self.expire_jobs(sesh, expired)
+
+    def expire_jobs(self, sesh, expired) -> None:
+        failed_ids = (
+            sesh.execute(
+                sa.update(QueueJob)
+                .where(expired & (QueueJob.attempts >= self.max_attempts))
+                .values(state=JobState.failed, error="Lease expired")
+                .returning(QueueJob.item_id)
             )
-            count = sesh.execute(stmt).scalar()
-            return count
+            .scalars()
+            .all()
+        )
+        if failed_ids:
+            logger.warn(
+                f"Giving up on {len(failed_ids)} items in {self.name} queue "
+                f"after {self.max_attempts} attempts"
+            )
+            self.remove_from_queue(sesh, failed_ids)
+
+        num_reclaimed = sesh.execute(
+            sa.update(QueueJob)
+            .where(expired)
+            .values(state=JobState.waiting, worker=None, lease_expires_at=None)
+        ).rowcount
+        if num_reclaimed:
+            logger.info(f"Reclaimed {num_reclaimed} expired jobs in {self.name} queue")
+
+    def lease_jobs(self, sesh, n: int, ids: Optional[Sequence[int]] = None):
+        waiting = (
+            sa.select(QueueJob.id)
+            .where(
+                (QueueJob.queue == self.key)
+                & (QueueJob.state == JobState.waiting)
+                & (QueueJob.item_id.in_(self.queued_ids().scalar_subquery()))
+            )
+            .order_by(QueueJob.id)
+            .limit(n)
+            .with_for_update(skip_locked=True)
+        )
+        if ids is not None:
+            waiting = waiting.where(QueueJob.item_id.in_(ids))
+        stmt = (
+            sa.update(QueueJob)
+            .where(QueueJob.id.in_(waiting.scalar_subquery()))
+            .values(
+                state=JobState.leased,
+                worker=self.worker_id,
+                lease_expires_at=(
+                    datetime.datetime.now()
+                    + datetime.timedelta(seconds=self.lease_seconds)
+                ),
+                attempts=QueueJob.attempts + 1,
+            )
+            .returning(QueueJob.item_id)
+        )
+        item_ids = sesh.execute(stmt).scalars().all()
+        if item_ids:
+            counts = self.count_states(sesh, item_ids)
+            self.change_counters(
+                sesh,
+                {
+                    deployment: {"waiting": -n["leased"], "leased": n["leased"]}
+                    for deployment, n in counts.items()
+                },
+            )
+        return item_ids
 
-    def unprocessed_count(self) -> Union[int, None]:
+    @retry_on_locked
+    def pull_n_from_queue(self, n: int, ids: Optional[Sequence[int]] = None):
+        """
+        Lease up to `n` items from the queue. If `ids` are given, only those
+        items will be pulled, and only if they are still in the queue.
+
+        The items stay in the queue until `complete` is called with their IDs.
+        If that doesn't happen before the lease expires, they will be pulled again.
+        """
+        logger.debug(f"Attempting to pull {n} items from {self.name} queue")
+        ModelClass = self.get_model()
         with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(TrapImage.id)).where(
-                (TrapImage.id.in_(self.ids()) & (TrapImage.last_processed.is_(None)))
+            self.reclaim_expired(sesh)
+            item_ids = self.lease_jobs(sesh, n, ids)
+            if len(item_ids) < n and self.has_items_without_jobs(sesh):
+                self.add_jobs(sesh)
+                item_ids += self.lease_jobs(sesh, n - len(item_ids), ids)
+            sesh.commit()
+            items = (
+                sesh.execute(
+                    sa.select(ModelClass)
+                    .where(ModelClass.id.in_(item_ids))
+                    .order_by(ModelClass.id)
+                )
+                .unique()
+                .scalars()
+                .all()
+            )
+            logger.info(f"Pulled {len(items)} items from {self.name} queue")
+            return items
+
+    def complete_jobs(self, sesh, item_ids: Sequence[int]) -> None:
+        with self.track_counters(sesh, item_ids):
+            sesh.execute(
+                sa.delete(QueueJob).where(
+                    (QueueJob.queue == self.key)
+                    & (QueueJob.item_id.in_(item_ids))
+                    & (QueueJob.state == JobState.leased)
+                )
             )
-            count = sesh.execute(stmt).scalar()
-            return count
+            self.remove_from_queue(sesh, item_ids)
+
+    @retry_on_locked
+    def complete(self, item_ids: Sequence[int], writer=None) -> None:
+        """
+        Delete the jobs for these items after their results have been saved.
+
+        With a `DatabaseWriter`, the jobs are completed in the same transaction
+        as the results that were submitted before, or a later one.
+        """
+        if writer:
+            writer.submit(self.complete_jobs, item_ids)
+            return
 
-    def done_count(self) -> Union[int, None]:
         with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(TrapImage.id)).where(
-                (TrapImage.id.in_(self.ids()) & (TrapImage.last_processed.is_not(None)))
+            self.complete_jobs(sesh, item_ids)
+            sesh.commit()
+
+    def clear_jobs(self, sesh) -> None:
+        """
+        Delete waiting jobs for items in the scope of this queue. Failed jobs
+        are kept for troubleshooting.
+        """
+        sesh.execute(
+            sa.delete(QueueJob).where(
+                (QueueJob.queue == self.key)
+                & (QueueJob.item_id.in_(self.ids()))
+                & (QueueJob.state == JobState.waiting)
             )
-            count = sesh.execute(stmt).scalar()
-            return count
+        )
+
+    def process_queue(self, model):
+        logger.info(f"Processing {self.name} queue")
+        model.run()
+        logger.info(f"Done processing {self.name} queue")
+
+
+class ImageQueue(QueueManager):
+    name = "Images"
+    key = "images"
+    description = "Raw images from camera needing object detection"
+
+    @classmethod
+    def get_model(cls):
+        return TrapImage
+
+    @classmethod
+    def in_scope(cls):
+        # Copies of an image are processed once, see `link_duplicate_images`
+        return TrapImage.duplicate_of_id.is_(None)
+
+    @classmethod
+    def is_queued(cls):
+        return TrapImage.in_queue.is_(True)
+
+    @classmethod
+    def is_done(cls):
+        return TrapImage.last_processed.is_not(None)
 
     def add_unprocessed(self, *_) -> None:
         logger.info("Adding all unprocessed deployment images to queue")
         with get_session(self.db_path) as sesh:
             stmt = (
                 sa.update(TrapImage)
-                .where(
-                    TrapImage.id.in_(self.ids()) & TrapImage.last_processed.is_(None)
-                )
+                .where(self.in_deployment() & TrapImage.last_processed.is_(None))
                 .values({"in_queue": True})
             )
             sesh.execute(stmt)
+            self.clear_counter(sesh)
+            forget_image_stats(sesh)
             sesh.commit()
 
     def clear_queue(self, *_) -> None:
@@ -120,88 +622,49 @@ class ImageQueue(QueueManager):
         with get_session(self.db_path) as sesh:
             stmt = (
                 sa.update(TrapImage)
-                .where(TrapImage.id.in_(self.ids()) & TrapImage.in_queue.is_(True))
+                .where(self.in_deployment() & TrapImage.in_queue.is_(True))
                 .values({"in_queue": False})
             )
             sesh.execute(stmt)
+            self.clear_jobs(sesh)
+            self.clear_counter(sesh)
+            forget_image_stats(sesh)
             sesh.commit()
 
-    def pull_n_from_queue(self, n: int) -> Sequence[TrapImage]:
-        logger.debug(f"Attempting to pull {n} images from queue")
-        select_stmt = (
-            sa.select(TrapImage.id)
-            .where(TrapImage.id.in_(self.ids()) & (TrapImage.in_queue.is_(True)))
-            .limit(n)
-            .with_for_update()
+    def queued_ids(self) -> sa.Select:
+        return sa.select(TrapImage.id).where(
+            self.in_deployment() & (TrapImage.in_queue.is_(True))
         )
-        update_stmt = (
+
+    def remove_from_queue(self, sesh, item_ids: Sequence[int]) -> None:
+        sesh.execute(
             sa.update(TrapImage)
-            .where(TrapImage.id.in_(select_stmt.scalar_subquery()))
-            # .where(TrapImage.status == Status.waiting)
+            .where(TrapImage.id.in_(item_ids))
             .values({"in_queue": False})
-            .returning(TrapImage)
         )
-        with get_session(self.db_path) as sesh:
-            images = sesh.execute(update_stmt).unique().scalars().all()
-            sesh.commit()
-            logger.info(f"Pulled {len(images)} images from queue")
-            return images
+        forget_image_stats(sesh, item_ids)
 
 
 class DetectedObjectQueue(QueueManager):
     name = "Detected objects"
+    key = "detected_objects"
     description = "Objects that were detected in an image but have not been classified"
 
-    def ids(self) -> sa.ScalarSelect:
-        """
-        Return subquery of all IDs managed by the scope of this queue.
-        """
-        return (
-            sa.select(DetectedObject.id)
-            .where(
-                (MonitoringSession.base_directory == str(self.base_directory))
-                & DetectedObject.bbox.is_not(None)
-            )
-            .join(
-                MonitoringSession,
-                DetectedObject.monitoring_session_id == MonitoringSession.id,
-            )
-            .scalar_subquery()
-        )
+    @classmethod
+    def get_model(cls):
+        return DetectedObject
 
-    def queue_count(self):
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & DetectedObject.in_queue.is_(True)
-                    & (DetectedObject.binary_label.is_(None))
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def in_scope(cls):
+        return DetectedObject.bbox.is_not(None)
 
-    def unprocessed_count(self):
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & (DetectedObject.binary_label.is_(None))
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def is_queued(cls):
+        return DetectedObject.in_queue.is_(True) & DetectedObject.binary_label.is_(None)
 
-    def done_count(self):
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & (DetectedObject.binary_label.is_not(None))
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def is_done(cls):
+        return DetectedObject.binary_label.is_not(None)
 
     def add_unprocessed(self, *_) -> None:
         logger.info(f"Adding detected objects from deployment to queue")
@@ -209,13 +672,14 @@ class DetectedObjectQueue(QueueManager):
             stmt = (
                 sa.update(DetectedObject)
                 .where(
-                    (DetectedObject.id.in_(self.ids()))
+                    self.in_deployment()
                     & (DetectedObject.in_queue.is_(False))
                     & (DetectedObject.binary_label.is_(None))
                 )
                 .values({"in_queue": True})
             )
             sesh.execute(stmt)
+            self.clear_counter(sesh)
             sesh.commit()
 
     def clear_queue(self, *_) -> None:
@@ -224,105 +688,61 @@ class DetectedObjectQueue(QueueManager):
             stmt = (
                 sa.update(DetectedObject)
                 .where(
-                    (DetectedObject.id.in_(self.ids()))
+                    self.in_deployment()
                     & (DetectedObject.in_queue.is_(True))
                     & (DetectedObject.binary_label.is_(None))
                 )
                 .values({"in_queue": False})
             )
             sesh.execute(stmt)
+            self.clear_jobs(sesh)
+            self.clear_counter(sesh)
             sesh.commit()
 
-    def pull_n_from_queue(self, n: int) -> Sequence[DetectedObject]:
-        logger.debug(f"Attempting to pull {n} detected objects from queue")
-        select_stmt = (
-            sa.select(DetectedObject.id)
+    def queued_ids(self) -> sa.Select:
+        return sa.select(DetectedObject.id).where(
+            self.in_deployment()
+            & (DetectedObject.in_queue.is_(True))
+            & (DetectedObject.binary_label.is_(None))
+        )
+
+    def remove_from_queue(self, sesh, item_ids: Sequence[int]) -> None:
+        # Objects of interest stay in the queue for the next stage
+        sesh.execute(
+            sa.update(DetectedObject)
             .where(
-                (DetectedObject.id.in_(self.ids()))
-                & (DetectedObject.in_queue.is_(True))
+                (DetectedObject.id.in_(item_ids))
                 & (DetectedObject.binary_label.is_(None))
             )
-            .limit(n)
-            .with_for_update()
-        )
-        update_stmt = (
-            sa.update(DetectedObject)
-            .where(DetectedObject.id.in_(select_stmt.scalar_subquery()))
             .values({"in_queue": False})
-            .returning(DetectedObject.id)
         )
-        with get_session(self.db_path) as sesh:
-            record_ids = sesh.execute(update_stmt).unique().scalars().all()
-            sesh.commit()
-            objs = (
-                sesh.execute(
-                    sa.select(DetectedObject).where(DetectedObject.id.in_(record_ids))
-                )
-                .unique()
-                .scalars()
-                .all()
-            )
-            logger.info(f"Pulled {len(objs)} detected objects from queue")
-            return objs
 
 
 class UnclassifiedObjectQueue(QueueManager):
     name = "Unclassified objects"
+    key = "unclassified_objects"
     description = """
     Objects that have been identified as something of interest (e.g. a moth)
     but have not yet been classified to the species level.
     """
 
-    def ids(self) -> sa.ScalarSelect:
-        """
-        Return subquery of all IDs managed by the scope of this queue.
-        """
-        return (
-            sa.select(DetectedObject.id)
-            .where(
-                (MonitoringSession.base_directory == str(self.base_directory))
-                & (DetectedObject.binary_label == constants.POSITIVE_BINARY_LABEL)
-            )
-            .join(
-                MonitoringSession,
-                DetectedObject.monitoring_session_id == MonitoringSession.id,
-            )
-            .scalar_subquery()
-        )
+    @classmethod
+    def get_model(cls):
+        return DetectedObject
 
-    def queue_count(self) -> Union[int, None]:
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & DetectedObject.in_queue.is_(True)
-                    & DetectedObject.specific_label.is_(None)
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def in_scope(cls):
+        return DetectedObject.binary_label == constants.POSITIVE_BINARY_LABEL
 
-    def unprocessed_count(self) -> Union[int, None]:
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & DetectedObject.specific_label.is_(None)
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def is_queued(cls):
+        return DetectedObject.in_queue.is_(True) & (
+            DetectedObject.specific_label.is_(None)
+        )
 
-    def done_count(self) -> Union[int, None]:
-        with get_session(self.db_path) as sesh:
-            stmt = sa.select(sa.func.count(DetectedObject.id)).where(
-                (
-                    (DetectedObject.id.in_(self.ids()))
-                    & DetectedObject.specific_label.is_not(None)
-                )
-            )
-            count = sesh.execute(stmt).scalar()
-            return count
+    @classmethod
+    def is_done(cls):
+        return DetectedObject.specific_label.is_not(None)
 
     def add_unprocessed(self, *_) -> None:
         logger.info("Adding unclassified objects from deployment to queue")
@@ -330,13 +750,14 @@ class UnclassifiedObjectQueue(QueueManager):
             stmt = (
                 sa.update(DetectedObject)
                 .where(
-                    (DetectedObject.id.in_(self.ids()))
+                    self.in_deployment()
                     & (DetectedObject.in_queue.is_(False))
                     & (DetectedObject.specific_label.is_(None))
                 )
                 .values({"in_queue": True})
             )
             sesh.execute(stmt)
+            self.clear_counter(sesh)
             sesh.commit()
 
     def clear_queue(self, *_) -> None:
@@ -345,47 +766,46 @@ class UnclassifiedObjectQueue(QueueManager):
             stmt = (
                 sa.update(DetectedObject)
                 .where(
-                    (DetectedObject.id.in_(self.ids()))
+                    self.in_deployment()
                     & (DetectedObject.in_queue.is_(True))
                     & (DetectedObject.specific_label.is_(None))
                 )
                 .values({"in_queue": False})
             )
             sesh.execute(stmt)
+            self.clear_jobs(sesh)
+            self.clear_counter(sesh)
             sesh.commit()
 
-    def pull_n_from_queue(self, n: int) -> Sequence[DetectedObject]:
-        logger.debug(f"Attempting to pull {n} objects of interest from queue")
-        select_stmt = (
-            sa.select(DetectedObject.id)
-            .where(
-                (DetectedObject.id.in_(self.ids()))
-                & (DetectedObject.in_queue.is_(True))
-                & (DetectedObject.specific_label.is_(None))
-                & (DetectedObject.bbox.is_not(None))
-            )
-            .limit(n)
-            .with_for_update()
+    def queued_ids(self) -> sa.Select:
+        return sa.select(DetectedObject.id).where(
+            self.in_deployment()
+            & (DetectedObject.in_queue.is_(True))
+            & (DetectedObject.specific_label.is_(None))
+            & (DetectedObject.bbox.is_not(None))
         )
-        update_stmt = (
+
+    def remove_from_queue(self, sesh, item_ids: Sequence[int]) -> None:
+        sesh.execute(
             sa.update(DetectedObject)
-            .where(DetectedObject.id.in_(select_stmt.scalar_subquery()))
+            .where(DetectedObject.id.in_(item_ids))
             .values({"in_queue": False})
-            .returning(DetectedObject.id)
         )
-        with get_session(self.db_path) as sesh:
-            record_ids = sesh.execute(update_stmt).scalars().all()
-            sesh.commit()
-            objs = (
-                sesh.execute(
-                    sa.select(DetectedObject).where(DetectedObject.id.in_(record_ids))
-                )
-                .unique()
-                .scalars()
-                .all()
-            )
-            logger.info(f"Pulled {len(objs)} objects of interest from queue")
-            return objs
+
+
+def clear_queue_counters(
+    sesh, queue: Optional[str] = None, deployment_id: Optional[int] = None
+) -> None:
+    """
+    Delete the counters of a queue or a deployment (or all of them) after
+    their items were changed in bulk. They are counted again when needed.
+    """
+    stmt = sa.delete(QueueCounter)
+    if queue is not None:
+        stmt = stmt.where(QueueCounter.queue == queue)
+    if deployment_id is not None:
+        stmt = stmt.where(QueueCounter.deployment_id == deployment_id)
+    sesh.execute(stmt)
 
 
 def all_queues(db_path, base_directory):
@@ -403,13 +823,17 @@ def add_image_to_queue(db_path, image_id):
     with get_session(db_path) as sesh:
         logger.info(f"Adding image id {image_id} to queue")
         stmt = sa.update(TrapImage).filter_by(id=image_id).values({"in_queue": True})
-        sesh.execute(stmt)
+        with ImageQueue.track_counters(sesh, [image_id]):
+            sesh.execute(stmt)
+        forget_image_stats(sesh, [image_id])
         sesh.commit()
 
 
 def add_sample_to_queue(db_path, sample_size=10):
     with get_session(db_path) as sesh:
-        num_in_queue = sesh.query(TrapImage).filter_by(in_queue=True).count()
+        num_in_queue = (
+            sesh.query(TrapImage).filter(TrapImage.in_queue.is_(True)).count()
+        )
         if num_in_queue < sample_size:
             images = []
             for image in (
@@ -417,6 +841,7 @@ def add_sample_to_queue(db_path, sample_size=10):
                 .filter_by(
                     in_queue=False,
                 )
+                .filter(ImageQueue.in_scope())
                 .order_by(sa.func.random())
                 .limit(sample_size - num_in_queue)
                 .all()
@@ -425,6 +850,8 @@ def add_sample_to_queue(db_path, sample_size=10):
                 images.append(image)
             logger.info(f"Adding {len(images)} images to queue")
             sesh.bulk_save_objects(images)
+            clear_queue_counters(sesh, ImageQueue.key)
+            forget_image_stats(sesh, [image.id for image in images])
             sesh.commit()
 
     return images
@@ -459,6 +886,7 @@ def add_monitoring_session_to_queue(db_path, monitoring_session, limit=None):
                 last_processed=None,
                 monitoring_session_id=ms.id,
             )
+            .filter(ImageQueue.in_scope())
             .order_by(TrapImage.timestamp)
             .limit(limit)
             .all()
@@ -467,30 +895,36 @@ def add_monitoring_session_to_queue(db_path, monitoring_session, limit=None):
             images.append(image)
         logger.info(f"Adding {len(images)} images to queue")
         sesh.bulk_save_objects(images)
+        clear_queue_counters(sesh, ImageQueue.key, ms.deployment_id)
+        forget_image_stats(sesh, [image.id for image in images])
         sesh.commit()
 
 
 def images_in_queue(db_path):
     with get_session(db_path) as sesh:
-        return sesh.query(TrapImage).filter_by(in_queue=True).count()
+        return sesh.query(TrapImage).filter(TrapImage.in_queue.is_(True)).count()
 
 
 def queue_counts(db_path):
     counts = {}
     with get_session(db_path) as sesh:
-        counts["images"] = sesh.query(TrapImage).filter_by(in_queue=True).count()
+        # Compare with `is_` to match the partial indexes on `in_queue`
+        counts["images"] = (
+            sesh.query(TrapImage).filter(TrapImage.in_queue.is_(True)).count()
+        )
         counts["unclassified_objects"] = (
             sesh.query(DetectedObject)
-            .filter_by(in_queue=True, binary_label=None)
+            .filter_by(binary_label=None)
+            .filter(DetectedObject.in_queue.is_(True))
             .count()
         )
         counts["unclassified_species"] = (
             sesh.query(DetectedObject)
             .filter_by(
-                in_queue=True,
                 specific_label=None,
             )
             .filter(
+                DetectedObject.in_queue.is_(True),
                 DetectedObject.binary_label.is_not(None),
             )
             .count()
@@ -0,0 +1,313 @@
+import datetime
+import os
+import pathlib
+import threading
+
+import sqlalchemy as sa
+
+from trapdata.db import Base, get_session
+from trapdata import logger
+from trapdata.common.types import FilePath
+from trapdata.common.filemanagement import (
+    SCAN_WORKERS,
+    TimestampSource,
+    find_changed_images,
+    hash_images,
+    is_image,
+    read_images,
+)
+from trapdata.db.models.deployments import get_or_create_deployment
+from trapdata.db.models.events import group_new_images, ingest_session_batches
+from trapdata.db.models.images import TrapImage
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+# Seconds between scans of a watched directory, if watchdog is not installed
+# or misses an event (e.g. on a network mount)
+WATCH_INTERVAL = 10
+# Images modified more recently may still be being copied, and are saved by
+# the next scan of a watched directory
+WATCH_SETTLE_SECONDS = 2
+# The watchdog events of files that were written
+WATCH_EVENTS = {"created", "modified", "moved", "closed"}
+
+
+class ScannedDirectory(Base):
+    """
+    A directory of a deployment as it was when its images were last scanned,
+    so that the next scan only needs to read the images that were added or
+    changed since. See `find_changed_images`.
+    """
+
+    __tablename__ = "scanned_directories"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    deployment_id = sa.Column(sa.ForeignKey("deployments.id"), nullable=False)
+    # Relative to the base directory of the deployment
+    path = sa.Column(sa.String(255), nullable=False)
+    mtime_ns = sa.Column(sa.BigInteger, nullable=False)
+    subdirectories = sa.Column(sa.JSON, nullable=False)
+    # The size and modification time of each image, by file name
+    files = sa.Column(sa.JSON, nullable=False)
+    scanned_at = sa.Column(sa.DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        sa.Index(
+            "ix_scanned_directories_deployment_id_path",
+            deployment_id,
+            path,
+            unique=True,
+        ),
+    )
+
+    def __repr__(self):
+        return (
+            f"ScannedDirectory(deployment_id={self.deployment_id!r}, "
+            f"path={self.path!r}, num_files={len(self.files or {})!r})"
+        )
+
+
+def get_scan_manifest(sesh, deployment_id: int) -> dict[str, dict]:
+    rows = sesh.execute(
+        sa.select(ScannedDirectory).where(
+            ScannedDirectory.deployment_id == deployment_id
+        )
+    ).scalars()
+    return {
+        row.path: {
+            "mtime_ns": row.mtime_ns,
+            "subdirectories": row.subdirectories,
+            "files": row.files,
+        }
+        for row in rows
+    }
+
+
+def save_scan_manifest(
+    sesh, deployment_id: int, manifest: dict[str, dict], new_manifest: dict[str, dict]
+) -> None:
+    """
+    Save the directories that changed since the last scan, and delete the
+    ones that no longer exist. Does not commit.
+    """
+    removed = set(manifest) - set(new_manifest)
+    changed = [
+        path
+        for path, directory in new_manifest.items()
+        if manifest.get(path) != directory
+    ]
+    if removed or changed:
+        sesh.execute(
+            sa.delete(ScannedDirectory).where(
+                ScannedDirectory.deployment_id == deployment_id,
+                ScannedDirectory.path.in_(removed | set(changed)),
+            )
+        )
+    if changed:
+        scanned_at = datetime.datetime.now()
+        sesh.execute(
+            sa.insert(ScannedDirectory),
+            [
+                {
+                    "deployment_id": deployment_id,
+                    "path": path,
+                    "scanned_at": scanned_at,
+                    **new_manifest[path],
+                }
+                for path in changed
+            ],
+        )
+
+
+def skip_saved_images(
+    sesh, deployment_id: int, base_directory: pathlib.Path, files: list[os.DirEntry]
+) -> list[os.DirEntry]:
+    """
+    Leave out the files that are already saved with the same size and their
+    dimensions, for the first scan of a deployment that was saved before it
+    had a scan manifest. Use a full scan to read them again.
+    """
+    saved = dict(
+        sesh.execute(
+            sa.select(TrapImage.path, TrapImage.filesize).where(
+                TrapImage.deployment_id == deployment_id,
+                TrapImage.width.is_not(None),
+            )
+        ).all()
+    )
+    if not saved:
+        return files
+    return [
+        entry
+        for entry in files
+        if saved.get(os.path.relpath(entry.path, base_directory))
+        != entry.stat().st_size
+    ]
+
+
+def rescan_deployment(
+    db_path,
+    base_directory: FilePath,
+    full: bool = False,
+    timestamps: TimestampSource = TimestampSource.exif,
+    queue: bool = False,
+    settle_seconds: float = 0,
+    workers: int = SCAN_WORKERS,
+    hashes: bool = True,
+) -> dict[str, int]:
+    """
+    Save the images that were added to a directory, or changed, since it was
+    last scanned. Only directories that were modified are listed, and only
+    the new or changed files in them are read. The first scan of a deployment
+    that was saved before does not read the images it already has (see
+    `skip_saved_images`). Set `full` to read every
+    image again, e.g. if files were replaced without modifying their
+    directories. See `TimestampSource` for where timestamps are read from.
+    Set `queue` to add the new images to the processing queue. Unless
+    `hashes` is unset, the contents of the files are hashed too, to find
+    copies of images that were already saved and files that were replaced.
+
+    New images are added to the saved monitoring session they were taken
+    during, or to new sessions. They are saved in batches while the files
+    are read, and the manifest is saved at the end, so an interrupted scan
+    reads the same files again next time. Returns the number of directories
+    listed, images read and images saved.
+    """
+    base_directory = pathlib.Path(base_directory)
+    with get_session(db_path) as sesh:
+        deployment_id = get_or_create_deployment(sesh, base_directory).id
+        manifest = {} if full else get_scan_manifest(sesh, deployment_id)
+        sesh.commit()
+
+    logger.info(f"Scanning '{base_directory}' for new or changed images")
+    changed_files, new_manifest = find_changed_images(
+        base_directory, manifest, settle_seconds
+    )
+    if not full and not manifest:
+        with get_session(db_path) as sesh:
+            changed_files = skip_saved_images(
+                sesh, deployment_id, base_directory, changed_files
+            )
+    images = read_images(changed_files, workers=workers, timestamps=timestamps)
+    if hashes:
+        images = hash_images(images, workers=workers)
+
+    with get_session(db_path) as sesh:
+        sessions = group_new_images(sesh, base_directory, images, timestamps=timestamps)
+    counts = ingest_session_batches(db_path, base_directory, sessions, queue=queue)
+
+    with get_session(db_path) as sesh:
+        save_scan_manifest(sesh, deployment_id, manifest, new_manifest)
+        sesh.commit()
+
+    counts |= {
+        "scanned_directories": len(
+            [path for path in new_manifest if manifest.get(path) != new_manifest[path]]
+        ),
+        "read_images": len(changed_files),
+    }
+    logger.info(f"Scanned '{base_directory}': {counts}")
+    return counts
+
+
+class DeploymentWatcher:
+    """
+    Save the images added to a directory while it is being watched, by
+    scanning it again whenever files change, or every `interval` seconds.
+    Set `queue` to add the new images to the processing queue, so that a
+    running pipeline picks them up.
+
+    Files are watched with watchdog if it is installed
+    (`pip install trapdata[watch]`), otherwise the directory is only checked
+    every `interval` seconds. Each scan only lists the directories that
+    changed, see `rescan_deployment`.
+
+    >>> watcher = DeploymentWatcher(db_path, base_directory, queue=True)
+    >>> threading.Thread(target=watcher.run).start()
+    >>> watcher.stop()
+    """
+
+    def __init__(
+        self,
+        db_path,
+        base_directory: FilePath,
+        interval: float = WATCH_INTERVAL,
+        timestamps: TimestampSource = TimestampSource.exif,
+        queue: bool = False,
+        settle_seconds: float = WATCH_SETTLE_SECONDS,
+        hashes: bool = True,
+    ):
+        self.db_path = db_path
+        self.base_directory = pathlib.Path(base_directory)
+        self.interval = interval
+        self.timestamps = timestamps
+        self.queue = queue
+        self.settle_seconds = settle_seconds
+        self.hashes = hashes
+        self.num_scans = 0
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+
+    def dispatch(self, event):
+        """
+        Handle a watchdog event, by waking up the next scan if an image was
+        added or changed. Images that are only read, e.g. by the scan, are
+        ignored.
+        """
+        path = getattr(event, "dest_path", "") or event.src_path
+        if event.event_type in WATCH_EVENTS and is_image(str(path)):
+            self.changed.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+
+    def scan(self) -> dict[str, int]:
+        counts = rescan_deployment(
+            self.db_path,
+            self.base_directory,
+            timestamps=self.timestamps,
+            queue=self.queue,
+            settle_seconds=self.settle_seconds,
+            hashes=self.hashes,
+        )
+        self.num_scans += 1
+        return counts
+
+    def wait_for_changes(self):
+        if self.changed.wait(self.interval):
+            # Wait for the rest of a batch of files being copied
+            self.stopped.wait(self.settle_seconds)
+
+    def run(self, scan_first: bool = True):
+        """
+        Scan the directory until `stop` is called. Set `scan_first` to False
+        if it was just scanned, to wait for changes before the first scan.
+        """
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(self, str(self.base_directory), recursive=True)
+            observer.start()
+            logger.info(f"Watching '{self.base_directory}' for new images")
+        else:
+            logger.info(
+                f"Checking '{self.base_directory}' for new images every "
+                f"{self.interval} seconds, install watchdog to save them sooner"
+            )
+        try:
+            if not scan_first:
+                self.wait_for_changes()
+            while not self.stopped.is_set():
+                # Changes made during the scan start another one
+                self.changed.clear()
+                self.scan()
+                self.wait_for_changes()
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
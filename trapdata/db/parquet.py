@@ -0,0 +1,345 @@
+"""
+Export detected objects and monitoring sessions to Parquet files for analysis.
+
+Files are partitioned by deployment and night, like
+`detections/deployment_id=1/day=2022-06-01/part-0.parquet`, and can be read as
+one dataset with `pyarrow.dataset` or `pandas.read_parquet`. Requires pyarrow,
+which can be installed with `pip install trapdata[parquet]`.
+"""
+import functools
+import json
+import os
+import pathlib
+import shutil
+from typing import Optional
+
+import sqlalchemy as sa
+
+from trapdata import logger
+from trapdata.common.types import FilePath
+from trapdata.db import get_session
+from trapdata.db.models.deployments import Deployment, normalize_base_directory
+from trapdata.db.models.events import MonitoringSession
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import DetectedObject
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+# Rows read from the database and written to each row group
+ROW_GROUP_SIZE = 50000
+# Fingerprints of the partitions written by the last export
+MANIFEST_NAME = "_manifest.json"
+
+
+def check_pyarrow():
+    if pa is None:
+        raise ImportError(
+            "Parquet exports require pyarrow, install it with: "
+            "pip install trapdata[parquet]"
+        )
+
+
+def detection_schema() -> "pa.Schema":
+    label = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("image_id", pa.int64()),
+            ("trap", label),
+            ("event", pa.date32()),
+            ("source_image", pa.string()),
+            ("cropped_image", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("bbox_x1", pa.int32()),
+            ("bbox_y1", pa.int32()),
+            ("bbox_x2", pa.int32()),
+            ("bbox_y2", pa.int32()),
+            ("area_pixels", pa.int64()),
+            ("model_name", label),
+            ("binary_label", label),
+            ("binary_label_score", pa.float32()),
+            ("specific_label", label),
+            ("specific_label_score", pa.float32()),
+            ("category_label", label),
+            ("category_score", pa.float32()),
+            ("last_detected", pa.timestamp("us")),
+        ]
+    )
+
+
+def event_schema() -> "pa.Schema":
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("trap", pa.dictionary(pa.int32(), pa.string())),
+            ("event", pa.date32()),
+            ("start_time", pa.timestamp("us")),
+            ("end_time", pa.timestamp("us")),
+            ("duration_minutes", pa.int32()),
+            ("num_images", pa.int32()),
+            ("num_processed_images", pa.int32()),
+            ("num_detected_objects", pa.int32()),
+            ("num_moths", pa.int32()),
+            ("num_species", pa.int32()),
+        ]
+    )
+
+
+def make_batch(columns: dict[str, list], schema) -> "pa.RecordBatch":
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[field.name], field.type) for field in schema],
+        schema=schema,
+    )
+
+
+def detection_batch(rows, trap, day) -> "pa.RecordBatch":
+    schema = detection_schema()
+    columns = {name: [] for name in schema.names}
+    for row in rows:
+        bbox = row.bbox or [None, None, None, None]
+        if row.specific_label:
+            label, score = row.specific_label, row.specific_label_score
+        else:
+            label, score = row.binary_label, row.binary_label_score
+        values = {
+            "id": row.id,
+            "image_id": row.image_id,
+            "trap": trap,
+            "event": day,
+            "source_image": str(pathlib.Path(str(row.base_path)) / str(row.image_path)),
+            "cropped_image": row.path,
+            "timestamp": row.timestamp,
+            "bbox_x1": bbox[0],
+            "bbox_y1": bbox[1],
+            "bbox_x2": bbox[2],
+            "bbox_y2": bbox[3],
+            "area_pixels": row.area_pixels,
+            "model_name": row.model_name,
+            "binary_label": row.binary_label,
+            "binary_label_score": row.binary_label_score,
+            "specific_label": row.specific_label,
+            "specific_label_score": row.specific_label_score,
+            "category_label": label,
+            "category_score": score,
+            "last_detected": row.last_detected,
+        }
+        for name, value in values.items():
+            columns[name].append(value)
+    return make_batch(columns, schema)
+
+
+def event_batch(rows, trap) -> "pa.RecordBatch":
+    schema = event_schema()
+    sessions = [row[0] for row in rows]
+    durations = [ms.duration() for ms in sessions]
+    columns = {
+        "id": [ms.id for ms in sessions],
+        "trap": [trap for _ in sessions],
+        "event": [ms.day for ms in sessions],
+        "start_time": [ms.start_time for ms in sessions],
+        "end_time": [ms.end_time for ms in sessions],
+        "duration_minutes": [
+            int(d.total_seconds() // 60) if d else None for d in durations
+        ],
+    }
+    for name in schema.names[len(columns) :]:
+        columns[name] = [getattr(ms, name) for ms in sessions]
+    return make_batch(columns, schema)
+
+
+def read_manifest(directory: pathlib.Path) -> dict[str, str]:
+    path = directory / MANIFEST_NAME
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def write_manifest(directory: pathlib.Path, manifest: dict[str, str]):
+    path = directory / MANIFEST_NAME
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_path, path)
+
+
+def get_fingerprints(sesh, deployment_ids) -> dict[int, str]:
+    """
+    Summarize the detected objects of each monitoring session with one query,
+    so that sessions whose objects were added, deleted or classified since
+    the last export can be found without reading the objects.
+    """
+    query = (
+        sa.select(
+            DetectedObject.monitoring_session_id,
+            sa.func.count(DetectedObject.id),
+            sa.func.max(DetectedObject.id),
+            sa.func.max(DetectedObject.last_detected),
+            sa.func.count(DetectedObject.binary_label),
+            sa.func.count(DetectedObject.specific_label),
+            sa.func.sum(DetectedObject.binary_label_score),
+            sa.func.sum(DetectedObject.specific_label_score),
+            sa.func.count(DetectedObject.path),
+        )
+        .where(DetectedObject.deployment_id.in_(deployment_ids))
+        .group_by(DetectedObject.monitoring_session_id)
+    )
+    return {
+        session_id: json.dumps(list(values), default=str)
+        for session_id, *values in sesh.execute(query)
+    }
+
+
+def write_partition(sesh, path: pathlib.Path, query, to_batch, schema) -> int:
+    """
+    Write the results of a query to one Parquet file, in row groups that are
+    read from a streaming cursor. `to_batch` converts the rows of a row
+    group to a record batch. The file is replaced once it is complete.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    num_rows = 0
+    result = sesh.execute(query.execution_options(yield_per=ROW_GROUP_SIZE))
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for rows in result.partitions():
+            writer.write_batch(to_batch(rows))
+            num_rows += len(rows)
+    os.replace(tmp_path, path)
+    return num_rows
+
+
+def remove_partition(directory: pathlib.Path, partition: str):
+    path = directory / partition
+    if path.exists():
+        shutil.rmtree(path)
+
+
+def get_deployments(sesh, base_directory: Optional[FilePath] = None):
+    query = sa.select(Deployment)
+    if base_directory:
+        query = query.where(
+            Deployment.base_directory == normalize_base_directory(base_directory)
+        )
+    return sesh.execute(query).scalars().all()
+
+
+def export_detections_parquet(
+    db_path, directory: FilePath, base_directory: Optional[FilePath] = None
+) -> list[str]:
+    """
+    Export the detected objects of every deployment, or of the deployment for
+    `base_directory`, with one partition for each night. Only the nights that
+    changed since the last export to the same directory are written again.
+    Returns the partitions that were written.
+    """
+    check_pyarrow()
+    directory = pathlib.Path(directory) / "detections"
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(directory)
+    schema = detection_schema()
+    written = []
+
+    with get_session(db_path) as sesh:
+        deployments = get_deployments(sesh, base_directory)
+        fingerprints = get_fingerprints(sesh, [d.id for d in deployments])
+        sessions = sesh.execute(
+            sa.select(MonitoringSession).where(
+                MonitoringSession.id.in_(fingerprints.keys())
+            )
+        ).scalars()
+        partitions = {
+            f"deployment_id={ms.deployment_id}/day={ms.day.isoformat()}": ms
+            for ms in sessions
+        }
+
+        names = {d.id: d.name for d in deployments}
+        for partition, ms in sorted(partitions.items()):
+            fingerprint = fingerprints[ms.id]
+            path = directory / partition / "part-0.parquet"
+            if manifest.get(partition) == fingerprint and path.exists():
+                continue
+            query = (
+                sa.select(
+                    DetectedObject.id,
+                    DetectedObject.image_id,
+                    TrapImage.base_path,
+                    TrapImage.path.label("image_path"),
+                    TrapImage.timestamp,
+                    DetectedObject.path,
+                    DetectedObject.bbox,
+                    DetectedObject.area_pixels,
+                    DetectedObject.model_name,
+                    DetectedObject.binary_label,
+                    DetectedObject.binary_label_score,
+                    DetectedObject.specific_label,
+                    DetectedObject.specific_label_score,
+                    DetectedObject.last_detected,
+                )
+                .join(TrapImage, DetectedObject.image_id == TrapImage.id)
+                .where(DetectedObject.monitoring_session_id == ms.id)
+                .order_by(DetectedObject.id)
+            )
+            num_rows = write_partition(
+                sesh,
+                path,
+                query,
+                functools.partial(
+                    detection_batch, trap=names[ms.deployment_id], day=ms.day
+                ),
+                schema,
+            )
+            logger.info(f"Exported {num_rows} detected objects to {partition}")
+            manifest[partition] = fingerprint
+            written.append(partition)
+
+    # Nights in these deployments that no longer have any objects
+    prefixes = tuple(f"deployment_id={d.id}/" for d in deployments)
+    for partition in list(manifest):
+        if partition.startswith(prefixes) and partition not in partitions:
+            remove_partition(directory, partition)
+            del manifest[partition]
+            written.append(partition)
+
+    write_manifest(directory, manifest)
+    logger.info(
+        f"Exported {len(written)} changed partitions of detected objects "
+        f"to {directory}"
+    )
+    return written
+
+
+def export_events_parquet(
+    db_path, directory: FilePath, base_directory: Optional[FilePath] = None
+) -> list[str]:
+    """
+    Export the monitoring sessions of every deployment, or of the deployment
+    for `base_directory`, with one partition for each deployment. There is one
+    row per night, so every partition is written again.
+    """
+    check_pyarrow()
+    directory = pathlib.Path(directory) / "events"
+    schema = event_schema()
+    written = []
+
+    with get_session(db_path) as sesh:
+        for deployment in get_deployments(sesh, base_directory):
+            partition = f"deployment_id={deployment.id}"
+            query = (
+                sa.select(MonitoringSession)
+                .where(MonitoringSession.deployment_id == deployment.id)
+                .order_by(MonitoringSession.day)
+            )
+            write_partition(
+                sesh,
+                directory / partition / "part-0.parquet",
+                query,
+                functools.partial(event_batch, trap=deployment.name),
+                schema,
+            )
+            written.append(partition)
+
+    logger.info(f"Exported monitoring sessions of {len(written)} deployments")
+    return written
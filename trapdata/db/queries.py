@@ -1,6 +1,3 @@
-import statistics
-import random
-from collections import Counter
 import sqlalchemy as sa
 
 from .base import get_session
@@ -93,53 +90,119 @@ def classification_results(
     return results
 
 
-def summarize_results(
-    db_path,
+def species_summary_query(
     monitoring_session=None,
     classification_threshold: float = -1,
     num_examples=3,
+    examples_by="area_pixels",
 ):
-    results = classification_results(
-        db_path=db_path,
-        monitoring_session=monitoring_session,
-        classification_threshold=classification_threshold,
+    """
+    Count the moths of each label in a monitoring session, with their mean
+    score and a few examples, in one query.
+
+    Uses the same labels as `classification_results`. The examples of each
+    label are the largest objects, or the ones with the highest score if
+    `examples_by` is "score".
+    """
+    obj = models.DetectedObject
+    score = sa.func.coalesce(obj.specific_label_score, 0)
+    area = sa.func.coalesce(obj.area_pixels, 0)
+    label = sa.case(
+        (
+            sa.and_(
+                obj.specific_label_score != 0,
+                obj.specific_label_score >= classification_threshold,
+            ),
+            obj.specific_label,
+        ),
+        else_=obj.binary_label,
     )
 
-    index = {result["label"]: [] for result in results}
-    summary = []
-    for result in results:
-        index[result["label"]].append(result)
-
-    for label, items in index.items():
-        count = len(items)
-        mean_score = statistics.mean([item["score"] for item in items])
-        # items.sort(key=lambda item: item["score"], reverse=True)
-        # best_example = items[0]
-        random.shuffle(items)
-        examples = [item for item in items[:num_examples]]
-        summary.append(
-            {
-                "label": label,
-                "count": count,
-                "mean_score": mean_score,
-                "examples": examples,
-            }
+    results = sa.select(
+        obj.id,
+        label.label("label"),
+        score.label("score"),
+        area.label("area_pixels"),
+        obj.path.label("image_path"),
+        obj.monitoring_session_id,
+    ).where(obj.binary_label == constants.POSITIVE_BINARY_LABEL)
+    if monitoring_session:
+        results = results.where(obj.monitoring_session_id == monitoring_session.id)
+    results = results.cte("results")
+
+    if examples_by == "score":
+        example_order = [results.c.score.desc(), results.c.area_pixels.desc()]
+    elif examples_by == "area_pixels":
+        example_order = [results.c.area_pixels.desc(), results.c.score.desc()]
+    else:
+        raise ValueError(f"Can't choose examples by {examples_by}")
+
+    # The totals of each label, joined to the top ranked examples of the label
+    totals = (
+        sa.select(
+            results.c.label,
+            sa.func.count().label("count"),
+            sa.func.avg(results.c.score).label("mean_score"),
         )
-    summary.sort(key=lambda item: item["count"], reverse=True)
-    return summary
+        .group_by(results.c.label)
+        .subquery()
+    )
+    examples = sa.select(
+        results,
+        sa.func.row_number()
+        .over(partition_by=results.c.label, order_by=example_order + [results.c.id])
+        .label("rank"),
+    ).subquery()
+    return (
+        sa.select(
+            examples.c.id,
+            examples.c.label,
+            examples.c.score,
+            examples.c.image_path,
+            examples.c.monitoring_session_id,
+            totals.c["count"],
+            totals.c.mean_score,
+        )
+        .join(totals, examples.c.label.is_not_distinct_from(totals.c.label))
+        .where(examples.c.rank <= num_examples)
+        .order_by(totals.c["count"].desc(), examples.c.label, examples.c.rank)
+    )
 
-    # Pandas implementation:
-    # df = pd.DataFrame(results)
-    # stats = df.groupby("label").agg({"score": ["max", "mean"], "label": ["count"]})
 
-    # best_examples = (
-    #     df.sort_values("score", ascending=False)
-    #     .drop_duplicates("label", keep="first")
-    #     .set_index("label")
-    # )[["image_path"]]
-    # summary = best_examples.join(stats)
-    # summary.columns = ["example_image_path", "max_score", "mean_score", "count"]
-    # return summary.to_dict(orient="records")
+def summarize_results(
+    db_path,
+    monitoring_session=None,
+    classification_threshold: float = -1,
+    num_examples=3,
+    examples_by="area_pixels",
+):
+    query = species_summary_query(
+        monitoring_session,
+        classification_threshold=classification_threshold,
+        num_examples=num_examples,
+        examples_by=examples_by,
+    )
+    summary = {}
+    with get_session(db_path) as sesh:
+        for record in sesh.execute(query).mappings():
+            name = record["label"]
+            if name not in summary:
+                summary[name] = {
+                    "label": name,
+                    "count": record["count"],
+                    "mean_score": record["mean_score"],
+                    "examples": [],
+                }
+            summary[name]["examples"].append(
+                {
+                    "id": record["id"],
+                    "label": name,
+                    "score": record["score"],
+                    "image_path": record["image_path"],
+                    "monitoring_session": record["monitoring_session_id"],
+                }
+            )
+    return list(summary.values())
 
 
 def count_species_with_images(db_session=None, monitoring_session=None):
@@ -169,11 +232,8 @@ def count_species_with_images(db_session=None, monitoring_session=None):
         return query
 
 
-def update_all_aggregates(directory):
-    # Call the update_aggregates method of every model
-    raise NotImplementedError
-
-    with get_session(directory) as sesh:
-        for ms in sesh.query(None).all():
-            ms.update_aggregates()
+def update_all_aggregates(db_path):
+    # Count the totals of every monitoring session again
+    with get_session(db_path) as sesh:
+        models.events.update_session_aggregates(sesh)
         sesh.commit()
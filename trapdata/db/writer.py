@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from trapdata import logger
+from trapdata.db.base import get_session, retry_on_locked
+
+
+# Defaults for the `writer_flush_interval` and `writer_flush_size` settings
+FLUSH_INTERVAL = 0.05  # Seconds
+FLUSH_SIZE = 50  # Writes per transaction
+# Writes that can wait for the writer before `submit` blocks the caller
+MAX_PENDING = 200
+
+
+class DatabaseWriterError(Exception):
+    pass
+
+
+class DatabaseWriter:
+    """
+    Save the results of all pipeline stages from a single thread.
+
+    Each write is a function that takes a session, e.g. `insert_detected_objects`.
+    Writes submitted by any stage or thread are run in the order they arrive,
+    and are grouped into one transaction until `flush_size` writes are waiting
+    or `flush_interval` seconds have passed since the first one. SQLite only
+    allows one writer at a time, so this replaces many small transactions that
+    wait for each other with a few larger ones.
+
+    `submit` returns a Future with the result of the write, once it has been
+    committed, and blocks if too many writes are waiting (backpressure).
+    `execute` waits for the result, and commits the current group right away.
+    If a transaction fails, every write in it fails and the writer stops
+    accepting new ones. Use as a context manager to flush all waiting writes
+    when the pipeline stops.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.num_writes = 0
+        self.num_transactions = 0
+        self.thread = None
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(
+                target=self.run, name="Trapdata Database Writer", daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Add a write to the queue. `func` is called with a session as the first
+        argument, followed by `args` and `kwargs`, and must not commit.
+        """
+        if self.error:
+            raise DatabaseWriterError("Database writer has stopped") from self.error
+        if not self.thread:
+            self.start()
+        future = Future()
+        if self.pending.full():
+            logger.debug("Database writer is behind, waiting to submit")
+        self.pending.put((future, func, args, kwargs))
+        return future
+
+    def execute(self, func: Callable, *args, **kwargs):
+        """
+        Submit a write and return its result once it has been committed,
+        without waiting for more writes to group with it.
+        """
+        future = self.submit(func, *args, **kwargs)
+        self.flush()
+        return future.result()
+
+    def flush(self):
+        """
+        Wait until every write that was submitted has been committed.
+        """
+        future = self.submit(None)
+        future.result()
+
+    def stop(self):
+        """
+        Commit any waiting writes and stop the thread.
+        """
+        if self.thread:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+            logger.info(
+                f"Database writer saved {self.num_writes} writes "
+                f"in {self.num_transactions} transactions"
+            )
+        if self.error:
+            raise DatabaseWriterError("Some results were not saved") from self.error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_group(self):
+        """
+        Wait for the next write, then for others to group with it. Returns
+        the writes and whether the writer was asked to stop.
+        """
+        first = self.pending.get()
+        if first is None:
+            return [], True
+        group = [first]
+        deadline = time.time() + self.flush_interval
+        # A write without a function means someone is waiting for a flush
+        while len(group) < self.flush_size and group[-1][1] is not None:
+            try:
+                item = self.pending.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:
+                return group, True
+            group.append(item)
+        return group, False
+
+    @retry_on_locked
+    def write(self, group):
+        results = []
+        with get_session(self.db_path) as sesh:
+            for _, func, args, kwargs in group:
+                results.append(func(sesh, *args, **kwargs) if func else None)
+            sesh.commit()
+        return results
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            group, stopping = self.get_group()
+            if not group:
+                continue
+            if self.error:
+                results = [self.error for _ in group]
+            else:
+                try:
+                    results = self.write(group)
+                    self.num_writes += sum(1 for item in group if item[1])
+                    self.num_transactions += 1
+                except Exception as e:
+                    logger.error(f"Failed to save {len(group)} writes: {e}")
+                    self.error = e
+                    results = [e for _ in group]
+            for (future, _, _, _), result in zip(group, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
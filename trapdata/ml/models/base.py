@@ -1,4 +1,5 @@
 import json
+import time
 
 import torch
 from sentry_sdk import start_transaction
@@ -9,6 +10,7 @@ from trapdata.ml.utils import (
     get_device,
     get_or_download_file,
     StopWatch,
+    ThroughputCounter,
 )
 from trapdata.common.utils import slugify
 
@@ -61,6 +63,9 @@ class InferenceBaseClass:
     type = "unknown"
     stage = 0
     single = True
+    input_queue = None  # In-memory queue of item IDs from the previous stage
+    results_queue = None  # In-memory queue of item IDs for the next stage
+    writer = None  # DatabaseWriter shared by all stages of the pipeline
 
     def __init__(self, db_path, **kwargs):
         self.db_path = db_path
@@ -192,12 +197,19 @@ class InferenceBaseClass:
         #     yield self.post_process_single(item)
 
     def save_results(self, item_ids, batch_output):
+        """
+        Save the results of a batch to the database.
+
+        Return the IDs of any new or updated items that should be passed
+        on to the next stage of the pipeline.
+        """
         logger.warn("No save method configured for model. Doing nothing with results")
         return None
 
     @torch.no_grad()
     def run(self):
         torch.cuda.empty_cache()
+        self.throughput = ThroughputCounter(self.name)
 
         for i, batch in enumerate(self.dataloader):
             if not batch:
@@ -211,6 +223,8 @@ class InferenceBaseClass:
                 f"Processing batch {i+1}, about {len(self.dataloader)} remaining"
             )
 
+            batch_start = time.time()
+
             # @TODO the StopWatch doesn't seem to work when there are multiple workers,
             # it always returns 0 seconds.
             with StopWatch() as batch_time:
@@ -226,7 +240,22 @@ class InferenceBaseClass:
             batch_output = list(self.post_process_batch(batch_output))
             item_ids = item_ids.tolist()
             logger.info(f"Saving {len(item_ids)} results")
-            self.save_results(item_ids, batch_output)
+            next_item_ids = self.save_results(item_ids, batch_output)
+            if hasattr(self.dataset, "queue"):
+                self.dataset.queue.complete(item_ids, writer=self.writer)
+            self.throughput.add(len(item_ids), seconds=time.time() - batch_start)
+
+            if self.results_queue is not None and next_item_ids:
+                if self.writer:
+                    # The next stage pulls the items from the database queue
+                    self.writer.flush()
+                # Blocks if the next stage has fallen behind
+                self.results_queue.put(next_item_ids)
+
             logger.info(f"{self.name} Batch -- Done")
 
+        if self.writer:
+            self.writer.flush()
+        self.throughput.stop()
         logger.info(f"{self.name} -- Done")
+        logger.info(self.throughput)
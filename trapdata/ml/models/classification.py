@@ -24,26 +24,92 @@ class ClassificationIterableDatabaseDataset(torch.utils.data.IterableDataset):
         return self.queue.queue_count()
 
     def __iter__(self):
-        while len(self):
+        # Items that are leased to other workers are still counted in the queue,
+        # so stop as soon as there is nothing left to pull.
+        while True:
             worker_info = torch.utils.data.get_worker_info()
             logger.info(f"Using worker: {worker_info}")
 
             records = self.queue.pull_n_from_queue(self.batch_size)
             if records:
-                item_ids = torch.utils.data.default_collate(
-                    [record.id for record in records]
-                )
-                batch_data = torch.utils.data.default_collate(
-                    [self.transform(record.cropped_image_data()) for record in records]
-                )
-                yield (item_ids, batch_data)
+                yield self.collate(records)
+            else:
+                break
+
+    def collate(self, records):
+        item_ids = torch.utils.data.default_collate([record.id for record in records])
+        batch_data = torch.utils.data.default_collate(
+            [self.transform(record.cropped_image_data()) for record in records]
+        )
+        return (item_ids, batch_data)
 
     def transform(self, cropped_image):
         return self.image_transforms(cropped_image)
 
 
+class ClassificationStreamingDataset(ClassificationIterableDatabaseDataset):
+    """
+    Classify objects as soon as the previous stage of the pipeline hands
+    over their IDs through an in-memory queue, rather than waiting for the
+    previous stage to finish.
+
+    The objects are still pulled from the database queue before they are
+    processed, so the database remains the record of what is left to do.
+    Objects left in the database queue by a previous run are processed first,
+    since the previous stage may keep running while it waits for new images.
+    When the previous stage is done (it sends `None`), any objects remaining
+    in the database queue are processed as usual.
+
+    The in-memory queue can't be shared with dataloader worker processes,
+    so this must be used in single worker mode.
+    """
+
+    def __init__(self, queue, input_queue, image_transforms, batch_size=4):
+        super().__init__(queue, image_transforms, batch_size)
+        self.input_queue = input_queue
+        self.input_finished = False
+
+    def __len__(self):
+        return self.input_queue.qsize() + self.queue.queue_count()
+
+    def pull_ids(self, pending):
+        """
+        Wait for IDs from the previous stage, then take whatever else is ready
+        up to the batch size. Returns False once the previous stage is done.
+        """
+        item_ids = self.input_queue.get()
+        while item_ids is not None:
+            pending.extend(item_ids)
+            if len(pending) >= self.batch_size or self.input_queue.empty():
+                return True
+            item_ids = self.input_queue.get()
+        self.input_finished = True
+        return False
+
+    def __iter__(self):
+        logger.info("Checking database queue before the previous stage is done")
+        yield from super().__iter__()
+
+        pending = []
+        streaming = True
+        while streaming or pending:
+            if streaming and len(pending) < self.batch_size:
+                streaming = self.pull_ids(pending)
+
+            item_ids, pending = pending[: self.batch_size], pending[self.batch_size :]
+            if item_ids:
+                records = self.queue.pull_n_from_queue(len(item_ids), ids=item_ids)
+                if records:
+                    yield self.collate(records)
+
+        logger.info("Previous stage is done, checking database queue")
+        yield from super().__iter__()
+
+
 class EfficientNetClassifier(InferenceBaseClass):
     input_size = 300
+    normalization_mean = [0.5, 0.5, 0.5]
+    normalization_std = [0.5, 0.5, 0.5]
 
     def get_model(self):
         num_classes = len(self.category_map)
@@ -62,7 +128,7 @@ class EfficientNetClassifier(InferenceBaseClass):
         return model
 
     def get_transforms(self):
-        mean, std = [0.5, 0.5, 0.5], [0.5, 0.5, 0.5]
+        mean, std = self.normalization_mean, self.normalization_std
 
         return torchvision.transforms.Compose(
             [
@@ -72,6 +138,14 @@ class EfficientNetClassifier(InferenceBaseClass):
             ]
         )
 
+    def get_crop_transforms(self):
+        """
+        Transforms for crops that are already tensors of the input size,
+        see `trapdata.ml.utils.crop_bboxes`.
+        """
+        mean, std = self.normalization_mean, self.normalization_std
+        return torchvision.transforms.Normalize(mean, std)
+
     def post_process_batch(self, output):
         predictions = torch.nn.functional.softmax(output, dim=1)
         predictions = predictions.cpu().numpy()
@@ -111,6 +185,8 @@ class Resnet50(torch.nn.Module):
 
 class Resnet50Classifier(InferenceBaseClass):
     input_size = 300
+    normalization_mean = [0.485, 0.456, 0.406]
+    normalization_std = [0.229, 0.224, 0.225]
 
     def get_model(self):
         num_classes = len(self.category_map)
@@ -125,7 +201,7 @@ class Resnet50Classifier(InferenceBaseClass):
         return model
 
     def get_transforms(self):
-        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+        mean, std = self.normalization_mean, self.normalization_std
         return torchvision.transforms.Compose(
             [
                 torchvision.transforms.Resize((self.input_size, self.input_size)),
@@ -134,6 +210,14 @@ class Resnet50Classifier(InferenceBaseClass):
             ]
         )
 
+    def get_crop_transforms(self):
+        """
+        Transforms for crops that are already tensors of the input size,
+        see `trapdata.ml.utils.crop_bboxes`.
+        """
+        mean, std = self.normalization_mean, self.normalization_std
+        return torchvision.transforms.Normalize(mean, std)
+
     def post_process_batch(self, output):
         predictions = torch.nn.functional.softmax(output, dim=1)
         predictions = predictions.cpu().numpy()
@@ -170,11 +254,20 @@ class BinaryClassifier(EfficientNetClassifier):
     positive_negative_label = None
 
     def get_dataset(self):
-        dataset = ClassificationIterableDatabaseDataset(
-            queue=DetectedObjectQueue(self.db_path, self.image_base_path),
-            image_transforms=self.get_transforms(),
-            batch_size=self.batch_size,
-        )
+        queue = DetectedObjectQueue(self.db_path, self.image_base_path)
+        if self.input_queue is not None:
+            dataset = ClassificationStreamingDataset(
+                queue=queue,
+                input_queue=self.input_queue,
+                image_transforms=self.get_transforms(),
+                batch_size=self.batch_size,
+            )
+        else:
+            dataset = ClassificationIterableDatabaseDataset(
+                queue=queue,
+                image_transforms=self.get_transforms(),
+                batch_size=self.batch_size,
+            )
         return dataset
 
     def save_results(self, object_ids, batch_output):
@@ -188,7 +281,16 @@ class BinaryClassifier(EfficientNetClassifier):
             }
             for label, score in batch_output
         ]
-        save_classified_objects(self.db_path, object_ids, classified_objects_data)
+        save_classified_objects(
+            self.db_path, object_ids, classified_objects_data, writer=self.writer
+        )
+
+        # Only objects of interest continue on to the species classifier
+        return [
+            object_id
+            for object_id, (label, _) in zip(object_ids, batch_output)
+            if label == constants.POSITIVE_BINARY_LABEL
+        ]
 
 
 class MothNonMothClassifier(BinaryClassifier):
@@ -205,11 +307,20 @@ class SpeciesClassifier:
     type = "fine_grained_classifier"
 
     def get_dataset(self):
-        dataset = ClassificationIterableDatabaseDataset(
-            queue=UnclassifiedObjectQueue(self.db_path, self.image_base_path),
-            image_transforms=self.get_transforms(),
-            batch_size=self.batch_size,
-        )
+        queue = UnclassifiedObjectQueue(self.db_path, self.image_base_path)
+        if self.input_queue is not None:
+            dataset = ClassificationStreamingDataset(
+                queue=queue,
+                input_queue=self.input_queue,
+                image_transforms=self.get_transforms(),
+                batch_size=self.batch_size,
+            )
+        else:
+            dataset = ClassificationIterableDatabaseDataset(
+                queue=queue,
+                image_transforms=self.get_transforms(),
+                batch_size=self.batch_size,
+            )
         return dataset
 
     def save_results(self, object_ids, batch_output):
@@ -222,7 +333,9 @@ class SpeciesClassifier:
             }
             for label, score in batch_output
         ]
-        save_classified_objects(self.db_path, object_ids, classified_objects_data)
+        save_classified_objects(
+            self.db_path, object_ids, classified_objects_data, writer=self.writer
+        )
 
 
 class QuebecVermontMothSpeciesClassifierMixedResolution(
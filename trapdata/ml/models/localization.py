@@ -15,18 +15,44 @@ from trapdata.db.models.detections import save_detected_objects
 from trapdata.ml.models.base import InferenceBaseClass
 
 
+# Seconds to wait before pulling from an empty queue again, while watching
+# for new images
+POLL_INTERVAL = 5
+
+
 class LocalizationIterableDatabaseDataset(torch.utils.data.IterableDataset):
-    def __init__(self, queue, image_transforms, batch_size=1):
+    """
+    Pull batches of images from the queue until it is empty.
+
+    If `stop_polling` is given, wait `poll_interval` seconds and pull again
+    instead, until the event is set. Images that are added to the queue while
+    the pipeline is running (e.g. by `ami collect --watch --queue`) are then
+    processed without starting it again. Use a `multiprocessing.Event` if the
+    dataset is used by dataloader workers.
+    """
+
+    def __init__(
+        self,
+        queue,
+        image_transforms,
+        batch_size=1,
+        stop_polling=None,
+        poll_interval=POLL_INTERVAL,
+    ):
         super().__init__()
         self.queue = queue
         self.image_transforms = image_transforms
         self.batch_size = batch_size
+        self.stop_polling = stop_polling
+        self.poll_interval = poll_interval
 
     def __len__(self):
         return self.queue.queue_count()
 
     def __iter__(self):
-        while len(self):
+        # Items that are leased to other workers are still counted in the queue,
+        # so stop (or wait) as soon as there is nothing left to pull.
+        while True:
             worker_info = torch.utils.data.get_worker_info()
             logger.info(f"Using worker: {worker_info}")
 
@@ -40,6 +66,11 @@ class LocalizationIterableDatabaseDataset(torch.utils.data.IterableDataset):
                 )
 
                 yield (item_ids, batch_data)
+            elif self.stop_polling is None:
+                break
+            elif self.stop_polling.wait(self.poll_interval):
+                logger.info("Stopped waiting for new images")
+                break
 
     def transform(self, img_path):
         return self.image_transforms(PIL.Image.open(img_path))
@@ -113,6 +144,9 @@ class ObjectDetector(InferenceBaseClass):
     title = "Unknown Object Detector"
     type = "object_detection"
     stage = 1
+    save_crops = True
+    stop_polling = None  # Event that ends the wait for new images, see the dataset
+    poll_interval = POLL_INTERVAL
 
     def get_transforms(self):
         return torchvision.transforms.Compose(
@@ -126,10 +160,12 @@ class ObjectDetector(InferenceBaseClass):
             queue=ImageQueue(self.db_path, self.image_base_path),
             image_transforms=self.get_transforms(),
             batch_size=self.batch_size,
+            stop_polling=self.stop_polling,
+            poll_interval=self.poll_interval,
         )
         return dataset
 
-    def save_results(self, item_ids, batch_output):
+    def save_results(self, item_ids, batch_output, cropped_images=None):
         # Format data to be saved in DB
         # Here we are just saving the bboxes of detected objects
         detected_objects_data = []
@@ -143,9 +179,16 @@ class ObjectDetector(InferenceBaseClass):
             ]
             detected_objects_data.append(detected_objects)
 
-        save_detected_objects(
-            self.db_path, item_ids, detected_objects_data, self.user_data_path
+        detected_object_ids = save_detected_objects(
+            self.db_path,
+            item_ids,
+            detected_objects_data,
+            self.user_data_path,
+            save_crops=self.save_crops,
+            cropped_images=cropped_images,
+            writer=self.writer,
         )
+        return detected_object_ids
 
 
 class MothObjectDetector_FasterRCNN(ObjectDetector):
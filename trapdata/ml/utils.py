@@ -10,6 +10,7 @@ import torch
 import torchvision
 
 from trapdata import logger
+from trapdata.common import utils as common_utils
 
 
 def get_device(device_str=None):
@@ -80,13 +81,7 @@ def bbox_relative(bbox_absolute, img_width, img_height):
     """
 
     box_numpy = bbox_absolute.detach().cpu().numpy()
-    bbox_percent = [
-        round(box_numpy[0] / img_width, 4),
-        round(box_numpy[1] / img_height, 4),
-        round(box_numpy[2] / img_width, 4),
-        round(box_numpy[3] / img_height, 4),
-    ]
-    return bbox_percent
+    return common_utils.bbox_relative(box_numpy, img_width, img_height)
 
 
 def crop_bbox(image, bbox):
@@ -97,8 +92,8 @@ def crop_bbox(image, bbox):
     [(top-left-coordinate-pair), (bottom-right-coordinate-pair)]
     or: [x1, y1, x2, y2]
 
-    The image is assumed to be a numpy array that can be indexed using the
-    coordinate pairs.
+    The image is assumed to be a tensor (C, H, W) that can be indexed using the
+    coordinate pairs. Returns a PIL image.
     """
 
     x1, y1, x2, y2 = bbox
@@ -109,18 +104,41 @@ def crop_bbox(image, bbox):
         int(x1) : int(x2),
     ]
     transform_to_PIL = torchvision.transforms.ToPILImage()
-    cropped_image = transform_to_PIL(cropped_image)
-    yield cropped_image
+    cropped_image = transform_to_PIL(cropped_image.cpu())
+    return cropped_image
+
+
+def crop_bboxes(images, bboxes, output_size):
+    """
+    Crop and resize many bounding boxes from a batch of images in one operation,
+    without converting anything to PIL images or writing them to disk.
+
+    The images are a tensor (N, C, H, W) and the bounding boxes a list of
+    (image_index, [x1, y1, x2, y2]) pairs. Returns a tensor of crops with the
+    shape (K, C, output_size, output_size) on the same device as the images.
+    """
+    rois = torch.tensor(
+        [[image_index, *bbox] for image_index, bbox in bboxes],
+        dtype=images.dtype,
+        device=images.device,
+    )
+    return torchvision.ops.roi_align(
+        images,
+        rois,
+        output_size=(output_size, output_size),
+        aligned=True,
+    )
 
 
 class StopWatch:
     """
     Measure inference time with GPU support.
 
-    >>> with stopwatch() as t:
-    >>>     sleep(5)
-    >>> int(t.duration)
-    >>> 5
+    >>> from time import sleep
+    >>> with StopWatch() as t:
+    ...     sleep(1)
+    >>> round(t.duration)
+    1
     """
 
     def __enter__(self):
@@ -140,3 +158,62 @@ class StopWatch:
         end = datetime.datetime.fromtimestamp(self.end).strftime("%H:%M:%S")
         seconds = int(round(self.duration, 1))
         return f"Started: {start}, Ended: {end}, Duration: {seconds} seconds"
+
+
+class ThroughputCounter:
+    """
+    Keep track of how many items a stage of the pipeline has processed
+    and how much of its time was spent working vs. waiting for input.
+
+    >>> from time import sleep
+    >>> counter = ThroughputCounter("Object detector")
+    >>> sleep(1)
+    >>> counter.add(num_items=4, seconds=1)
+    >>> counter.stop()
+    >>> counter
+    Object detector: 4 items in 1.0 seconds (4.0 items/sec, busy 100%)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.num_items = 0
+        self.num_batches = 0
+        self.busy_seconds = 0.0
+        self.start = time.time()
+        self.end = None
+
+    def add(self, num_items, seconds):
+        self.num_items += num_items
+        self.num_batches += 1
+        self.busy_seconds += seconds
+
+    def stop(self):
+        self.end = time.time()
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def items_per_second(self):
+        return self.num_items / self.duration if self.duration else 0.0
+
+    @property
+    def busy_percent(self):
+        return 100 * self.busy_seconds / self.duration if self.duration else 0.0
+
+    def report_data(self):
+        return {
+            "stage": self.name,
+            "num_items": self.num_items,
+            "num_batches": self.num_batches,
+            "seconds": round(self.duration, 2),
+            "items_per_second": round(self.items_per_second, 2),
+            "busy_percent": round(self.busy_percent, 1),
+        }
+
+    def __repr__(self):
+        return (
+            f"{self.name}: {self.num_items} items in {round(self.duration, 1)} seconds "
+            f"({round(self.items_per_second, 2)} items/sec, busy {round(self.busy_percent)}%)"
+        )
@@ -1,14 +1,63 @@
+import enum
 import pathlib
+import queue
+import threading
+import time
+
+import torch
 
 from trapdata import logger
 from trapdata import ml
+from trapdata.db import writer as db_writer
+from trapdata.ml.models.localization import POLL_INTERVAL
+from trapdata.ml.utils import ThroughputCounter, crop_bbox, crop_bboxes
+
+
+# Number of batches that can wait between two stages of the streaming pipeline
+# before the previous stage is paused.
+STREAMING_QUEUE_SIZE = 10
+
 
+class PipelineMode(str, enum.Enum):
+    sequential = "sequential"
+    streaming = "streaming"
+    fused = "fused"
+
+
+def get_writer(db_path, config):
+    return db_writer.DatabaseWriter(
+        db_path,
+        flush_interval=config.getfloat(
+            "performance", "writer_flush_interval", fallback=db_writer.FLUSH_INTERVAL
+        ),
+        flush_size=config.getint(
+            "performance", "writer_flush_size", fallback=db_writer.FLUSH_SIZE
+        ),
+    )
 
-def start_pipeline(db_path, image_base_path, config, single=False):
+
+def get_models(
+    db_path,
+    image_base_path,
+    config,
+    single=False,
+    streaming=False,
+    writer=None,
+    stop_polling=None,
+    poll_interval=POLL_INTERVAL,
+):
     user_data_path = pathlib.Path(config.get("paths", "user_data_path"))
     logger.info(f"Local user data path: {user_data_path}")
     num_workers = int(config.get("performance", "num_workers"))
 
+    if streaming:
+        # Bounded queues so a slow stage applies backpressure to the previous one
+        detections_queue = queue.Queue(maxsize=STREAMING_QUEUE_SIZE)
+        moths_queue = queue.Queue(maxsize=STREAMING_QUEUE_SIZE)
+    else:
+        detections_queue = None
+        moths_queue = None
+
     model_1_name = config.get("models", "localization_model")
     Model_1 = ml.models.object_detectors[model_1_name]
     model_1 = Model_1(
@@ -18,9 +67,11 @@ def start_pipeline(db_path, image_base_path, config, single=False):
         batch_size=int(config.get("performance", "localization_batch_size")),
         num_workers=num_workers,
         single=single,
+        results_queue=detections_queue,
+        writer=writer,
+        stop_polling=stop_polling,
+        poll_interval=poll_interval,
     )
-    model_1.run()
-    logger.info("Localization complete")
 
     model_2_name = config.get("models", "binary_classification_model")
     Model_2 = ml.models.binary_classifiers[model_2_name]
@@ -30,10 +81,11 @@ def start_pipeline(db_path, image_base_path, config, single=False):
         user_data_path=user_data_path,
         batch_size=int(config.get("performance", "classification_batch_size")),
         num_workers=num_workers,
-        single=single,
+        single=single or streaming,
+        input_queue=detections_queue,
+        results_queue=moths_queue,
+        writer=writer,
     )
-    model_2.run()
-    logger.info("Binary classification complete")
 
     model_3_name = config.get("models", "taxon_classification_model")
     Model_3 = ml.models.species_classifiers[model_3_name]
@@ -43,7 +95,287 @@ def start_pipeline(db_path, image_base_path, config, single=False):
         user_data_path=user_data_path,
         batch_size=int(config.get("performance", "classification_batch_size")),
         num_workers=num_workers,
-        single=single,
+        single=single or streaming,
+        input_queue=moths_queue,
+        writer=writer,
     )
-    model_3.run()
-    logger.info("Species classification complete")
+
+    return model_1, model_2, model_3
+
+
+def start_pipeline(
+    db_path,
+    image_base_path,
+    config,
+    single=False,
+    stop_polling=None,
+    poll_interval=POLL_INTERVAL,
+):
+    """
+    Process the images in the queue with the models chosen in the config.
+
+    If `stop_polling` is given, keep waiting for new images once the queue is
+    empty, checking every `poll_interval` seconds, until the event is set.
+    The sequential mode would never get to the classifiers, so the streaming
+    mode is used instead.
+    """
+    mode = PipelineMode(
+        config.get("performance", "pipeline_mode", fallback=PipelineMode.sequential)
+    )
+    if stop_polling is not None and mode is PipelineMode.sequential:
+        logger.info("Using the streaming pipeline mode to watch for new images")
+        mode = PipelineMode.streaming
+    if mode is PipelineMode.streaming:
+        return start_streaming_pipeline(
+            db_path, image_base_path, config, single, stop_polling, poll_interval
+        )
+    elif mode is PipelineMode.fused:
+        return start_fused_pipeline(
+            db_path, image_base_path, config, single, stop_polling, poll_interval
+        )
+
+    with get_writer(db_path, config) as writer:
+        model_1, model_2, model_3 = get_models(
+            db_path, image_base_path, config, single, writer=writer
+        )
+
+        model_1.run()
+        logger.info("Localization complete")
+
+        model_2.run()
+        logger.info("Binary classification complete")
+
+        model_3.run()
+        logger.info("Species classification complete")
+
+
+def run_stage(model, stop_polling=None):
+    """
+    Run one stage of the streaming pipeline, then tell the next stage that no
+    more items are coming.
+
+    If the stage fails, keep accepting items from the previous stage so it is
+    not blocked forever. Those items remain in the database queue. While
+    watching for new images, `stop_polling` is set first so that the object
+    detector finishes.
+    """
+    try:
+        model.run()
+    except Exception as e:
+        logger.error(f"{model.name} stopped with an error: {e}")
+        if stop_polling is not None:
+            stop_polling.set()
+        input_finished = getattr(model.dataset, "input_finished", False)
+        if model.input_queue is not None and not input_finished:
+            while model.input_queue.get() is not None:
+                pass
+        raise
+    finally:
+        if model.results_queue is not None:
+            model.results_queue.put(None)
+
+
+def start_streaming_pipeline(
+    db_path,
+    image_base_path,
+    config,
+    single=False,
+    stop_polling=None,
+    poll_interval=POLL_INTERVAL,
+):
+    """
+    Run all stages of the pipeline at the same time.
+
+    New detections are handed to the binary classifier, and objects of interest
+    to the species classifier, through bounded in-memory queues as soon as their
+    results have been saved. Everything is still saved to the database first,
+    so any work that is interrupted is picked up by the regular queues.
+
+    While watching for new images (see `start_pipeline`), an interrupt sets
+    `stop_polling` so that every stage finishes before the writer is closed.
+
+    If a stage fails, the other stages finish what they were given and then
+    the first error is raised.
+    """
+    errors = []
+
+    def run_stage_and_keep_error(model):
+        try:
+            run_stage(model, stop_polling)
+        except Exception as e:
+            errors.append(e)
+
+    with get_writer(db_path, config) as writer:
+        models = get_models(
+            db_path,
+            image_base_path,
+            config,
+            single,
+            streaming=True,
+            writer=writer,
+            stop_polling=stop_polling,
+            poll_interval=poll_interval,
+        )
+
+        threads = [
+            threading.Thread(
+                target=run_stage_and_keep_error,
+                args=(model,),
+                name=f"Trapdata Pipeline Stage {model.stage}",
+            )
+            for model in models
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            if stop_polling is None:
+                raise
+            logger.info("Stopping once the batches in progress are saved")
+            stop_polling.set()
+            for thread in threads:
+                thread.join()
+            raise
+
+    if errors:
+        raise errors[0]
+    logger.info("Streaming pipeline complete")
+    throughput = [model.throughput for model in models if hasattr(model, "throughput")]
+    for stage in throughput:
+        logger.info(stage)
+    if throughput:
+        bottleneck = max(throughput, key=lambda stage: stage.busy_percent)
+        logger.info(f"Slowest stage: {bottleneck.name}")
+    return [stage.report_data() for stage in throughput]
+
+
+def classify_crops(model, images, detections):
+    """
+    Classify detected objects using crops cut from a batch of images that are
+    already in memory.
+
+    `detections` maps the ID of each object to its (image_index, bbox) in the batch.
+    Returns the IDs of objects that should be passed on to the next stage.
+    """
+    next_item_ids = []
+    item_ids = list(detections)
+    transforms = model.get_crop_transforms()
+
+    for i in range(0, len(item_ids), model.batch_size):
+        batch_start = time.time()
+        # Pull objects from the database queue just like the regular datasets,
+        # skipping any that have already been taken by another worker.
+        records = model.dataset.queue.pull_n_from_queue(
+            model.batch_size, ids=item_ids[i : i + model.batch_size]
+        )
+        if not records:
+            continue
+        batch_ids = [record.id for record in records]
+        crops = crop_bboxes(
+            images,
+            [detections[item_id] for item_id in batch_ids],
+            output_size=model.input_size,
+        )
+        batch_output = model.predict_batch(transforms(crops))
+        batch_output = list(model.post_process_batch(batch_output))
+        next_item_ids += model.save_results(batch_ids, batch_output) or []
+        model.dataset.queue.complete(batch_ids, writer=model.writer)
+        model.throughput.add(len(batch_ids), seconds=time.time() - batch_start)
+
+    if model.writer and next_item_ids:
+        # The next classifier pulls the objects from the database queue
+        model.writer.flush()
+    return next_item_ids
+
+
+@torch.no_grad()
+def start_fused_pipeline(
+    db_path,
+    image_base_path,
+    config,
+    single=False,
+    stop_polling=None,
+    poll_interval=POLL_INTERVAL,
+):
+    """
+    Classify each detected object using the image that was already loaded for
+    object detection.
+
+    Crops are cut and resized for each classifier in one batched operation,
+    instead of being saved to disk as JPEGs and opened again by the classifiers.
+    Saving the cropped images is optional (the `save_crops` setting).
+    """
+    save_crops = config.getboolean("performance", "save_crops", fallback=True)
+    with get_writer(db_path, config) as writer:
+        models = get_models(
+            db_path,
+            image_base_path,
+            config,
+            single,
+            writer=writer,
+            stop_polling=stop_polling,
+            poll_interval=poll_interval,
+        )
+        object_detector, binary_classifier, species_classifier = models
+        object_detector.save_crops = save_crops
+        for model in models:
+            model.throughput = ThroughputCounter(model.name)
+
+        for batch in object_detector.dataloader:
+            if not batch:
+                continue
+
+            batch_start = time.time()
+            image_ids, images = batch
+            image_ids = image_ids.tolist()
+            images = images.to(object_detector.device)
+            batch_output = object_detector.predict_batch(images)
+            bboxes = list(object_detector.post_process_batch(batch_output))
+
+            if save_crops:
+                cropped_images = [
+                    [crop_bbox(image, bbox) for bbox in image_bboxes]
+                    for image, image_bboxes in zip(images, bboxes)
+                ]
+            else:
+                cropped_images = None
+
+            object_ids = object_detector.save_results(
+                image_ids, bboxes, cropped_images=cropped_images
+            )
+            object_detector.dataset.queue.complete(
+                image_ids, writer=object_detector.writer
+            )
+            object_detector.throughput.add(len(image_ids), time.time() - batch_start)
+
+            detections = dict(
+                zip(
+                    object_ids,
+                    [
+                        (image_index, bbox)
+                        for image_index, image_bboxes in enumerate(bboxes)
+                        for bbox in image_bboxes
+                    ],
+                )
+            )
+            moth_ids = classify_crops(binary_classifier, images, detections)
+            classify_crops(
+                species_classifier,
+                images,
+                {object_id: detections[object_id] for object_id in moth_ids},
+            )
+
+        throughput = [model.throughput for model in models]
+        for stage in throughput:
+            stage.stop()
+            logger.info(stage)
+
+        # Process anything left in the database queues from previous runs
+        binary_classifier.run()
+        species_classifier.run()
+
+    logger.info("Fused pipeline complete")
+
+    return [stage.report_data() for stage in throughput]
@@ -1,3 +1,4 @@
+import enum
 import sys
 from functools import lru_cache
 from typing import Optional
@@ -13,6 +14,9 @@ import sqlalchemy
 from rich import print as rprint
 
 from trapdata import ml
+from trapdata.common.filemanagement import TimestampSource
+from trapdata.db.base import SQLiteJournalMode, SQLiteSynchronous
+from trapdata.pipeline import PipelineMode
 
 
 class Settings(BaseSettings):
@@ -22,6 +26,7 @@ class Settings(BaseSettings):
     ] = None
     user_data_path: Optional[pathlib.Path] = None
     image_base_path: Optional[pathlib.Path] = None
+    image_timestamps: TimestampSource = TimestampSource.exif
     localization_model: Optional[ml.models.ObjectDetectorChoice] = None
     binary_classification_model: Optional[ml.models.BinaryClassifierChoice] = None
     taxon_classification_model: Optional[ml.models.SpeciesClassifierChoice] = None
@@ -30,6 +35,15 @@ class Settings(BaseSettings):
     localization_batch_size: int = 2
     classification_batch_size: int = 20
     num_workers: int = 1
+    pipeline_mode: PipelineMode = PipelineMode.sequential
+    save_crops: bool = True
+    sqlite_journal_mode: SQLiteJournalMode = SQLiteJournalMode.wal
+    sqlite_synchronous: SQLiteSynchronous = SQLiteSynchronous.normal
+    sqlite_mmap_size_mb: int = 256
+    sqlite_cache_size_mb: int = 64
+    sqlite_busy_timeout: float = 10
+    writer_flush_interval: float = 0.05
+    writer_flush_size: int = 50
 
     @validator("image_base_path", "user_data_path")
     def validate_path(cls, v):
@@ -61,6 +75,16 @@ class Settings(BaseSettings):
                 "kivy_type": "path",
                 "kivy_section": "paths",
             },
+            "image_timestamps": {
+                "title": "Image timestamps",
+                "description": (
+                    "Read the time each image was taken from its EXIF tags, or from its filename (e.g. 20220810232637-00-16.jpg). "
+                    "Filenames are much faster to scan, only one image per folder is opened to check the time and timezone. "
+                    "Images in nightly folders (e.g. 2022_05_14) are grouped by folder."
+                ),
+                "kivy_type": "options",
+                "kivy_section": "paths",
+            },
             "database_url": {
                 "title": "Database connection string",
                 "description": "Defaults to a local SQLite database that will automatically be created. Supports PostgreSQL.",
@@ -129,6 +153,73 @@ class Settings(BaseSettings):
                 "kivy_type": "numeric",
                 "kivy_section": "performance",
             },
+            "pipeline_mode": {
+                "title": "Pipeline mode",
+                "description": (
+                    "Sequential runs each model over the whole queue before starting the next. "
+                    "Streaming runs all models at the same time, passing results between them as they are saved. "
+                    "Fused classifies objects using the images already loaded for detection, without reading crops from disk."
+                ),
+                "kivy_type": "options",
+                "kivy_section": "performance",
+            },
+            "save_crops": {
+                "title": "Save cropped images",
+                "description": (
+                    "Save an image of each detected object to the user data directory, they are shown in the species summaries. "
+                    "Only the fused pipeline mode can skip them, the other modes classify the saved images."
+                ),
+                "kivy_type": "bool",
+                "kivy_section": "performance",
+            },
+            "sqlite_journal_mode": {
+                "title": "SQLite journal mode",
+                "description": (
+                    "WAL allows the app to read from the database while the pipeline is writing to it. "
+                    "Use delete if the database is on a network drive, which does not support WAL."
+                ),
+                "kivy_type": "options",
+                "kivy_section": "performance",
+            },
+            "sqlite_synchronous": {
+                "title": "SQLite synchronous level",
+                "description": (
+                    "How often SQLite waits for data to be written to disk. "
+                    "Normal is safe with WAL, the most recent results may be lost in a power failure but the database will not be corrupted."
+                ),
+                "kivy_type": "options",
+                "kivy_section": "performance",
+            },
+            "sqlite_mmap_size_mb": {
+                "title": "SQLite memory-mapped size (MB)",
+                "description": "Size of the database file that is read directly from memory. Set to 0 to disable.",
+                "kivy_type": "numeric",
+                "kivy_section": "performance",
+            },
+            "sqlite_cache_size_mb": {
+                "title": "SQLite cache size (MB)",
+                "description": "Memory used to cache database pages, for each connection.",
+                "kivy_type": "numeric",
+                "kivy_section": "performance",
+            },
+            "sqlite_busy_timeout": {
+                "title": "SQLite busy timeout (seconds)",
+                "description": "How long to wait for another connection that is writing to the database before giving up.",
+                "kivy_type": "numeric",
+                "kivy_section": "performance",
+            },
+            "writer_flush_interval": {
+                "title": "Database write interval (seconds)",
+                "description": "How long the pipeline waits for more results to save in the same transaction.",
+                "kivy_type": "numeric",
+                "kivy_section": "performance",
+            },
+            "writer_flush_size": {
+                "title": "Database writes per transaction",
+                "description": "Maximum number of batches of results that are saved in the same transaction.",
+                "kivy_type": "numeric",
+                "kivy_section": "performance",
+            },
         }
 
         @classmethod
@@ -173,6 +264,27 @@ def kivy_settings_source(settings: BaseSettings) -> dict[str, str]:
         return kivy_settings_flat
 
 
+def settings_to_config(settings: Settings) -> configparser.ConfigParser:
+    """
+    Arrange the settings in the sections of the Kivy settings file, which is
+    the config that the pipeline reads.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    for name, field in Settings.Config.fields.items():
+        value = getattr(settings, name)
+        if value is None:
+            continue
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        elif isinstance(value, sqlalchemy.engine.URL):
+            value = value.render_as_string(hide_password=False)
+        section = field["kivy_section"]
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, name, str(value))
+    return config
+
+
 cli_help_message = f"""
     Configuration for the CLI is currently set in the following sources, in order of priority:
         - The system environment (os.environ)
@@ -0,0 +1,502 @@
+"""
+Micro-benchmarks for hot paths. Run with `ami test benchmark <name>`.
+"""
+import datetime
+import pathlib
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import PIL.Image
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from trapdata import logger
+from trapdata.common.filemanagement import (
+    construct_exif,
+    find_images,
+    group_images_by_day,
+    iter_image_groups,
+    sort_images_by_time,
+    get_image_timestamp_with_timezone,
+    read_image_metadata,
+    scan_images,
+    SCAN_WORKERS,
+    TimestampSource,
+)
+from trapdata.db import get_db, get_session, queries
+from trapdata.db.base import create_engine, configure_sqlite, SQLITE_PRAGMAS
+from trapdata.db.models.events import (
+    get_or_create_monitoring_sessions,
+    save_monitoring_sessions,
+)
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import (
+    DetectedObject,
+    save_detected_objects,
+    save_classified_objects,
+    get_object_counts_for_image,
+    iter_detection_reports,
+)
+from trapdata.ml.utils import StopWatch
+
+
+TEST_IMAGES = pathlib.Path(__file__).parent / "images"
+
+
+def sessions(num_sessions=500):
+    """
+    Open sessions and run a small query in each, like the queue counts and
+    playback stats do. Compare sharing one engine per database with creating
+    a new engine for every session.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        query = sa.select(sa.func.count(TrapImage.id))
+
+        with StopWatch() as new_engines:
+            for _ in range(num_sessions):
+                engine = create_engine(db_path)
+                with orm.Session(engine) as sesh:
+                    sesh.execute(query).scalar()
+                engine.dispose()
+
+        with StopWatch() as shared_engine:
+            for _ in range(num_sessions):
+                with get_session(db_path) as sesh:
+                    sesh.execute(query).scalar()
+
+    results = {
+        "New engine per session": num_sessions / new_engines.duration,
+        "Shared engine": num_sessions / shared_engine.duration,
+    }
+    for name, sessions_per_second in results.items():
+        logger.info(f"{name}: {sessions_per_second:.0f} sessions/sec")
+    return results
+
+
+def detections(num_objects=20000):
+    """
+    Save a large number of detected objects for the test images in one batch.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+        with get_session(db_path) as sesh:
+            image_ids = sesh.execute(sa.select(TrapImage.id)).scalars().all()
+
+        objects_per_image = num_objects // len(image_ids)
+        detected_objects_data = [
+            [
+                {"bbox": [i, i, i + 10, i + 10], "model_name": "Benchmark"}
+                for i in range(objects_per_image)
+            ]
+            for _ in image_ids
+        ]
+        with StopWatch() as t:
+            object_ids = save_detected_objects(
+                db_path, image_ids, detected_objects_data, save_crops=False
+            )
+
+        with get_session(db_path) as sesh:
+            assert sesh.execute(
+                sa.select(sa.func.count(DetectedObject.id))
+            ).scalar() == len(object_ids)
+            assert all(
+                image.num_detected_objects == objects_per_image
+                for image in sesh.execute(sa.select(TrapImage)).unique().scalars()
+            )
+
+    objects_per_second = len(object_ids) / t.duration
+    logger.info(f"Saved {len(object_ids)} detected objects in {t}")
+    logger.info(f"{objects_per_second:.0f} objects/sec")
+    return {"Detected objects saved per second": objects_per_second}
+
+
+def classifications(num_objects=20000):
+    """
+    Save the classification results of a large number of detected objects.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+        with get_session(db_path) as sesh:
+            image_id = sesh.execute(sa.select(TrapImage.id)).scalars().first()
+        object_ids = save_detected_objects(
+            db_path,
+            [image_id],
+            [[{"bbox": [0, 0, 10, 10]} for _ in range(num_objects)]],
+            save_crops=False,
+        )
+        classified_objects_data = [
+            {
+                "binary_label": "moth",
+                "binary_label_score": i / num_objects,
+                "in_queue": True,
+                "model_name": "Benchmark",
+            }
+            for i in range(num_objects)
+        ]
+        with StopWatch() as t:
+            save_classified_objects(db_path, object_ids, classified_objects_data)
+
+        with get_session(db_path) as sesh:
+            obj = sesh.get(DetectedObject, object_ids[-1])
+            assert obj.binary_label_score == (num_objects - 1) / num_objects
+
+    objects_per_second = len(object_ids) / t.duration
+    logger.info(f"{objects_per_second:.0f} objects/sec")
+    return {"Classified objects saved per second": objects_per_second}
+
+
+def read_latency(seconds=5):
+    """
+    Measure how long the stats of the playback screen take to load while the
+    pipeline is saving results in another thread, with SQLite's default
+    rollback journal and with the WAL profile.
+    """
+    profiles = {
+        "Rollback journal": {"journal_mode": "delete", "synchronous": "full"},
+        "WAL": {"journal_mode": "wal", "synchronous": "normal"},
+    }
+    original_profile = {
+        "journal_mode": SQLITE_PRAGMAS["journal_mode"],
+        "synchronous": SQLITE_PRAGMAS["synchronous"],
+    }
+    results = {}
+
+    for name, profile in profiles.items():
+        configure_sqlite(**profile)
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+            get_db(db_path, create=True)
+            get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+            with get_session(db_path) as sesh:
+                image_ids = sesh.execute(sa.select(TrapImage.id)).scalars().all()
+
+            done = threading.Event()
+
+            def write():
+                while not done.is_set():
+                    object_ids = save_detected_objects(
+                        db_path,
+                        image_ids,
+                        [[{"bbox": [0, 0, 10, 10]}] * 100 for _ in image_ids],
+                        save_crops=False,
+                    )
+                    save_classified_objects(
+                        db_path,
+                        object_ids,
+                        [{"binary_label": "moth", "in_queue": False}] * len(object_ids),
+                    )
+
+            writer = threading.Thread(target=write, name="Benchmark Writer")
+            writer.start()
+            latencies = []
+            end = time.time() + seconds
+            try:
+                while time.time() < end:
+                    image_id = image_ids[len(latencies) % len(image_ids)]
+                    start = time.time()
+                    get_object_counts_for_image(db_path, image_id)
+                    latencies.append(time.time() - start)
+            finally:
+                done.set()
+                writer.join()
+
+        latencies.sort()
+        results[name] = {
+            "reads": len(latencies),
+            "median_ms": latencies[len(latencies) // 2] * 1000,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+        logger.info(f"{name}: {results[name]}")
+
+    configure_sqlite(**original_profile)
+    return results
+
+
+def export(num_objects=100000):
+    """
+    Read the report data of every detected object, like the detections export
+    does, and measure the peak memory used while reading them.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+        with get_session(db_path) as sesh:
+            image_ids = sesh.execute(sa.select(TrapImage.id)).scalars().all()
+        objects_per_image = num_objects // len(image_ids)
+        save_detected_objects(
+            db_path,
+            image_ids,
+            [
+                [{"bbox": [i, i, i + 10, i + 10]} for i in range(objects_per_image)]
+                for _ in image_ids
+            ],
+            save_crops=False,
+        )
+
+        with StopWatch() as t:
+            num_records = sum(1 for _ in iter_detection_reports(db_path, TEST_IMAGES))
+
+        # Tracing memory slows everything down, so it is measured separately
+        tracemalloc.start()
+        for _ in iter_detection_reports(db_path, TEST_IMAGES):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    objects_per_second = num_records / t.duration
+    logger.info(f"Exported {num_records} detected objects in {t}")
+    return {
+        "Detected objects exported per second": objects_per_second,
+        "Peak memory (MB)": peak / 1024 / 1024,
+    }
+
+
+def species_summary(num_objects=1000000, num_species=500):
+    """
+    Summarize the species of a monitoring session with a large number of
+    classified objects, like the summary screen does on every refresh. Compare
+    grouping the objects in Python with grouping them in the database.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+        with get_session(db_path) as sesh:
+            image = sesh.execute(sa.select(TrapImage)).unique().scalars().first()
+            monitoring_session = image.monitoring_session
+            rng = random.Random(0)
+            for start in range(0, num_objects, 100000):
+                sesh.execute(
+                    sa.insert(DetectedObject),
+                    [
+                        {
+                            "image_id": image.id,
+                            "monitoring_session_id": image.monitoring_session_id,
+                            "deployment_id": image.deployment_id,
+                            "path": f"crops/{i}.jpg",
+                            "area_pixels": rng.randint(100, 10000),
+                            "binary_label": "moth" if rng.random() < 0.8 else "nonmoth",
+                            "specific_label": f"Species {rng.randrange(num_species)}",
+                            "specific_label_score": rng.random(),
+                        }
+                        for i in range(start, min(start + 100000, num_objects))
+                    ],
+                )
+            sesh.commit()
+
+        with StopWatch() as python_grouping:
+            results = queries.classification_results(
+                db_path, monitoring_session, classification_threshold=0.2
+            )
+            index = {}
+            for result in results:
+                index.setdefault(result["label"], []).append(result)
+            expected = {
+                label: (len(items), statistics.mean(i["score"] for i in items))
+                for label, items in index.items()
+            }
+            for items in index.values():
+                random.shuffle(items)
+
+        with StopWatch() as sql_grouping:
+            summary = queries.summarize_results(
+                db_path, monitoring_session, classification_threshold=0.2
+            )
+
+        assert len(summary) == len(expected)
+        for item in summary:
+            count, mean_score = expected[item["label"]]
+            assert item["count"] == count
+            assert abs(item["mean_score"] - mean_score) < 1e-6
+
+    logger.info(f"Python grouping: {python_grouping}, SQL grouping: {sql_grouping}")
+    return {
+        "Python grouping (seconds)": python_grouping.duration,
+        "SQL grouping (seconds)": sql_grouping.duration,
+    }
+
+
+def ingest(num_images=100000, images_per_night=1000):
+    """
+    Save the monitoring sessions of a deployment with a large number of
+    images, then save them again like a rescan of the same directory does.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        base_directory = pathlib.Path(directory) / "images"
+        start = datetime.datetime(2022, 6, 1, 22)
+        sessions = []
+        for night in range(num_images // images_per_night):
+            night_directory = base_directory / str(night)
+            night_directory.mkdir(parents=True)
+            day = start + datetime.timedelta(days=night)
+            images = []
+            for i in range(images_per_night):
+                path = night_directory / f"{i}.jpg"
+                path.write_bytes(b"")
+                images.append(
+                    {"path": path, "timestamp": day + datetime.timedelta(seconds=i)}
+                )
+            sessions.append(
+                {"day": day.date(), "num_images": len(images), "images": images}
+            )
+
+        with StopWatch() as first_scan:
+            save_monitoring_sessions(db_path, base_directory, sessions)
+        with StopWatch() as rescan:
+            save_monitoring_sessions(db_path, base_directory, sessions)
+
+        with get_session(db_path) as sesh:
+            assert sesh.execute(sa.select(sa.func.count(TrapImage.id))).scalar() == (
+                num_images
+            )
+
+    results = {
+        "Images saved per second": num_images / first_scan.duration,
+        "Images rescanned per second": num_images / rescan.duration,
+    }
+    for name, images_per_second in results.items():
+        logger.info(f"{name}: {images_per_second:.0f}")
+    return results
+
+
+def scan(directory=None, num_nights=20, images_per_night=200):
+    """
+    Find the images in a directory and read their timestamps, one at a time,
+    with a thread pool and from their filenames. Uses a directory of generated
+    images unless one is given, e.g. a mounted SD card.
+    """
+    with tempfile.TemporaryDirectory() as tmp_directory:
+        if not directory:
+            directory = pathlib.Path(tmp_directory)
+            image = PIL.Image.new("RGB", (640, 480))
+            start = datetime.datetime(2022, 6, 1, 22)
+            for night in range(num_nights):
+                night_directory = directory / f"2022_06_{night + 1:02}"
+                night_directory.mkdir()
+                for i in range(images_per_night):
+                    timestamp = start + datetime.timedelta(days=night, minutes=i)
+                    image.save(
+                        night_directory / f"{timestamp:%Y%m%d%H%M%S}-{i}.jpg",
+                        exif=construct_exif(timestamp=timestamp),
+                    )
+
+        with StopWatch() as sequential:
+            num_images = sum(1 for _ in find_images(directory))
+        with StopWatch() as threads:
+            assert sum(1 for _ in scan_images(directory)) == num_images
+        with StopWatch() as filenames:
+            images = scan_images(directory, timestamps=TimestampSource.filename)
+            assert sum(1 for _ in images) == num_images
+
+    results = {
+        "Images per second, one at a time": num_images / sequential.duration,
+        f"Images per second, {SCAN_WORKERS} threads": num_images / threads.duration,
+        "Images per second, from filenames": num_images / filenames.duration,
+    }
+    for name, images_per_second in results.items():
+        logger.info(f"{name}: {images_per_second:.0f}")
+    return results
+
+
+def grouping(num_images=500000, images_per_night=1000, chunk_size=50000):
+    """
+    Group images into monitoring sessions all at once, and one session at a
+    time from an external sort, and measure the peak memory used by each.
+    The images of each night are out of order, like a scan of one folder.
+    """
+    start = datetime.datetime(2022, 6, 1, 22, tzinfo=datetime.timezone.utc)
+
+    def images():
+        for night in range(num_images // images_per_night):
+            seconds = list(range(images_per_night))
+            random.Random(night).shuffle(seconds)
+            for i in seconds:
+                timestamp = start + datetime.timedelta(days=night, seconds=i * 10)
+                yield {
+                    "path": pathlib.Path(f"{night}/{i}.jpg"),
+                    "timestamp": timestamp,
+                    "filesize": 1000,
+                }
+
+    def in_memory():
+        return len(group_images_by_day(images()))
+
+    def streaming():
+        groups = iter_image_groups(sort_images_by_time(images(), chunk_size))
+        return sum(1 for _ in groups)
+
+    results = {}
+    for name, group in [("all at once", in_memory), ("streaming", streaming)]:
+        with StopWatch() as t:
+            num_sessions = group()
+        # Tracing memory slows everything down, so it is measured separately
+        tracemalloc.start()
+        assert group() == num_sessions
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"Images grouped per second, {name}"] = num_images / t.duration
+        results[f"Peak memory (MB), {name}"] = peak / 1024 / 1024
+    for name, value in results.items():
+        logger.info(f"{name}: {value:.0f}")
+    return results
+
+
+def metadata(repeat=100):
+    """
+    Read the timestamp and dimensions of the test images from their headers,
+    and by opening them with PIL.
+    """
+    paths = sorted(TEST_IMAGES.glob("*/*.jpg")) * repeat
+
+    with StopWatch() as with_pil:
+        for path in paths:
+            get_image_timestamp_with_timezone(path)
+            PIL.Image.open(path).size
+    with StopWatch() as from_header:
+        for path in paths:
+            read_image_metadata(path)
+
+    results = {
+        "Images per second with PIL": len(paths) / with_pil.duration,
+        "Images per second from header": len(paths) / from_header.duration,
+    }
+    for name, images_per_second in results.items():
+        logger.info(f"{name}: {images_per_second:.0f}")
+    return results
+
+
+BENCHMARKS = {
+    "sessions": sessions,
+    "detections": detections,
+    "classifications": classifications,
+    "read_latency": read_latency,
+    "export": export,
+    "species_summary": species_summary,
+    "ingest": ingest,
+    "scan": scan,
+    "metadata": metadata,
+    "grouping": grouping,
+}
+
+
+def run(name):
+    return BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    for name in BENCHMARKS:
+        run(name)
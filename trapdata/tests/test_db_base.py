@@ -0,0 +1,72 @@
+import os
+import signal
+import tempfile
+import threading
+
+import sqlalchemy as sa
+
+from trapdata.db import base, get_session
+from trapdata.db.models import detections
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import get_object_counts_for_image
+from trapdata.tests.test_writer import get_image_ids
+
+
+def test_engines_are_shared():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path, _ = get_image_ids(directory)
+        engine = base.get_engine(db_path)
+        assert base.get_engine(db_path) is engine
+        with get_session(db_path) as sesh:
+            assert sesh.get_bind() is engine
+
+        base.dispose_engines()
+        assert base.get_engine(db_path) is not engine
+        base.dispose_engines()
+
+
+def test_sessions_work_after_fork():
+    if not hasattr(os, "fork"):
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        db_path, image_ids = get_image_ids(directory)
+        get_object_counts_for_image(db_path, image_ids[0])
+
+        # Another thread is opening a session when a Dataloader worker is forked
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold_locks():
+            with base._engines_lock, detections._image_stats_lock:
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_locks)
+        thread.start()
+        held.wait()
+        pid = os.fork()
+        if pid == 0:
+            # Killed by the alarm if the child waits for the locks forever
+            signal.alarm(10)
+            try:
+                with get_session(db_path) as sesh:
+                    num_images = sesh.execute(
+                        sa.select(sa.func.count(TrapImage.id))
+                    ).scalar()
+                get_object_counts_for_image(db_path, image_ids[0])
+                os._exit(0 if num_images == len(image_ids) else 1)
+            except BaseException:
+                os._exit(1)
+        release.set()
+        thread.join()
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def run():
+    test_engines_are_shared()
+    test_sessions_work_after_fork()
+
+
+if __name__ == "__main__":
+    run()
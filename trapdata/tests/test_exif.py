@@ -1,4 +1,5 @@
 import pathlib
+import shutil
 import tempfile
 import datetime
 
@@ -7,6 +8,13 @@ import PIL.Image
 from trapdata import logger
 from trapdata.common.filemanagement import (
     find_images,
+    scan_images,
+    read_image_metadata,
+    parse_filename_timestamp,
+    parse_folder_date,
+    TimestampSource,
+    parse_exif_datetime,
+    get_image_timestamp_with_timezone,
     construct_exif,
     get_exif,
     EXIF_DATETIME_STR_FORMAT,
@@ -16,8 +24,126 @@ from trapdata.common.filemanagement import (
 TEST_IMAGES = pathlib.Path(__file__).parent / "images"
 
 
-def run():
-    logger.info(f"Using test images from: {TEST_IMAGES}")
+def test_scan_images():
+    expected = sorted(find_images(TEST_IMAGES), key=lambda image: image["path"])
+    assert expected
+
+    def key(image):
+        return image["path"], image["timestamp"]
+
+    for workers in [1, 4]:
+        images = list(scan_images(TEST_IMAGES, workers=workers))
+        assert [key(image) for image in images] == [key(image) for image in expected]
+        assert all(
+            image["filesize"] == image["path"].stat().st_size for image in images
+        )
+        images = scan_images(TEST_IMAGES, ordered=False, workers=workers)
+        assert sorted(map(key, images)) == sorted(map(key, expected))
+
+    # Images without a timestamp
+    images = list(scan_images(TEST_IMAGES, skip_bad_exif=False))
+    assert len(images) == len(list(find_images(TEST_IMAGES, skip_bad_exif=False)))
+
+    # Stopping early
+    images = scan_images(TEST_IMAGES, workers=2)
+    assert next(images) == next(scan_images(TEST_IMAGES))
+    images.close()
+
+
+def test_read_image_metadata():
+    paths = sorted(TEST_IMAGES.glob("*/*.jpg"))
+    assert paths
+    for path in paths:
+        metadata = read_image_metadata(path)
+        assert metadata["timestamp"] == get_image_timestamp_with_timezone(path)
+        assert (metadata["width"], metadata["height"]) == PIL.Image.open(path).size
+
+    # Other formats are read with PIL
+    timestamp = datetime.datetime(2022, 6, 1, 22, 30)
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / "image.png"
+        PIL.Image.new("RGB", (64, 48)).save(path, exif=construct_exif(timestamp))
+        assert read_image_metadata(path, default_offset="-4") == {
+            "timestamp": timestamp.replace(
+                tzinfo=datetime.timezone(datetime.timedelta(hours=-4))
+            ),
+            "width": 64,
+            "height": 48,
+        }
+
+    # Dates that are not in the EXIF format
+    assert parse_exif_datetime("2022:06:01 22:30") == timestamp
+    assert parse_exif_datetime("2022:06:01 22:30:00", "+2").utcoffset() == (
+        datetime.timedelta(hours=2)
+    )
+
+
+def test_filename_timestamps():
+    for path in TEST_IMAGES.glob("*/*.jpg"):
+        timestamp = read_image_metadata(path)["timestamp"]
+        assert parse_filename_timestamp(path.name) == timestamp.replace(tzinfo=None)
+    assert parse_filename_timestamp("2022-08-10_23-26-37.jpg") == (
+        datetime.datetime(2022, 8, 10, 23, 26, 37)
+    )
+    assert parse_filename_timestamp("snapshot-108.jpg") is None
+    # Not a valid date
+    assert parse_filename_timestamp("20221399999999.jpg") is None
+    assert parse_folder_date("2022_05_14") == datetime.date(2022, 5, 14)
+    assert parse_folder_date("20220514") == datetime.date(2022, 5, 14)
+    assert parse_folder_date("vermont") is None
+
+    def key(image):
+        return image["path"], image["timestamp"]
+
+    # The same timestamps and offsets as the EXIF tags, and the same dimensions
+    expected = list(map(key, scan_images(TEST_IMAGES)))
+    images = list(scan_images(TEST_IMAGES, timestamps=TimestampSource.filename))
+    assert list(map(key, images)) == expected
+    for image in images:
+        assert (image["width"], image["height"]) == PIL.Image.open(image["path"]).size
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        image = PIL.Image.new("RGB", (64, 48))
+        timestamp = datetime.datetime(2022, 6, 1, 22, 30)
+        image.save(directory / "no-timestamp.jpg", exif=construct_exif(timestamp))
+        image.save(directory / "20220601223500.jpg")
+        images = scan_images(directory, timestamps=TimestampSource.filename)
+        assert [image["timestamp"] for image in images] == [
+            timestamp.replace(minute=35, tzinfo=datetime.timezone.utc),
+            timestamp.replace(tzinfo=datetime.timezone.utc),
+        ]
+
+        # The dimensions of the first image are used for the others, unless
+        # the last one has different dimensions
+        night = directory / "sizes"
+        night.mkdir()
+        image.save(night / "20220601223000.jpg", exif=construct_exif(timestamp))
+        image.save(night / "20220601223500.jpg")
+        images = scan_images(night, timestamps=TimestampSource.filename)
+        assert [(image["width"], image["height"]) for image in images] == [
+            (64, 48),
+            (64, 48),
+        ]
+        PIL.Image.new("RGB", (32, 24)).save(night / "20220601224000.jpg")
+        images = scan_images(night, timestamps=TimestampSource.filename)
+        assert [(image["width"], image["height"]) for image in images] == [
+            (64, 48),
+            (64, 48),
+            (32, 24),
+        ]
+        shutil.rmtree(night)
+
+        # Names that don't match their EXIF tags
+        image.save(directory / "20220101000000.jpg", exif=construct_exif(timestamp))
+        images = scan_images(directory, timestamps=TimestampSource.filename)
+        assert [image["timestamp"] for image in images] == [
+            timestamp.replace(tzinfo=datetime.timezone.utc),
+            timestamp.replace(tzinfo=datetime.timezone.utc),
+        ]
+
+
+def test_exif_tags():
     saved_images = []
     timestamp = datetime.datetime.now() - datetime.timedelta(days=365 * 100)
     description = f"Image with test EXIF tags created at {timestamp}"
@@ -47,5 +173,13 @@ def run():
         assert exif_result["ImageDescription"] == description
 
 
+def run():
+    logger.info(f"Using test images from: {TEST_IMAGES}")
+    test_scan_images()
+    test_read_image_metadata()
+    test_filename_timestamps()
+    test_exif_tags()
+
+
 if __name__ == "__main__":
     run()
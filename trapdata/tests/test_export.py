@@ -0,0 +1,163 @@
+import csv
+import gzip
+import json
+import pathlib
+import tempfile
+
+from trapdata import logger
+from trapdata.common.utils import ExportFormat, write_report
+from trapdata.db import parquet
+from trapdata.db.models.detections import (
+    save_detected_objects,
+    save_classified_objects,
+    get_detected_objects,
+    iter_detection_reports,
+)
+from trapdata.db.models.events import get_monitoring_sessions_from_db
+from trapdata.tests.test_queue import TEST_IMAGES, get_queue
+
+
+def create_detections(directory, objects_per_image=3):
+    queue = get_queue(directory)
+    image_ids = [image.id for image in queue.pull_n_from_queue(4)]
+    save_detected_objects(
+        queue.db_path,
+        image_ids,
+        [
+            [{"bbox": [i, i, i + 10, i + 10], "model_name": "Test"}] * objects_per_image
+            for i, _ in enumerate(image_ids)
+        ],
+        save_crops=False,
+    )
+    return queue.db_path
+
+
+def test_detection_reports_are_paged():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_detections(directory)
+        objects = sorted(
+            get_detected_objects(db_path, TEST_IMAGES), key=lambda obj: obj.id
+        )
+        expected = [obj.report_data() for obj in objects]
+        assert len(expected) == 12
+
+        # Pages that end exactly at the last object, and a shorter last page
+        for page_size in [1, 3, 5, 100]:
+            records = iter_detection_reports(db_path, TEST_IMAGES, page_size=page_size)
+            assert list(records) == expected
+
+        records = iter_detection_reports(
+            db_path, TEST_IMAGES, limit=4, offset=5, page_size=3
+        )
+        assert list(records) == expected[5:9]
+
+        session = objects[-1].monitoring_session
+        records = iter_detection_reports(
+            db_path, TEST_IMAGES, monitoring_session=session, page_size=2
+        )
+        assert list(records) == [
+            obj.report_data()
+            for obj in objects
+            if obj.monitoring_session_id == session.id
+        ]
+
+        assert not list(iter_detection_reports(db_path, directory))
+
+
+def test_reports_are_written_in_each_format():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_detections(directory)
+        expected = list(iter_detection_reports(db_path, TEST_IMAGES))
+        # The same values as the JSON export
+        expected = json.loads(json.dumps(expected, default=str))
+        reports = pathlib.Path(directory) / "reports"
+
+        def read(name, format):
+            records = iter_detection_reports(db_path, TEST_IMAGES, page_size=5)
+            filepath = reports / name
+            assert write_report(records, filepath, format=format) == len(expected)
+            open_file = gzip.open if name.endswith(".gz") else open
+            with open_file(filepath, "rt", newline="") as f:
+                return f.read()
+
+        assert json.loads(read("detections.json", ExportFormat.json)) == expected
+        for name in ["detections.ndjson", "detections.ndjson.gz"]:
+            lines = read(name, ExportFormat.ndjson).splitlines()
+            assert [json.loads(line) for line in lines] == expected
+
+        rows = list(csv.reader(read("detections.csv", ExportFormat.csv).splitlines()))
+        assert rows[0] == list(expected[0].keys())
+        assert len(rows) == len(expected) + 1
+
+        # Nothing is written without any records
+        assert write_report(iter([]), reports / "empty.csv") == 0
+        assert not (reports / "empty.csv").exists()
+        # Unless an empty report is wanted, like `ami export` writes
+        assert write_report(iter([]), reports / "empty.csv", skip_empty=False) == 0
+        assert (reports / "empty.csv").read_text() == ""
+        filepath = reports / "empty.json"
+        assert (
+            write_report(iter([]), filepath, ExportFormat.json, skip_empty=False) == 0
+        )
+        assert json.loads(filepath.read_text()) == []
+
+
+def test_parquet_partitions_are_updated():
+    if parquet.pa is None:
+        logger.warn("pyarrow is not installed, skipping Parquet export test")
+        return
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_detections(directory)
+        objects = get_detected_objects(db_path, TEST_IMAGES)
+        output = pathlib.Path(directory) / "parquet"
+
+        written = parquet.export_detections_parquet(db_path, output)
+        nights = {obj.monitoring_session.day.isoformat() for obj in objects}
+        assert sorted(partition.split("day=")[1] for partition in written) == sorted(
+            nights
+        )
+        table = pyarrow.dataset.dataset(
+            output / "detections", format="parquet", partitioning="hive"
+        ).to_table()
+        assert sorted(table["id"].to_pylist()) == sorted(obj.id for obj in objects)
+        assert table.schema.field("bbox_x2").type == "int32"
+        assert table.schema.field("binary_label_score").type == "float"
+        assert str(table.schema.field("model_name").type).startswith("dictionary")
+
+        # Nothing has changed
+        assert not parquet.export_detections_parquet(db_path, output)
+
+        # Only the night of the classified object is written again
+        obj = objects[0]
+        save_classified_objects(
+            db_path, [obj.id], [{"binary_label": "moth", "binary_label_score": 0.9}]
+        )
+        written = parquet.export_detections_parquet(db_path, output)
+        assert written == [
+            f"deployment_id={obj.deployment_id}"
+            f"/day={obj.monitoring_session.day.isoformat()}"
+        ]
+        table = pyarrow.parquet.read_table(output / "detections" / written[0])
+        row = table.filter(pyarrow.compute.equal(table["id"], obj.id)).to_pylist()[0]
+        assert row["category_label"] == "moth"
+
+        written = parquet.export_events_parquet(db_path, output)
+        table = pyarrow.parquet.read_table(output / "events" / written[0])
+        assert table.num_rows == len(
+            get_monitoring_sessions_from_db(db_path, TEST_IMAGES)
+        )
+
+
+def run():
+    logger.info(f"Using test images from: {TEST_IMAGES}")
+    test_detection_reports_are_paged()
+    test_reports_are_written_in_each_format()
+    test_parquet_partitions_are_updated()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,93 @@
+import PIL.Image
+import torch
+import torchvision
+
+from trapdata.ml.utils import ThroughputCounter, crop_bboxes
+from trapdata.tests.test_queue import TEST_IMAGES
+
+
+# Largest mean difference of the pixel values (0-1) of a crop compared to PIL
+CROP_TOLERANCE = 0.01
+
+
+def get_devices():
+    devices = [torch.device("cpu")]
+    if torch.cuda.is_available():
+        devices.append(torch.device("cuda"))
+    return devices
+
+
+def test_crops_match_pil():
+    images = [
+        PIL.Image.open(TEST_IMAGES / "denmark" / name).convert("RGB")
+        for name in ["20220810232637-00-16.jpg", "20220810232855-00-20.jpg"]
+    ]
+    # Crops that are enlarged, shrunk and stretched, from both images
+    bboxes = [
+        (0, [100, 200, 132, 232]),
+        (1, [100, 200, 180, 250]),
+        (0, [300, 100, 556, 356]),
+        (1, [10, 10, 500, 300]),
+        (1, [3700, 2000, 3840, 2160]),
+    ]
+    output_size = 64
+    expected = torch.stack(
+        [
+            torchvision.transforms.functional.to_tensor(
+                images[image_index]
+                .crop(bbox)
+                .resize((output_size, output_size), PIL.Image.BILINEAR)
+            )
+            for image_index, bbox in bboxes
+        ]
+    )
+
+    for device in get_devices():
+        batch = torch.stack(
+            [torchvision.transforms.functional.to_tensor(image) for image in images]
+        ).to(device)
+        crops = crop_bboxes(batch, bboxes, output_size=output_size)
+
+        assert crops.shape == (len(bboxes), 3, output_size, output_size)
+        assert crops.device == batch.device
+        differences = (crops.cpu() - expected).abs().mean(dim=(1, 2, 3))
+        assert differences.max() < CROP_TOLERANCE, differences
+
+
+def test_throughput_counts():
+    counter = ThroughputCounter("Stub stage")
+    counter.add(num_items=4, seconds=0.5)
+    counter.add(num_items=2, seconds=0.25)
+    counter.start = 100.0
+    counter.end = 102.0
+
+    assert counter.num_items == 6
+    assert counter.num_batches == 2
+    assert counter.duration == 2
+    assert counter.items_per_second == 3
+    assert counter.busy_percent == 37.5
+    assert counter.report_data() == {
+        "stage": "Stub stage",
+        "num_items": 6,
+        "num_batches": 2,
+        "seconds": 2.0,
+        "items_per_second": 3.0,
+        "busy_percent": 37.5,
+    }
+    assert repr(counter) == (
+        "Stub stage: 6 items in 2.0 seconds (3.0 items/sec, busy 38%)"
+    )
+
+    # Nothing is divided by a duration of zero
+    counter.end = counter.start
+    assert counter.items_per_second == 0
+    assert counter.busy_percent == 0
+
+
+def run():
+    test_crops_match_pil()
+    test_throughput_counts()
+
+
+if __name__ == "__main__":
+    run()
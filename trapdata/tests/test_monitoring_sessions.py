@@ -0,0 +1,754 @@
+import datetime
+import pathlib
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+import PIL.Image
+import sqlalchemy as sa
+
+from trapdata import logger
+from trapdata import constants
+from trapdata.common.filemanagement import (
+    EXIF_DATETIME_STR_FORMAT,
+    construct_exif,
+    hash_file,
+    TimestampSource,
+    group_images_by_day,
+    iter_image_groups,
+    scan_images,
+    sort_images_by_time,
+)
+from trapdata.db import get_db, get_session, queries
+from trapdata.db.models.events import (
+    MonitoringSession,
+    get_monitoring_sessions_from_filesystem,
+    iter_monitoring_sessions_from_filesystem,
+    save_monitoring_sessions,
+    get_or_create_monitoring_sessions,
+    get_monitoring_sessions_from_db,
+)
+from trapdata.db.models import detections
+from trapdata.db.models.images import TrapImage, completely_classified
+from trapdata.db.models.detections import (
+    DetectedObject,
+    save_detected_objects,
+    save_classified_objects,
+    delete_objects_for_image,
+    get_object_counts_for_image,
+    get_objects_for_image,
+    get_detections_for_image,
+    get_classifications_for_image,
+    get_species_for_image,
+)
+from trapdata.db.models.deployments import Deployment
+from trapdata.db.models.queue import ImageQueue
+from trapdata.db.models.scans import DeploymentWatcher, rescan_deployment
+from trapdata.tests.test_queue import TEST_IMAGES, get_queue
+
+
+def get_totals(db_path):
+    with get_session(db_path) as sesh:
+        return {
+            ms.id: {
+                "num_images": ms.num_images,
+                "num_processed_images": ms.num_processed_images,
+                "num_detected_objects": ms.num_detected_objects,
+                "num_moths": ms.num_moths,
+                "num_species": ms.num_species,
+                "start_time": ms.start_time,
+                "end_time": ms.end_time,
+            }
+            for ms in sesh.execute(sa.select(MonitoringSession)).scalars()
+        }
+
+
+def count_totals(db_path):
+    # The slow way, by loading every image and object of each session
+    with get_session(db_path) as sesh:
+        totals = {}
+        for ms in sesh.execute(sa.select(MonitoringSession)).scalars():
+            moths = [
+                obj
+                for obj in ms.detected_objects
+                if obj.binary_label == constants.POSITIVE_BINARY_LABEL
+            ]
+            totals[ms.id] = {
+                "num_images": len(ms.images),
+                "num_processed_images": len(
+                    [img for img in ms.images if img.last_processed]
+                ),
+                "num_detected_objects": len(ms.detected_objects),
+                "num_moths": len(moths),
+                "num_species": len(
+                    {obj.specific_label for obj in moths if obj.specific_label}
+                ),
+                "start_time": ms.images[0].timestamp,
+                "end_time": ms.images[-1].timestamp,
+            }
+        return totals
+
+
+def test_totals_are_updated_on_write():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        db_path = queue.db_path
+        assert get_totals(db_path) == count_totals(db_path)
+
+        image_ids = [image.id for image in queue.pull_n_from_queue(3)]
+        object_ids = save_detected_objects(
+            db_path,
+            image_ids,
+            [[{"bbox": [0, 0, 10, 10]}] * 3 for _ in image_ids],
+            save_crops=False,
+        )
+        assert get_totals(db_path) == count_totals(db_path)
+
+        labels = ["moth", "nonmoth", "moth", "moth", "moth"]
+        species = ["Species A", None, "Species B", "Species A", None]
+        save_classified_objects(
+            db_path,
+            object_ids[: len(labels)],
+            [
+                {"binary_label": label, "specific_label": name}
+                for label, name in zip(labels, species)
+            ],
+        )
+        totals = get_totals(db_path)
+        assert totals == count_totals(db_path)
+        assert sum(ms["num_moths"] for ms in totals.values()) == 4
+        assert sum(ms["num_processed_images"] for ms in totals.values()) == 3
+
+        # Processing an image again, and changing labels
+        save_detected_objects(
+            db_path,
+            image_ids[1:2],
+            [[{"bbox": [0, 0, 10, 10], "binary_label": "moth"}]],
+            save_crops=False,
+        )
+        save_classified_objects(
+            db_path,
+            object_ids[:2],
+            [{"binary_label": "nonmoth"}, {"specific_label": "Species C"}],
+        )
+        totals = get_totals(db_path)
+        assert totals == count_totals(db_path)
+        assert sum(ms["num_processed_images"] for ms in totals.values()) == 3
+        assert sum(ms["num_moths"] for ms in totals.values()) == 4
+
+        delete_objects_for_image(db_path, image_ids[0])
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_images_are_saved_once():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+
+        sessions = get_monitoring_sessions_from_filesystem(images)
+        paths = sorted(
+            pathlib.Path(image["path"])
+            for session in sessions
+            for image in session["images"]
+        )
+
+        def scan():
+            save_monitoring_sessions(db_path, images, sessions)
+            with get_session(db_path) as sesh:
+                return {
+                    image.path: image
+                    for image in sesh.execute(sa.select(TrapImage)).unique().scalars()
+                }
+
+        saved = scan()
+        assert sorted(saved) == [str(path.relative_to(images)) for path in paths]
+        assert all(image.width and image.height for image in saved.values())
+        assert scan().keys() == saved.keys()
+        assert get_totals(db_path) == count_totals(db_path)
+
+        # A replaced file, and a new file
+        with open(paths[0], "ab") as f:
+            f.write(b"0" * 10)
+        shutil.copy(paths[1], paths[1].with_name("copy.jpg"))
+        sessions = get_monitoring_sessions_from_filesystem(images)
+        rescanned = scan()
+        assert len(rescanned) == len(saved) + 1
+        replaced = rescanned[str(paths[0].relative_to(images))]
+        assert replaced.id == saved[replaced.path].id
+        assert replaced.filesize == saved[replaced.path].filesize + 10
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_objects_move_with_their_images():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+        rescan_deployment(db_path, images)
+
+        path = images / "denmark" / "20220810232637-00-16.jpg"
+        with get_session(db_path) as sesh:
+            image_id, ms_id = sesh.execute(
+                sa.select(TrapImage.id, TrapImage.monitoring_session_id).where(
+                    TrapImage.path == str(path.relative_to(images))
+                )
+            ).one()
+        object_ids = save_detected_objects(
+            db_path,
+            [image_id],
+            [[{"bbox": [0, 0, 10, 10]}] * 2],
+            save_crops=False,
+        )
+        save_classified_objects(
+            db_path,
+            object_ids,
+            [{"binary_label": "moth", "specific_label": "Species A"}] * 2,
+        )
+
+        # The clock of the camera was fixed, the image was taken two nights later
+        image = PIL.Image.open(path)
+        image.load()
+        image.save(path, exif=construct_exif(datetime.datetime(2022, 8, 12, 23, 26)))
+        counts = rescan_deployment(db_path, images, full=True, hashes=False)
+        assert counts["changed_images"] == 1
+
+        with get_session(db_path) as sesh:
+            image = sesh.get(TrapImage, image_id)
+            assert image.monitoring_session_id != ms_id
+            assert [obj.monitoring_session_id for obj in image.detected_objects] == [
+                image.monitoring_session_id
+            ] * 2
+        totals = get_totals(db_path)
+        assert totals == count_totals(db_path)
+        assert totals[ms_id]["num_moths"] == 0
+        assert totals[image.monitoring_session_id]["num_species"] == 1
+
+
+def test_saved_images_are_not_read_again():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+        # Saved before deployments had a scan manifest
+        sessions = get_monitoring_sessions_from_filesystem(images)
+        save_monitoring_sessions(db_path, images, sessions)
+        image = images / "denmark" / "20220810232637-00-16.jpg"
+        shutil.copy(image, images / "denmark" / "copy.jpg")
+        counts = rescan_deployment(db_path, images, hashes=False)
+        assert counts["read_images"] == counts["new_images"] == 1
+
+        # Opening the deployment does not hash new images
+        shutil.copy(image, images / "vermont" / "copy.jpg")
+        saved = get_or_create_monitoring_sessions(db_path, images)
+        assert sum(ms.num_images for ms in saved) == len(list(images.glob("*/*.jpg")))
+        with get_session(db_path) as sesh:
+            assert not sesh.execute(
+                sa.select(TrapImage.id).where(TrapImage.content_hash.is_not(None))
+            ).all()
+        assert rescan_deployment(db_path, images)["read_images"] == 0
+        counts = rescan_deployment(db_path, images, full=True)
+        assert counts["duplicate_images"] == 2
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_new_nights_are_found_on_rescan():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+
+        sessions = get_or_create_monitoring_sessions(db_path, images)
+        num_images = sum(ms.num_images for ms in sessions)
+        assert num_images == len(list(images.glob("*/*.jpg")))
+
+        # Nothing has changed
+        counts = rescan_deployment(db_path, images)
+        assert counts["read_images"] == 0
+        assert counts["scanned_directories"] == 0
+        assert len(get_totals(db_path)) == len(sessions)
+
+        # A new night in a new directory, and an image taken during a saved night
+        night = images / "denmark" / "20220901"
+        night.mkdir()
+        image = PIL.Image.open(next(images.glob("denmark/*.jpg")))
+        timestamp = datetime.datetime(2022, 9, 1, 23, 0)
+        image.save(night / "new.jpg", exif=construct_exif(timestamp))
+        shutil.copy(
+            images / "denmark" / "20220810232637-00-16.jpg",
+            images / "denmark" / "copy.jpg",
+        )
+        counts = rescan_deployment(db_path, images)
+        assert counts["read_images"] == 2
+        assert counts["scanned_directories"] == 2
+
+        rescanned = get_monitoring_sessions_from_db(db_path, images)
+        assert len(rescanned) == len(sessions) + 1
+        assert sum(ms.num_images for ms in rescanned) == num_images + 2
+        assert get_totals(db_path) == count_totals(db_path)
+
+        # Reading every image again saves nothing new
+        counts = rescan_deployment(db_path, images, full=True)
+        assert counts["read_images"] == num_images + 2
+        assert len(get_totals(db_path)) == len(rescanned)
+
+
+def test_images_are_grouped_in_order():
+    start = datetime.datetime(2022, 6, 1, 22, tzinfo=datetime.timezone.utc)
+    minutes = [0, 10, 600, 610, 60 * 25, 60 * 25 + 5, 60 * 24 * 3]
+    images = [
+        {"path": f"{i}.jpg", "timestamp": start + datetime.timedelta(minutes=m)}
+        for i, m in enumerate(minutes)
+    ]
+    shuffled = random.Random(1).sample(images, len(images))
+    for chunk_size in [1, 3, 100]:
+        assert list(sort_images_by_time(shuffled, chunk_size)) == images
+
+    # Gaps longer than a day start a new session
+    groups = list(iter_image_groups(images))
+    assert [(day.isoformat(), len(group)) for day, group in groups] == [
+        ("2022-06-01", 2),
+        ("2022-06-02", 2),
+        ("2022-06-02", 2),
+        ("2022-06-04", 1),
+    ]
+    # Sessions that start on the same day are merged
+    groups = group_images_by_day(shuffled)
+    assert {day.isoformat(): len(group) for day, group in groups.items()} == {
+        "2022-06-01": 2,
+        "2022-06-02": 4,
+        "2022-06-04": 1,
+    }
+    assert groups[datetime.date(2022, 6, 2)] == images[2:6]
+
+    # None of the test images are lost
+    test_images = list(scan_images(TEST_IMAGES))
+    groups = group_images_by_day(test_images)
+    assert sum(len(group) for group in groups.values()) == len(test_images)
+
+
+def test_sessions_are_saved_in_batches():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        sessions = iter_monitoring_sessions_from_filesystem(TEST_IMAGES)
+        saved = save_monitoring_sessions(db_path, TEST_IMAGES, sessions, batch_size=2)
+
+        expected = get_monitoring_sessions_from_filesystem(TEST_IMAGES)
+        assert [(ms.day, ms.num_images) for ms in saved] == [
+            (session["day"], session["num_images"]) for session in expected
+        ]
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_new_images_are_queued_while_watching():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+        num_images = len(list(images.glob("*/*.jpg")))
+
+        # Images that may still be being copied are saved by the next scan
+        for path in images.glob("*/*.jpg"):
+            path.touch()
+        counts = rescan_deployment(db_path, images, settle_seconds=3600)
+        assert counts["read_images"] == 0
+        counts = rescan_deployment(db_path, images, queue=True)
+        assert counts["new_images"] == num_images
+        queue = ImageQueue(db_path, images)
+        assert queue.queue_count() == num_images
+
+        watcher = DeploymentWatcher(
+            db_path, images, interval=0.1, queue=True, settle_seconds=0
+        )
+        # Like `ami collect --watch`, after the scan above
+        thread = threading.Thread(target=watcher.run, kwargs={"scan_first": False})
+        thread.start()
+        try:
+            # Saved outside of the directory first, so it is complete once it's in it
+            image = PIL.Image.open(TEST_IMAGES / "denmark" / "20220810232637-00-16.jpg")
+            timestamp = datetime.datetime(2022, 8, 10, 23, 30)
+            new_image = pathlib.Path(directory) / "new.jpg"
+            image.save(new_image, exif=construct_exif(timestamp))
+            new_image.rename(images / "denmark" / "new.jpg")
+            deadline = time.monotonic() + 10
+            while queue.queue_count() == num_images and time.monotonic() < deadline:
+                time.sleep(0.1)
+        finally:
+            watcher.stop()
+            thread.join()
+
+        assert watcher.num_scans >= 1
+        assert queue.queue_count() == num_images + 1
+        with get_session(db_path) as sesh:
+            in_queue = sesh.execute(
+                sa.select(TrapImage.in_queue).where(TrapImage.path == "denmark/new.jpg")
+            ).scalar_one()
+            assert in_queue
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_copies_of_images_are_processed_once():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        # The same SD card copied into two directories
+        first = pathlib.Path(directory) / "first"
+        second = pathlib.Path(directory) / "second"
+        shutil.copytree(TEST_IMAGES, first)
+        shutil.copytree(TEST_IMAGES, second)
+        num_images = len(list(first.glob("*/*.jpg")))
+        path = first / "denmark" / "20220810232637-00-16.jpg"
+        assert hash_file(path) == hash_file(second / path.relative_to(first))
+        assert hash_file(path) != hash_file(next(first.glob("vermont/*.jpg")))
+
+        counts = rescan_deployment(db_path, first, queue=True)
+        assert counts["new_images"] == num_images
+        assert counts["duplicate_images"] == 0
+        counts = rescan_deployment(db_path, second, queue=True)
+        assert counts["new_images"] == num_images
+        assert counts["duplicate_images"] == num_images
+        assert ImageQueue(db_path, first).queue_count() == num_images
+        assert ImageQueue(db_path, second).queue_count() == 0
+        assert ImageQueue(db_path, second).unprocessed_count() == 0
+
+        with get_session(db_path) as sesh:
+            ids = dict(
+                sesh.execute(
+                    sa.select(TrapImage.content_hash, TrapImage.id).where(
+                        TrapImage.base_path == str(first)
+                    )
+                ).all()
+            )
+            copies = sesh.execute(
+                sa.select(TrapImage.content_hash, TrapImage.duplicate_of_id).where(
+                    TrapImage.base_path == str(second)
+                )
+            ).all()
+            assert len(ids) == num_images
+            assert all(ids[content_hash] == id for content_hash, id in copies)
+
+            # The first image was processed, then replaced without changing
+            # its directory
+            image = (
+                sesh.execute(
+                    sa.select(TrapImage).where(
+                        TrapImage.base_path == str(first),
+                        TrapImage.path == str(path.relative_to(first)),
+                    )
+                )
+                .unique()
+                .scalar_one()
+            )
+            image_id = image.id
+            image.last_processed = datetime.datetime.now()
+            image.in_queue = False
+            sesh.add(
+                DetectedObject(
+                    image_id=image.id,
+                    monitoring_session_id=image.monitoring_session_id,
+                    deployment_id=image.deployment_id,
+                )
+            )
+            sesh.commit()
+        timestamp = PIL.Image.open(path).getexif()[0x0132]
+        PIL.Image.new("RGB", (64, 48)).save(
+            path,
+            exif=construct_exif(
+                datetime.datetime.strptime(timestamp, EXIF_DATETIME_STR_FORMAT)
+            ),
+        )
+
+        counts = rescan_deployment(db_path, first, queue=True)
+        assert counts["read_images"] == 0
+        counts = rescan_deployment(db_path, first, full=True, queue=True)
+        assert counts["replaced_images"] == 1
+        assert counts["new_images"] == 0
+        with get_session(db_path) as sesh:
+            image = sesh.get(TrapImage, image_id)
+            assert image.in_queue and not image.last_processed
+            assert not image.detected_objects
+        # The copy of the previous contents is now processed by itself
+        assert ImageQueue(db_path, second).unprocessed_count() == 1
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def test_copies_of_replaced_images_are_queued():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        first = pathlib.Path(directory) / "first"
+        second = pathlib.Path(directory) / "second"
+        shutil.copytree(TEST_IMAGES, first)
+        shutil.copytree(TEST_IMAGES, second)
+        path = first / "denmark" / "20220810232637-00-16.jpg"
+        copy_path = str(path.relative_to(first))
+
+        # Processed without --queue, e.g. from the app
+        rescan_deployment(db_path, first)
+        rescan_deployment(db_path, second)
+        with get_session(db_path) as sesh:
+            image = (
+                sesh.execute(
+                    sa.select(TrapImage).where(
+                        TrapImage.base_path == str(first),
+                        TrapImage.path == copy_path,
+                    )
+                )
+                .unique()
+                .scalar_one()
+            )
+            image_id = image.id
+            image.last_processed = datetime.datetime.now()
+            sesh.commit()
+        assert ImageQueue(db_path, second).unprocessed_count() == 0
+
+        timestamp = PIL.Image.open(path).getexif()[0x0132]
+        PIL.Image.new("RGB", (64, 48)).save(
+            path,
+            exif=construct_exif(
+                datetime.datetime.strptime(timestamp, EXIF_DATETIME_STR_FORMAT)
+            ),
+        )
+        counts = rescan_deployment(db_path, first, full=True)
+        assert counts["replaced_images"] == 1
+
+        with get_session(db_path) as sesh:
+            assert sesh.get(TrapImage, image_id).in_queue
+            copy = (
+                sesh.execute(
+                    sa.select(TrapImage).where(
+                        TrapImage.base_path == str(second),
+                        TrapImage.path == copy_path,
+                    )
+                )
+                .unique()
+                .scalar_one()
+            )
+            assert copy.duplicate_of_id is None
+            assert copy.in_queue
+        assert ImageQueue(db_path, first).queue_count() == 1
+        assert ImageQueue(db_path, second).queue_count() == 1
+
+
+def test_deployments_are_found_by_any_path():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+        num_images = len(list(images.glob("*/*.jpg")))
+        link = pathlib.Path(directory) / "link"
+        link.symlink_to(images)
+
+        assert rescan_deployment(db_path, link)["new_images"] == num_images
+        assert rescan_deployment(db_path, images, full=True)["new_images"] == 0
+        unnormalized = images / "denmark" / ".."
+        assert rescan_deployment(db_path, unnormalized)["new_images"] == 0
+
+        with get_session(db_path) as sesh:
+            deployments = sesh.execute(sa.select(Deployment)).scalars().all()
+        assert [d.base_directory for d in deployments] == [str(images)]
+        for path in [images, link, unnormalized]:
+            assert ImageQueue(db_path, path).deployment_id == deployments[0].id
+            sessions = get_monitoring_sessions_from_db(db_path, path)
+            assert sum(ms.num_images for ms in sessions) == num_images
+
+
+def test_nightly_folders_are_sessions():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "vermont"
+        # An image taken after midnight belongs to the night before
+        nights = {
+            "2022_06_21": ["20220622000459-108-snapshot.jpg"],
+            "2022_06_22": [
+                "20220622200400-01-snapshot.jpg",
+                "20220623043000-215-snapshot.jpg",
+            ],
+        }
+        for night, names in nights.items():
+            (images / night).mkdir(parents=True)
+            for name in names:
+                shutil.copy(TEST_IMAGES / "vermont" / name, images / night / name)
+
+        sessions = get_or_create_monitoring_sessions(
+            db_path, images, timestamps=TimestampSource.filename
+        )
+        assert {ms.day.isoformat(): ms.num_images for ms in sessions} == {
+            "2022-06-21": 1,
+            "2022-06-22": 2,
+        }
+        assert get_totals(db_path) == count_totals(db_path)
+
+        # A new image in a saved night
+        shutil.copy(
+            TEST_IMAGES / "vermont" / "20220623043000-215-snapshot.jpg",
+            images / "2022_06_22" / "20220623043000-216-snapshot.jpg",
+        )
+        rescan_deployment(db_path, images, timestamps=TimestampSource.filename)
+        sessions = get_monitoring_sessions_from_db(db_path, images)
+        assert [ms.num_images for ms in sessions] == [1, 3]
+        assert get_totals(db_path) == count_totals(db_path)
+
+
+def count_image_stats(db_path, image_id):
+    # One query for each count
+    return {
+        "num_objects": get_objects_for_image(db_path, image_id).count(),
+        "num_detections": get_detections_for_image(db_path, image_id).count(),
+        "num_species": get_species_for_image(db_path, image_id).count(),
+        "num_classifications": get_classifications_for_image(db_path, image_id).count(),
+        "completely_classified": completely_classified(db_path, image_id),
+    }
+
+
+def test_image_stats_are_updated_on_write():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        db_path = queue.db_path
+        image_ids = [image.id for image in queue.pull_n_from_queue(2)]
+
+        def assert_stats_match():
+            for image_id in image_ids:
+                expected = count_image_stats(db_path, image_id)
+                assert get_object_counts_for_image(db_path, image_id) == expected
+
+        assert_stats_match()
+        object_ids = save_detected_objects(
+            db_path,
+            image_ids,
+            [[{"bbox": [0, 0, 10, 10]}] * 3 for _ in image_ids],
+            save_crops=False,
+        )
+        assert_stats_match()
+        queue.complete(image_ids)
+        assert_stats_match()
+
+        save_classified_objects(
+            db_path,
+            object_ids,
+            [
+                {"binary_label": "moth", "specific_label": f"Species {i % 2}"}
+                for i, _ in enumerate(object_ids)
+            ],
+        )
+        assert_stats_match()
+        assert get_object_counts_for_image(db_path, image_ids[0]) == {
+            "num_objects": 3,
+            "num_detections": 3,
+            "num_species": 2,
+            "num_classifications": 3,
+            "completely_classified": True,
+        }
+
+        delete_objects_for_image(db_path, image_ids[0])
+        assert_stats_match()
+
+        # Written by another process, which can't remove the cached counts
+        engine = sa.create_engine(db_path)
+        with engine.begin() as connection:
+            connection.execute(
+                sa.delete(DetectedObject).where(DetectedObject.image_id == image_ids[1])
+            )
+        engine.dispose()
+        assert get_object_counts_for_image(db_path, image_ids[1])["num_objects"] == 3
+        time.sleep(detections.IMAGE_STATS_TTL)
+        assert_stats_match()
+
+
+def test_species_summary():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        db_path = queue.db_path
+        image_ids = [image.id for image in queue.pull_n_from_queue(4)]
+        object_ids = save_detected_objects(
+            db_path,
+            image_ids,
+            [
+                [{"bbox": [0, 0, 10 + i, 10 + j]} for j in range(5)]
+                for i, _ in enumerate(image_ids)
+            ],
+            save_crops=False,
+        )
+        species = ["Species A", "Species B", "Species C", None]
+        save_classified_objects(
+            db_path,
+            object_ids,
+            [
+                {
+                    "binary_label": "moth" if i % 5 else "nonmoth",
+                    "specific_label": species[i % 4],
+                    "specific_label_score": (i % 7) / 7,
+                }
+                for i, _ in enumerate(object_ids)
+            ],
+        )
+
+        threshold = 0.3
+        results = queries.classification_results(
+            db_path, classification_threshold=threshold
+        )
+        expected = {}
+        for result in results:
+            expected.setdefault(result["label"], []).append(result)
+
+        summary = queries.summarize_results(
+            db_path, classification_threshold=threshold, num_examples=2
+        )
+        assert [item["count"] for item in summary] == sorted(
+            (len(items) for items in expected.values()), reverse=True
+        )
+        with get_session(db_path) as sesh:
+            query = sa.select(DetectedObject.id, DetectedObject.area_pixels)
+            areas = dict(sesh.execute(query).all())
+        for item in summary:
+            items = expected[item["label"]]
+            assert item["count"] == len(items)
+            assert (
+                abs(item["mean_score"] - statistics.mean(i["score"] for i in items))
+                < 1e-6
+            )
+            # The largest objects of each label
+            largest = sorted(
+                items, key=lambda i: (-areas[i["id"]], -i["score"], i["id"])
+            )
+            assert item["examples"] == largest[:2]
+
+        summary = queries.summarize_results(
+            db_path, classification_threshold=threshold, examples_by="score"
+        )
+        for item in summary:
+            scores = sorted((i["score"] for i in expected[item["label"]]), reverse=True)
+            assert [example["score"] for example in item["examples"]] == scores[:3]
+
+
+def run():
+    logger.info(f"Using test images from: {TEST_IMAGES}")
+    test_totals_are_updated_on_write()
+    test_image_stats_are_updated_on_write()
+    test_species_summary()
+    test_images_are_saved_once()
+    test_objects_move_with_their_images()
+    test_saved_images_are_not_read_again()
+    test_new_nights_are_found_on_rescan()
+    test_nightly_folders_are_sessions()
+    test_images_are_grouped_in_order()
+    test_sessions_are_saved_in_batches()
+    test_new_images_are_queued_while_watching()
+    test_copies_of_images_are_processed_once()
+    test_copies_of_replaced_images_are_queued()
+    test_deployments_are_found_by_any_path()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,191 @@
+import datetime
+import re
+import tempfile
+
+import sqlalchemy as sa
+
+from trapdata import logger
+from trapdata import constants
+from trapdata.db import get_db, get_session
+from trapdata.db.base import get_engine
+from trapdata.db.models.deployments import Deployment
+from trapdata.db.models.events import (
+    MonitoringSession,
+    get_monitoring_sessions_from_db,
+    get_monitoring_session_image_ids,
+    update_session_aggregates,
+)
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import (
+    DetectedObject,
+    get_object_counts_for_image,
+    iter_detection_reports,
+)
+from trapdata.db.models.queue import all_queues, queue_counts
+
+
+NUM_TRAPS = 10
+BASE_DIRECTORY = "/synthetic/trap_1"
+
+# A scan of a whole table, rather than a search or a scan of a (partial) index
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)( AS \w+)?$")
+LARGE_TABLES = ["monitoring_sessions", "images", "detections", "queue_jobs"]
+
+
+def create_synthetic_db(
+    directory, num_sessions=200, images_per_session=100, objects_per_image=5
+):
+    """
+    Create a database that is large enough that the query planner would rather
+    use an index, with a few items in each queue.
+    """
+    db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+    get_db(db_path, create=True)
+    start = datetime.datetime(2022, 6, 1, 22)
+
+    with get_session(db_path) as sesh:
+        sesh.execute(
+            sa.insert(Deployment),
+            [
+                {
+                    "id": i + 1,
+                    "name": f"trap_{i}",
+                    "base_directory": f"/synthetic/trap_{i}",
+                }
+                for i in range(NUM_TRAPS)
+            ],
+        )
+        sesh.execute(
+            sa.insert(MonitoringSession),
+            [
+                {
+                    "id": session_id,
+                    "deployment_id": session_id % NUM_TRAPS + 1,
+                    "base_directory": f"/synthetic/trap_{session_id % NUM_TRAPS}",
+                    "day": (start + datetime.timedelta(days=session_id)).date(),
+                }
+                for session_id in range(1, num_sessions + 1)
+            ],
+        )
+        images = []
+        for session_id in range(1, num_sessions + 1):
+            for i in range(images_per_session):
+                images.append(
+                    {
+                        "id": len(images) + 1,
+                        "monitoring_session_id": session_id,
+                        "deployment_id": session_id % NUM_TRAPS + 1,
+                        "base_path": BASE_DIRECTORY,
+                        "path": f"{session_id}/{i}.jpg",
+                        "timestamp": start + datetime.timedelta(minutes=i),
+                        "last_processed": start if i % 10 else None,
+                        "in_queue": i % 50 == 0,
+                    }
+                )
+        sesh.execute(sa.insert(TrapImage), images)
+        objects = []
+        for image in images:
+            if not image["last_processed"]:
+                continue
+            for i in range(objects_per_image):
+                binary_label = constants.POSITIVE_BINARY_LABEL if i % 2 else "nonmoth"
+                objects.append(
+                    {
+                        "image_id": image["id"],
+                        "monitoring_session_id": image["monitoring_session_id"],
+                        "deployment_id": image["deployment_id"],
+                        "bbox": [0, 0, 10, 10],
+                        "binary_label": binary_label if image["id"] % 7 else None,
+                        "specific_label": f"Species {i}" if image["id"] % 5 else None,
+                        "in_queue": image["id"] % 50 == 0,
+                    }
+                )
+        sesh.execute(sa.insert(DetectedObject), objects)
+        sesh.commit()
+
+    return db_path
+
+
+def run_queries(db_path):
+    """
+    Run the queries of the queues and the playback screen and return the
+    statements that were sent to the database.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    engine = get_engine(db_path)
+    sa.event.listen(engine, "before_cursor_execute", capture)
+    try:
+        for queue in all_queues(db_path, BASE_DIRECTORY).values():
+            queue.queue_count()
+            queue.unprocessed_count()
+            queue.done_count()
+            items = queue.pull_n_from_queue(10)
+            queue.complete([item.id for item in items])
+        queue_counts(db_path)
+        for ms in get_monitoring_sessions_from_db(db_path, BASE_DIRECTORY)[:1]:
+            image_ids = get_monitoring_session_image_ids(db_path, ms)
+            get_object_counts_for_image(db_path, image_ids[0].id)
+            list(iter_detection_reports(db_path, BASE_DIRECTORY, limit=2, page_size=1))
+            # Run after every batch of results is saved
+            with get_session(db_path) as sesh:
+                update_session_aggregates(
+                    sesh,
+                    sa.select(TrapImage.monitoring_session_id)
+                    .where(TrapImage.id.in_([image.id for image in image_ids[:10]]))
+                    .distinct(),
+                )
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", capture)
+
+    return statements
+
+
+def get_full_scans(db_path, statements):
+    full_scans = []
+    with get_engine(db_path).connect() as conn:
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+            for _, _, _, detail in plan:
+                match = FULL_SCAN.match(detail)
+                if match and match.group("table") in LARGE_TABLES:
+                    full_scans.append((detail, statement))
+    return full_scans
+
+
+def check_query_plans(analyze=False):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = create_synthetic_db(directory)
+        if analyze:
+            with get_engine(db_path).begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+
+        statements = run_queries(db_path)
+        assert statements
+        full_scans = get_full_scans(db_path, statements)
+        for detail, statement in full_scans:
+            logger.error(f"{detail} in query:\n{statement}")
+        assert not full_scans, f"{len(full_scans)} queries scan a whole table"
+
+
+def test_query_plans():
+    check_query_plans()
+
+
+def test_query_plans_with_statistics():
+    check_query_plans(analyze=True)
+
+
+def run():
+    test_query_plans()
+    test_query_plans_with_statistics()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,224 @@
+import pathlib
+import tempfile
+import threading
+
+import sqlalchemy as sa
+
+from trapdata import logger
+from trapdata.db import get_db, get_session
+from trapdata.db.models.events import get_or_create_monitoring_sessions
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import (
+    save_detected_objects,
+    save_classified_objects,
+)
+from trapdata.db.models.queue import (
+    ImageQueue,
+    DetectedObjectQueue,
+    UnclassifiedObjectQueue,
+    QueueJob,
+    JobState,
+    add_image_to_queue,
+)
+
+
+TEST_IMAGES = pathlib.Path(__file__).parent / "images"
+
+
+def get_queue(directory):
+    db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+    get_db(db_path, create=True)
+    get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+    queue = ImageQueue(db_path, TEST_IMAGES)
+    queue.add_unprocessed()
+    return queue
+
+
+def get_jobs(queue):
+    with get_session(queue.db_path) as sesh:
+        return sesh.execute(sa.select(QueueJob)).scalars().all()
+
+
+def test_leases_are_exclusive():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        num_queued = queue.queue_count()
+
+        first = [image.id for image in queue.pull_n_from_queue(2)]
+        second = [image.id for image in queue.pull_n_from_queue(2)]
+        assert len(first) == len(second) == 2
+        assert not set(first) & set(second)
+
+        # Leased items stay in the queue until they are completed
+        assert queue.queue_count() == num_queued
+        queue.complete(first)
+        assert queue.queue_count() == num_queued - 2
+
+        remaining = queue.pull_n_from_queue(num_queued)
+        assert len(remaining) == num_queued - 4
+        assert not queue.pull_n_from_queue(1)
+
+
+def test_expired_leases_are_reclaimed():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        queue.lease_seconds = -1  # Every lease has expired by the next pull
+        queue.max_attempts = 2
+
+        first = [image.id for image in queue.pull_n_from_queue(1)]
+        second = [image.id for image in queue.pull_n_from_queue(1)]
+        assert first == second
+
+        # Give up after too many attempts
+        third = [image.id for image in queue.pull_n_from_queue(1)]
+        assert third != first
+        failed = [job for job in get_jobs(queue) if job.state == JobState.failed]
+        assert [job.item_id for job in failed] == first
+        assert failed[0].attempts == 2
+        with get_session(queue.db_path) as sesh:
+            assert not sesh.get(TrapImage, first[0]).in_queue
+
+
+def test_clear_queue():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        queue.complete([image.id for image in queue.pull_n_from_queue(1)])
+        queue.pull_n_from_queue(1)
+
+        queue.clear_queue()
+        assert queue.queue_count() == 0
+        assert not queue.pull_n_from_queue(1)
+        assert [job.state for job in get_jobs(queue)] == [JobState.leased]
+
+
+def test_jobs_are_added_for_new_items():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        num_queued = queue.queue_count()
+        calls = []
+
+        class CountingQueue(ImageQueue):
+            def add_jobs(self, sesh):
+                calls.append(self.key)
+                super().add_jobs(sesh)
+
+        queue = CountingQueue(queue.db_path, TEST_IMAGES)
+        image_ids = [image.id for image in queue.pull_n_from_queue(num_queued)]
+        assert len(calls) == 1
+        queue.complete(image_ids)
+        # Completed jobs are not kept
+        assert not get_jobs(queue)
+
+        # The queue hasn't changed since the jobs were added
+        assert not queue.pull_n_from_queue(1)
+        assert len(calls) == 1
+
+        add_image_to_queue(queue.db_path, image_ids[0])
+        assert [image.id for image in queue.pull_n_from_queue(2)] == image_ids[:1]
+        assert len(calls) == 2
+
+
+def assert_counters_match(queues):
+    for queue in queues:
+        with get_session(queue.db_path) as sesh:
+            counts = queue.count_states(sesh, deployment_id=queue.deployment_id)
+        expected = counts.get(queue.deployment_id)
+        expected = expected or {"waiting": 0, "leased": 0, "done": 0, "unprocessed": 0}
+        assert queue.get_counter() == expected, f"{queue.name}: {expected}"
+
+
+def test_counters():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        queues = [
+            queue,
+            DetectedObjectQueue(queue.db_path, TEST_IMAGES),
+            UnclassifiedObjectQueue(queue.db_path, TEST_IMAGES),
+        ]
+        num_images = queue.queue_count()
+        assert queue.unprocessed_count() == num_images
+        assert queues[1].queue_count() == queues[2].queue_count() == 0
+
+        image_ids = [image.id for image in queue.pull_n_from_queue(3)]
+        assert_counters_match(queues)
+        object_ids = save_detected_objects(
+            queue.db_path,
+            image_ids,
+            [[{"bbox": [0, 0, 10, 10]}] * 2 for _ in image_ids],
+            save_crops=False,
+        )
+        queue.complete(image_ids)
+        assert queue.queue_count() == num_images - 3
+        assert queue.done_count() == 3
+        assert queues[1].queue_count() == len(object_ids)
+        assert_counters_match(queues)
+
+        objects = queues[1].pull_n_from_queue(4)
+        save_classified_objects(
+            queue.db_path,
+            [obj.id for obj in objects],
+            [
+                {"binary_label": label, "in_queue": label == "moth"}
+                for label in ["moth", "nonmoth", "moth", "nonmoth"]
+            ],
+        )
+        queues[1].complete([obj.id for obj in objects])
+        assert queues[1].done_count() == 4
+        assert queues[2].queue_count() == 2
+        assert_counters_match(queues)
+
+        queue.lease_seconds = -1
+        queue.pull_n_from_queue(2)
+        queue.pull_n_from_queue(1)  # Reclaims the expired leases first
+        assert_counters_match(queues)
+
+        queue.clear_queue()
+        assert queue.queue_count() == 0
+        assert_counters_match(queues)
+
+
+def test_counters_are_not_lost_while_counting():
+    with tempfile.TemporaryDirectory() as directory:
+        queue = get_queue(directory)
+        num_queued = queue.queue_count()
+        queue.pull_n_from_queue(1)
+        threads = []
+
+        class SlowQueue(ImageQueue):
+            @classmethod
+            def count_states(cls, sesh, item_ids=None, deployment_id=None):
+                counts = super().count_states(sesh, item_ids, deployment_id)
+                if deployment_id is not None and not threads:
+                    # Another worker leases and completes items while the
+                    # missing counter is being counted
+                    def work():
+                        other = ImageQueue(queue.db_path, TEST_IMAGES)
+                        other.complete([item.id for item in other.pull_n_from_queue(2)])
+
+                    threads.append(threading.Thread(target=work))
+                    threads[0].start()
+                    threads[0].join(timeout=0.5)
+                return counts
+
+        slow_queue = SlowQueue(queue.db_path, TEST_IMAGES)
+        with get_session(queue.db_path) as sesh:
+            slow_queue.clear_counter(sesh)
+            sesh.commit()
+        slow_queue.get_counter()
+        threads[0].join()
+        assert queue.queue_count() == num_queued - 2
+        assert_counters_match([queue])
+
+
+def run():
+    logger.info(f"Using test images from: {TEST_IMAGES}")
+    test_leases_are_exclusive()
+    test_expired_leases_are_reclaimed()
+    test_clear_queue()
+    test_jobs_are_added_for_new_items()
+    test_counters()
+    test_counters_are_not_lost_while_counting()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,335 @@
+import configparser
+import datetime
+import pathlib
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import PIL.Image
+import sqlalchemy as sa
+import torch
+
+from trapdata import constants, ml, pipeline
+from trapdata.common.filemanagement import construct_exif
+from trapdata.db import get_db, get_session
+from trapdata.db.models.detections import DetectedObject
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.queue import DetectedObjectQueue
+from trapdata.db.models.scans import DeploymentWatcher, rescan_deployment
+from trapdata.ml.models.classification import (
+    BinaryClassifier,
+    Resnet50Classifier,
+    SpeciesClassifier,
+)
+from trapdata.ml.models.localization import ObjectDetector
+from trapdata.pipeline import run_stage, start_pipeline
+from trapdata.tests.test_monitoring_sessions import count_totals, get_totals
+from trapdata.tests.test_queue import TEST_IMAGES
+
+
+class StubDetectorModel(torch.nn.Module):
+    """
+    Find the same two objects in every image.
+    """
+
+    def forward(self, images):
+        return [[[0, 0, 20, 20], [10, 10, 40, 30]] for _ in images]
+
+
+class StubClassifierModel(torch.nn.Module):
+    """
+    Give the first label to every image.
+    """
+
+    def __init__(self, num_classes):
+        super().__init__()
+        self.num_classes = num_classes
+
+    def forward(self, images):
+        scores = torch.zeros(len(images), self.num_classes)
+        scores[:, 0] = 1
+        return scores
+
+
+class StubObjectDetector(ObjectDetector):
+    name = "Stub object detector"
+
+    def get_model(self):
+        return StubDetectorModel()
+
+
+class StubBinaryClassifier(BinaryClassifier):
+    name = "Stub binary classifier"
+    input_size = 32
+
+    def get_labels(self, labels_path):
+        return {0: constants.POSITIVE_BINARY_LABEL, 1: constants.NEGATIVE_BINARY_LABEL}
+
+    def get_model(self):
+        return StubClassifierModel(len(self.category_map))
+
+
+class FailingBinaryClassifier(StubBinaryClassifier):
+    name = "Failing stub binary classifier"
+
+    def predict_batch(self, batch):
+        raise RuntimeError("Stub classifier failed")
+
+
+class StubSpeciesClassifier(SpeciesClassifier, Resnet50Classifier):
+    name = "Stub species classifier"
+    input_size = 32
+
+    def get_labels(self, labels_path):
+        return {0: "Stub species", 1: "Other stub species"}
+
+    def get_model(self):
+        return StubClassifierModel(len(self.category_map))
+
+
+class StubStage:
+    """
+    Stands in for the model of a stage in `run_stage`. It takes one batch from
+    the previous stage, then fails.
+    """
+
+    name = "Stub stage"
+    dataset = None
+
+    def __init__(self, input_queue, results_queue):
+        self.input_queue = input_queue
+        self.results_queue = results_queue
+
+    def run(self):
+        self.input_queue.get()
+        raise RuntimeError("Stub stage failed")
+
+
+def get_config(
+    user_data_path,
+    pipeline_mode="sequential",
+    binary_classifier=StubBinaryClassifier,
+):
+    """
+    Config for the pipeline that uses the stub models, which need no weights.
+    """
+    ml.models.object_detectors[StubObjectDetector.name] = StubObjectDetector
+    ml.models.binary_classifiers[binary_classifier.name] = binary_classifier
+    ml.models.species_classifiers[StubSpeciesClassifier.name] = StubSpeciesClassifier
+
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "paths": {"user_data_path": str(user_data_path)},
+            "models": {
+                "localization_model": StubObjectDetector.name,
+                "binary_classification_model": binary_classifier.name,
+                "taxon_classification_model": StubSpeciesClassifier.name,
+            },
+            "performance": {
+                "num_workers": "0",
+                "localization_batch_size": "1",
+                "classification_batch_size": "4",
+                "pipeline_mode": pipeline_mode,
+            },
+        }
+    )
+    return config
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return condition()
+
+
+def count_unclassified(db_path):
+    with get_session(db_path) as sesh:
+        num_images = sesh.execute(
+            sa.select(sa.func.count(TrapImage.id)).where(
+                TrapImage.last_processed.is_(None)
+            )
+        ).scalar_one()
+        num_objects = sesh.execute(
+            sa.select(sa.func.count(DetectedObject.id)).where(
+                DetectedObject.specific_label.is_(None)
+            )
+        ).scalar_one()
+        return num_images + num_objects
+
+
+def test_failed_stages_keep_accepting_items():
+    input_queue = queue.Queue(maxsize=1)
+    results_queue = queue.Queue(maxsize=1)
+    num_batches = 5
+
+    def produce():
+        for i in range(num_batches):
+            input_queue.put([i])
+        input_queue.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    stop_polling = threading.Event()
+    try:
+        run_stage(StubStage(input_queue, results_queue), stop_polling)
+    except RuntimeError as e:
+        assert str(e) == "Stub stage failed"
+    else:
+        assert False, "The error of the stage was not raised"
+    # The previous stage was not left waiting on the full queue
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert input_queue.empty()
+    assert stop_polling.is_set()
+    # And the next stage is told that nothing else is coming
+    assert results_queue.get_nowait() is None
+
+
+def test_failed_stages_stop_the_pipeline():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        num_images = rescan_deployment(db_path, TEST_IMAGES, queue=True)["new_images"]
+        config = get_config(
+            directory,
+            pipeline_mode="streaming",
+            binary_classifier=FailingBinaryClassifier,
+        )
+
+        def run_pipeline(errors, **kwargs):
+            try:
+                start_pipeline(db_path, TEST_IMAGES, config, single=True, **kwargs)
+            except Exception as e:
+                errors.append(e)
+
+        # More batches of detections than fit in the queue between the stages
+        queue_size = pipeline.STREAMING_QUEUE_SIZE
+        pipeline.STREAMING_QUEUE_SIZE = 1
+        try:
+            errors = []
+            thread = threading.Thread(target=run_pipeline, args=(errors,))
+            thread.start()
+            thread.join(timeout=30)
+            assert not thread.is_alive()
+            assert [str(e) for e in errors] == ["Stub classifier failed"]
+
+            # The object detector processed every image
+            assert count_unclassified(db_path) == num_images * 2
+            # The objects remain in the queue for the next run
+            objects = DetectedObjectQueue(db_path, TEST_IMAGES)
+            assert objects.queue_count() == num_images * 2
+
+            # The object detector stops waiting for new images
+            errors = []
+            stop_polling = threading.Event()
+            thread = threading.Thread(
+                target=run_pipeline,
+                args=(errors,),
+                kwargs=dict(stop_polling=stop_polling, poll_interval=0.1),
+            )
+            thread.start()
+            thread.join(timeout=30)
+            assert not thread.is_alive()
+            assert [str(e) for e in errors] == ["Stub classifier failed"]
+            assert stop_polling.is_set()
+        finally:
+            pipeline.STREAMING_QUEUE_SIZE = queue_size
+
+
+def test_new_images_are_processed_while_watching():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+        get_db(db_path, create=True)
+        images = pathlib.Path(directory) / "images"
+        shutil.copytree(TEST_IMAGES, images)
+        num_images = len(list(images.glob("*/*.jpg")))
+        rescan_deployment(db_path, images, queue=True)
+        # Objects left in the queue by a previous run are classified while
+        # the object detector waits for new images
+        StubObjectDetector(
+            db_path=db_path,
+            image_base_path=images,
+            user_data_path=directory,
+            batch_size=1,
+        ).run()
+        assert count_unclassified(db_path) == num_images * 2
+
+        config = get_config(directory)
+        stop_polling = threading.Event()
+        results = []
+        pipeline = threading.Thread(
+            target=lambda: results.append(
+                start_pipeline(
+                    db_path,
+                    images,
+                    config,
+                    single=True,
+                    stop_polling=stop_polling,
+                    poll_interval=0.1,
+                )
+            )
+        )
+        watcher = DeploymentWatcher(
+            db_path, images, interval=0.1, queue=True, settle_seconds=0
+        )
+        watching = threading.Thread(target=watcher.run)
+        pipeline.start()
+        watching.start()
+        try:
+            assert wait_for(lambda: count_unclassified(db_path) == 0)
+            # The pipeline keeps waiting once the queue is empty
+            time.sleep(0.5)
+            assert pipeline.is_alive()
+
+            # Saved outside of the directory first, so it is complete once it's in it
+            image = PIL.Image.open(TEST_IMAGES / "denmark" / "20220810232637-00-16.jpg")
+            timestamp = datetime.datetime(2022, 8, 10, 23, 30)
+            new_image = pathlib.Path(directory) / "new.jpg"
+            image.save(new_image, exif=construct_exif(timestamp))
+            new_image.rename(images / "denmark" / "new.jpg")
+            assert wait_for(
+                lambda: get_totals(db_path) == count_totals(db_path)
+                and count_unclassified(db_path) == 0
+                and sum(ms["num_images"] for ms in get_totals(db_path).values())
+                == num_images + 1
+            )
+        finally:
+            stop_polling.set()
+            watcher.stop()
+            watching.join()
+            pipeline.join(timeout=20)
+
+        assert not pipeline.is_alive()
+        # Every stage ran until it was stopped
+        assert [stage["stage"] for stage in results[0]] == [
+            StubObjectDetector.name,
+            StubBinaryClassifier.name,
+            StubSpeciesClassifier.name,
+        ]
+        with get_session(db_path) as sesh:
+            image = (
+                sesh.execute(
+                    sa.select(TrapImage).where(TrapImage.path == "denmark/new.jpg")
+                )
+                .unique()
+                .scalar_one()
+            )
+            assert image.last_processed and not image.in_queue
+            assert [obj.specific_label for obj in image.detected_objects] == [
+                "Stub species",
+                "Stub species",
+            ]
+
+
+def run():
+    test_failed_stages_keep_accepting_items()
+    test_failed_stages_stop_the_pipeline()
+    test_new_images_are_processed_while_watching()
+
+
+if __name__ == "__main__":
+    run()
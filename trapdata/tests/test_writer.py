@@ -0,0 +1,90 @@
+import pathlib
+import tempfile
+
+import sqlalchemy as sa
+
+from trapdata import logger
+from trapdata.db import get_db, get_session
+from trapdata.db.models.events import get_or_create_monitoring_sessions
+from trapdata.db.models.images import TrapImage
+from trapdata.db.models.detections import (
+    DetectedObject,
+    save_detected_objects,
+    save_classified_objects,
+)
+from trapdata.db.writer import DatabaseWriter, DatabaseWriterError
+
+
+TEST_IMAGES = pathlib.Path(__file__).parent / "images"
+
+
+def get_image_ids(directory):
+    db_path = f"sqlite+pysqlite:///{directory}/trapdata.db"
+    get_db(db_path, create=True)
+    get_or_create_monitoring_sessions(db_path, TEST_IMAGES)
+    with get_session(db_path) as sesh:
+        image_ids = sesh.execute(sa.select(TrapImage.id)).scalars().all()
+    return db_path, image_ids
+
+
+def test_writes_are_grouped():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path, image_ids = get_image_ids(directory)
+        # A long interval, so only the size or a flush ends a transaction
+        with DatabaseWriter(db_path, flush_interval=60, flush_size=4) as writer:
+            object_ids = save_detected_objects(
+                db_path,
+                image_ids,
+                [[{"bbox": [0, 0, 10, 10]}] for _ in image_ids],
+                save_crops=False,
+                writer=writer,
+            )
+            assert len(object_ids) == len(image_ids)
+            for object_id in object_ids:
+                save_classified_objects(
+                    db_path, [object_id], [{"binary_label": "moth"}], writer=writer
+                )
+
+        assert writer.num_writes == len(image_ids) + 1
+        assert writer.num_transactions < writer.num_writes
+        # Everything was committed when the writer stopped
+        with get_session(db_path) as sesh:
+            labels = sesh.execute(sa.select(DetectedObject.binary_label)).scalars()
+            assert list(labels) == ["moth" for _ in image_ids]
+
+
+def test_failed_writes_stop_the_writer():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path, _ = get_image_ids(directory)
+        writer = DatabaseWriter(db_path, flush_interval=60).start()
+        writer.submit(sa.orm.Session.execute, sa.text("SELECT * FROM missing"))
+        try:
+            writer.flush()
+        except sa.exc.OperationalError:
+            pass
+        else:
+            raise AssertionError("The write did not fail")
+
+        try:
+            writer.submit(sa.orm.Session.execute, sa.text("SELECT 1"))
+        except DatabaseWriterError:
+            pass
+        else:
+            raise AssertionError("The writer accepted a write after a failure")
+
+        try:
+            writer.stop()
+        except DatabaseWriterError:
+            pass
+        else:
+            raise AssertionError("Stopping the writer did not report the failure")
+
+
+def run():
+    logger.info(f"Using test images from: {TEST_IMAGES}")
+    test_writes_are_grouped()
+    test_failed_writes_stop_the_writer()
+
+
+if __name__ == "__main__":
+    run()
@@ -33,7 +33,9 @@ from trapdata.db.models.events import (
     get_monitoring_sessions_from_db,
     export_monitoring_sessions,
 )
-from trapdata.db.models.detections import get_detected_objects, export_detected_objects
+from trapdata.db.models.detections import iter_detection_reports
+from trapdata.common.utils import report_filepath, write_report
+from trapdata.db.base import configure_sqlite
 from trapdata.db.models.queue import clear_all_queues
 from trapdata.pipeline import start_pipeline
 
@@ -207,6 +209,13 @@ class TrapDataApp(App):
         """
         self.app_settings = Settings(_env_file=None)  # noqa
         print(self.app_settings)
+        configure_sqlite(
+            journal_mode=self.app_settings.sqlite_journal_mode,
+            synchronous=self.app_settings.sqlite_synchronous,
+            mmap_size_mb=self.app_settings.sqlite_mmap_size_mb,
+            cache_size_mb=self.app_settings.sqlite_cache_size_mb,
+            busy_timeout=self.app_settings.sqlite_busy_timeout,
+        )
 
     def on_config_change(self, config, section, key, value):
         if key == "image_base_path":
@@ -251,6 +260,7 @@ class TrapDataApp(App):
             "paths",
             {
                 "image_base_path": "",  # Using None here gets converted into a string
+                "image_timestamps": "exif",
                 "user_data_path": self.user_data_dir,
                 "database_url": default_db_connection_string,
             },
@@ -276,6 +286,15 @@ class TrapDataApp(App):
                 "localization_batch_size": 2,
                 "classification_batch_size": 20,
                 "num_workers": 1,
+                "pipeline_mode": "sequential",
+                "save_crops": 1,
+                "sqlite_journal_mode": "wal",
+                "sqlite_synchronous": "normal",
+                "sqlite_mmap_size_mb": 256,
+                "sqlite_cache_size_mb": 64,
+                "sqlite_busy_timeout": 10,
+                "writer_flush_interval": 0.05,
+                "writer_flush_size": 50,
             },
         )
         # config.write()
@@ -347,30 +366,26 @@ class TrapDataApp(App):
             size=("550dp", "220dp"),
         ).open()
 
-    def export_detections(self, detected_objects=None, report_name=None):
+    def export_detections(self, monitoring_session=None, report_name=None):
         """
         User initiated export of Detected Objects with a pop-up.
         """
         app = self
         user_data_path = app.config.get("paths", "user_data_path")
-        objects = list(
-            detected_objects
-            or get_detected_objects(
-                db_path=app.db_path, image_base_path=app.image_base_path
-            )
+        records = iter_detection_reports(
+            db_path=app.db_path,
+            image_base_path=app.image_base_path,
+            monitoring_session=monitoring_session,
         )
         timestamp = int(time.time())
         trap = pathlib.Path(app.image_base_path).name
         report_name = report_name or f"{trap}-all-detections-{timestamp}"
-        filepath = export_detected_objects(
-            items=objects,
-            directory=user_data_path,
-            report_name=report_name,
-        )
-        if filepath:
+        filepath = report_filepath(user_data_path, report_name)
+        num_records = write_report(records, filepath)
+        if num_records:
             logger.info(f"Exported detections to {filepath}")
             msg = (
-                f"{len(objects)} detected objects have been exported to: \n\n"
+                f"{num_records} detected objects have been exported to: \n\n"
                 f'"{filepath.name}" \n\n'
                 f"In the directory: \n{filepath.parent} \n"
             )
@@ -24,6 +24,7 @@ from plyer import filechooser
 from trapdata import logger
 from trapdata import db
 from trapdata import TrapImage
+from trapdata.common.filemanagement import TimestampSource
 from trapdata.db.models.queue import add_monitoring_session_to_queue
 from trapdata.db.models.events import get_or_create_monitoring_sessions
 
@@ -291,7 +292,13 @@ class DataMenuScreen(Screen):
 
     def get_monitoring_sessions(self, *args):
         sessions = get_or_create_monitoring_sessions(
-            self.app.db_path, self.image_base_path
+            self.app.db_path,
+            self.image_base_path,
+            timestamps=TimestampSource(
+                self.app.config.get(
+                    "paths", "image_timestamps", fallback=TimestampSource.exif
+                )
+            ),
         )
         logger.info(
             f"Found {len(sessions)} monitoring sessions with base_path: {self.image_base_path}"
@@ -15,7 +15,6 @@ from kivy.clock import Clock
 from trapdata import logger
 from trapdata import constants
 from trapdata.db import queries
-from trapdata.db.models.detections import get_detected_objects, export_detected_objects
 
 
 Builder.load_file(str(pathlib.Path(__file__).parent / "summary.kv"))
@@ -185,14 +184,9 @@ class SpeciesSummaryScreen(Screen):
     def export(self):
         app = App.get_running_app()
         if app:
-            records = list(
-                get_detected_objects(
-                    db_path=app.db_path,
-                    image_base_path=app.image_base_path,
-                    monitoring_session=self.monitoring_session,
-                )
-            )
             timestamp = int(time.time())
             trap = pathlib.Path(app.image_base_path).name
             report_name = f"{trap}-detections-for-{self.monitoring_session.day.strftime('%Y-%m-%d')}-created-{timestamp}"
-            app.export_detections(detected_objects=records, report_name=report_name)
+            app.export_detections(
+                monitoring_session=self.monitoring_session, report_name=report_name
+            )